@@ -1,68 +1,107 @@
 import re
-import time
-import datetime
 import numpy as np
-import pandas as pd
-import pyqtgraph as pg
 import PyQt5.QtWidgets as QtW
 import PyQt5.QtCore as QtC
 import drawer_and_up
 
-
-def timestamps_from_dates(array):
-    to_ret = []
-    for dt in array:
-        if "/" in dt:
-            pattern = "%d/%m/%Y %H:%M"
-        else:
-            pattern = "%Y-%m-%d %H:%M:%S"
-        to_ret.append(time.mktime(datetime.datetime.strptime(dt, pattern).timetuple()))
-    return to_ret
-
-
-def date_from_timestamp(value):
-    pattern = "%d/%m/%Y %H:%M"
-    res = datetime.datetime.fromtimestamp(value).strftime(pattern)
-    return res
-
-
-def reformat_dates(value):
-    ts = timestamps_from_dates([value])
-    date = date_from_timestamp(ts[0])
-    return date
+# через сколько миллисекунд после последнего сдвига графика догружаются страницы базы
+PAGE_DELAY_MS = 200
 
 
 class MainWindow(QtW.QWidget):
-
-    def __init__(self, config_dict):
+    """
+    Главное окно. Строится в два шага: init_ui создаёт и показывает лёгкие виджеты (кнопки, вкладки, таблицу
+    без модели), finish_ui — всё, что требует pandas и pyqtgraph (модель таблицы, график, легенду).
+    При deferred=True второй шаг вызывает сам запускающий код, после первой отрисовки окна (см. main.py).
+    """
+    def __init__(self, config_dict, deferred=False):
         super().__init__()
         self.config_dict = config_dict
+        drawer_and_up.instrument.configure(config_dict.get("Instrumentation"))
         self.table = None
+        self.table_model = None
         self.plot = None
+        self.plot_placeholder = None
+        self.legend_placeholder = None
+        self.ready = False
         self.file_title = None
         self.df = None
-        self.file_keeper = drawer_and_up.filehandler.FileHandler("no_path/nowhere.np", config_dict)
+        self.file_keeper = None
+        self.loader = None
+        # идёт потоковая загрузка: показана часть нового файла, правка запрещена
+        self.streaming = False
+        self.df_before_loading = None
+        # фоновое сохранение; повторный запрос во время записи выполняется после её окончания
+        self.saver = None
+        self.save_requested = False
+        self.autosave_timer = None
+        # догрузка страниц базы после того, как график перестали двигать (Table :: PageDays)
+        self.page_timer = None
+        # опрос показанного CSV на строки, дописанные другими программами (Table :: Watch)
+        self.watch_timer = None
+        # приём показаний мониторов через локальный сокет (Ingest :: Address) и их выдача окну Ingest :: RateHz
+        # раз в секунду
+        self.ingest = None
+        self.ingest_timer = None
+        # перерисовки таблицы и графика после правок собираются и выполняются одним вызовом apply_redraw
+        self.redraw = drawer_and_up.redraw.RedrawScheduler(
+            self.apply_redraw, config_dict["PlotWidget"].get("RedrawMs", drawer_and_up.redraw.DEFAULT_INTERVAL_MS),
+            self)
+        # открытые, но не показанные сейчас пациенты; вкладки patient_tabs хранят пути всех открытых файлов
+        self.workspace = None
+        self.patient_tabs = None
         self.scatter_plots = dict()
+        self.series_data = dict()
         self.line_plots = dict()
+        self.button_open_file = None
+        self.button_new_file = None
+        self.button_default_view = None
         self.button_add_row = None
         self.button_delete_row = None
         self.button_save_changes = None
-        self.chosen_points = list()
+        self.highlights = dict()
+        # индекс строка -> (серия, номер точки); обратное соответствие хранится в self.series_data
+        self.series_of_row = np.empty(0, dtype=np.int64)
+        self.point_of_row = np.empty(0, dtype=np.int64)
         self.init_ui()
+        if not deferred:
+            self.finish_ui()
 
     def init_ui(self):
-        button_open_file = QtW.QPushButton('Open Table')
-        button_open_file.clicked.connect(self.get_text_file)
-        button_new_file = QtW.QPushButton('Create Table')
-        button_new_file.clicked.connect(self.create_text_file)
+        # кнопки, которым нужна модель таблицы или график, включаются в finish_ui
+        self.button_open_file = QtW.QPushButton('Open Table')
+        self.button_open_file.clicked.connect(self.get_text_file)
+        self.button_open_file.setEnabled(False)
+        self.button_new_file = QtW.QPushButton('Create Table')
+        self.button_new_file.clicked.connect(self.create_text_file)
+        self.button_new_file.setEnabled(False)
         self.button_save_changes = QtW.QPushButton('Save changes')
         self.button_save_changes.clicked.connect(self.save_changes)
         self.button_save_changes.setEnabled(False)
         self.button_save_changes.setStyleSheet("background-color: lightgray")
+        self.autosave_timer = QtC.QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.page_timer = QtC.QTimer(self)
+        self.page_timer.setSingleShot(True)
+        self.page_timer.setInterval(PAGE_DELAY_MS)
+        self.page_timer.timeout.connect(self.load_visible_pages)
+        self.watch_timer = QtC.QTimer(self)
+        self.watch_timer.timeout.connect(self.check_appended)
+        self.ingest_timer = QtC.QTimer(self)
+        self.ingest_timer.timeout.connect(self.deliver_readings)
+
+        self.patient_tabs = QtW.QTabBar()
+        self.patient_tabs.setTabsClosable(True)
+        self.patient_tabs.setExpanding(False)
+        self.patient_tabs.currentChanged.connect(self.patient_selected)
+        self.patient_tabs.tabCloseRequested.connect(self.close_patient)
 
         self.file_title = QtW.QLabel("Patient name")
-        button_default_view = QtW.QPushButton("Default view")
-        button_default_view.clicked.connect(self.set_default_view)
+        self.button_default_view = QtW.QPushButton("Default view")
+        # без аргумента checked сигнала clicked (set_default_view обёрнут instrument.timed)
+        self.button_default_view.clicked.connect(lambda: self.set_default_view())
+        self.button_default_view.setEnabled(False)
 
         self.button_add_row = QtW.QPushButton('Add new row')
         self.button_add_row.clicked.connect(self.add_new_row)
@@ -71,26 +110,33 @@ class MainWindow(QtW.QWidget):
         self.button_delete_row.clicked.connect(self.delete_row)
         self.button_delete_row.setEnabled(False)
 
-        self.table = pg.TableWidget(editable=True, sortable=False)
-        self.table.cellChanged.connect(self.table_changed)
-        self.table.itemSelectionChanged.connect(self.table_clicked)
+        self.table = QtW.QTableView()
+        self.table.setSelectionBehavior(QtW.QAbstractItemView.SelectRows)
+        # одинаковая высота строк: представлению не нужно измерять все строки таблицы
+        self.table.verticalHeader().setSectionResizeMode(QtW.QHeaderView.Fixed)
+        self.table.horizontalHeader().setResizeContentsPrecision(100)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        # valueChanged не годится: его вызывает и сброс модели после догрузки
+        self.table.verticalScrollBar().actionTriggered.connect(self.table_scrolled)
 
-        self.plot = drawer_and_up.pyqtdrawer.Plotter(self.config_dict["PlotWidget"])
-        self.draw_plot()
-        legend_plot = drawer_and_up.pyqtdrawer.LegendPlotter(self.config_dict["Plot"]["PointsStyle"])
+        # место графика и легенды до finish_ui
+        self.plot_placeholder = QtW.QLabel("Loading...")
+        self.plot_placeholder.setAlignment(QtC.Qt.AlignCenter)
+        self.legend_placeholder = QtW.QWidget()
 
         grid = QtW.QGridLayout()
         grid.setSpacing(10)
-        grid.addWidget(button_open_file, 1, 0)
-        grid.addWidget(button_new_file, 1, 1)
+        grid.addWidget(self.patient_tabs, 0, 0, 1, 9)
+        grid.addWidget(self.button_open_file, 1, 0)
+        grid.addWidget(self.button_new_file, 1, 1)
         grid.addWidget(self.button_save_changes, 1, 2)
         grid.addWidget(self.file_title, 2, 0, 1, 1)
-        grid.addWidget(button_default_view, 2, 2)
+        grid.addWidget(self.button_default_view, 2, 2)
         grid.addWidget(self.button_add_row, 3, 0)
         grid.addWidget(self.button_delete_row, 3, 1)
         grid.addWidget(self.table, 4, 0, 10, 3)
-        grid.addWidget(self.plot.pw, 1, 3, 12, 6)
-        grid.addWidget(legend_plot.pw, 13, 3, 1, 6)
+        grid.addWidget(self.plot_placeholder, 1, 3, 12, 6)
+        grid.addWidget(self.legend_placeholder, 13, 3, 1, 6)
 
         self.setLayout(grid)
 
@@ -98,74 +144,242 @@ class MainWindow(QtW.QWidget):
         self.setWindowTitle('Hicomuna {}'.format(self.config_dict["Version"]))
         self.show()
 
+    def finish_ui(self):
+        """
+        Второй шаг построения окна: FileHandler, кеш пациентов, модель таблицы, график и легенда.
+        :return:
+        """
+        self.set_file_keeper(drawer_and_up.filehandler.FileHandler("no_path/nowhere.np", self.config_dict["Table"]))
+        self.workspace = drawer_and_up.workspace.Workspace(self.config_dict["Workspace"]["MemoryMB"])
+
+        self.table_model = drawer_and_up.tablemodel.DataFrameModel()
+        self.table_model.cellEdited.connect(self.table_changed)
+        self.table.setModel(self.table_model)
+        self.table.selectionModel().selectionChanged.connect(self.table_clicked)
+
+        self.plot = drawer_and_up.pyqtdrawer.Plotter(self.config_dict["PlotWidget"])
+        self.draw_plot()
+        self.plot.p1.sigXRangeChanged.connect(self.view_range_changed)
+        legend = drawer_and_up.legend.Legend(self.config_dict["Plot"]["PointsStyle"])
+        grid = self.layout()
+        for placeholder, widget in ((self.plot_placeholder, self.plot.pw), (self.legend_placeholder, legend)):
+            grid.replaceWidget(placeholder, widget)
+            placeholder.deleteLater()
+        self.plot_placeholder = self.legend_placeholder = None
+
+        self.button_open_file.setEnabled(True)
+        self.button_new_file.setEnabled(True)
+        self.button_default_view.setEnabled(True)
+        watch = self.config_dict["Table"].get("Watch", 0)
+        if watch > 0:
+            self.watch_timer.start(int(watch * 1000))
+        self.start_ingest()
+        self.ready = True
+
+    def start_ingest(self):
+        """
+        Запускает приём показаний (drawer_and_up.ingest), если задан Ingest :: Address. Потоки подключений только
+        проверяют показания и кладут их в ограниченную очередь, а окно забирает накопленное таймером, так что
+        поток показаний любой частоты перерисовывает таблицу и график не чаще Ingest :: RateHz раз в секунду.
+        :return:
+        """
+        ingest_config = self.config_dict["Ingest"]
+        if not ingest_config["Address"]:
+            return
+        try:
+            self.ingest = drawer_and_up.ingest.IngestServer(
+                ingest_config["Address"], ingest_config["Types"], self.config_dict["Table"]["Delimiter"],
+                ingest_config["QueueRows"]).start()
+        except (OSError, ValueError) as e:
+            self.ingest = None
+            msg = QtW.QMessageBox()
+            msg.setWindowTitle("Ingest error")
+            msg.setText("Cannot listen on {0}: {1}".format(ingest_config["Address"], e))
+            msg.setIcon(QtW.QMessageBox.Critical)
+            msg.exec_()
+            return
+        self.ingest_timer.start(max(1, int(1000 / ingest_config["RateHz"])))
+
+    def stop_ingest(self):
+        """
+        Останавливает приём показаний; показания, уже принятые в очередь, вставляются в таблицы пациентов.
+        :return:
+        """
+        if self.ingest is not None:
+            self.ingest_timer.stop()
+            self.ingest.stop()
+            self.deliver_readings()
+            self.ingest = None
+
     def closeEvent(self, event):
         """
         Перезаписанный метод, при нажатии кнопки закрытия предлагает либо сохранить изменённый файл (если был изменён),
         либо просто спрашивает, закрыть или нет.
+        Несохранённые изменения других открытых пациентов предлагается сохранить по каждому отдельно.
+        Приём показаний останавливается до вопросов, чтобы все принятые показания попали в сохранение;
+        если закрытие отменено, приём запускается снова.
         :param event: event == close file
         :return:
         """
+        if not self.ready:
+            # окно закрыли до конца построения: сохранять нечего
+            event.accept()
+            return
+        self.stop_ingest()
+        for state in self.workspace.states:
+            if state.unsaved:
+                save_reply = QtW.QMessageBox.question(self, 'Message',
+                                                      "Save changes to {0}?".format(state.file_keeper.file_name),
+                                                      QtW.QMessageBox.Yes | QtW.QMessageBox.No, QtW.QMessageBox.No)
+                if save_reply == QtW.QMessageBox.Yes:
+                    state.file_keeper.save_file(state.df)
         if self.file_keeper.status_saved:
             reply = QtW.QMessageBox.question(self, 'Message',
                                              "Quit?", QtW.QMessageBox.Yes |
                                              QtW.QMessageBox.No, QtW.QMessageBox.No)
             if reply == QtW.QMessageBox.Yes:
+                self.wait_saving()
                 event.accept()
             else:
                 event.ignore()
+                self.start_ingest()
         else:
             self.ask_if_save_file()
             reply = QtW.QMessageBox.question(self, 'Message',
                                              "Quit?", QtW.QMessageBox.Yes |
                                              QtW.QMessageBox.No, QtW.QMessageBox.No)
             if reply == QtW.QMessageBox.Yes:
+                self.wait_saving()
                 event.accept()
             else:
                 event.ignore()
+                self.start_ingest()
 
-    def load_any_file(self):
-        try:
-            self.file_title.setText(self.file_keeper.file_name)
-            # загружаем содержимое файла
-            self.df = self.file_keeper.load_file()
-            # нужно убедиться, что DataFrame не пуст (иначе хер нам, а не сортировка)
-            if self.df.size > 0:
-                # сортируем значения по дате (на всякий случай)
-                self.df.sort_values(by="DATE", key=timestamps_from_dates, inplace=True)
-                # исправляем запятые
-                self.df["VALUE"] = self.df["VALUE"].apply(lambda x: re.sub(",", ".", x))
-                self.df["DATE"] = self.df["DATE"].apply(lambda x: reformat_dates(x))
-            # временно выключаю проверку события изменения таблицы для безошибочной записи в таблицу новых данных
-            self.file_keeper.set_status_opening(True)
-            self.update_table()
-            # а затем обратно включаю её
-            self.file_keeper.set_status_opening(False)
-            # обновляем график
-            self.update_plot()
-            self.set_default_view()
-            self.button_add_row.setEnabled(True)
-            self.button_delete_row.setEnabled(True)
+    def load_any_file(self, file_keeper=None, background=True):
+        """
+        Загружает файл (или его кеш) с приведёнными датами и запятыми в отдельном потоке, показывая прогресс
+        с возможностью отмены. Таблица и график обновляются одним шагом в finish_loading, file_keeper
+        заменяется только при успешной загрузке. Замер load_any_file — от начала загрузки до её показа
+        в finish_loading.
+        :param file_keeper: FileHandler открываемого файла, по умолчанию текущий
+        :param background: False — загрузить синхронно, в потоке GUI
+        :return:
+        """
+        if file_keeper is None:
+            file_keeper = self.file_keeper
+        if self.loader is not None:
+            self.loader.cancel()
+        worker = drawer_and_up.loader.LoadWorker(file_keeper, self)
+        worker.loaded.connect(self.finish_loading)
+        worker.partial_loaded.connect(self.show_partial)
+        worker.failed.connect(self.loading_failed)
+        worker.cancelled.connect(self.loading_cancelled)
+        self.loader = worker
+        if not background:
+            worker.run()
+            worker.deleteLater()
+            return
+        progress_dialog = QtW.QProgressDialog("Loading {0}".format(file_keeper.file_name), "Cancel", 0, 100, self)
+        progress_dialog.setWindowModality(QtC.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(300)
+        progress_dialog.canceled.connect(worker.cancel)
+        worker.progress.connect(lambda percent, text: (progress_dialog.setValue(percent),
+                                                      progress_dialog.setLabelText(text)))
+        worker.finished.connect(progress_dialog.reset)
+        worker.finished.connect(progress_dialog.deleteLater)
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def finish_loading(self, df):
+        # результат уже отменённой (заменённой новой) загрузки не нужен
+        if self.sender() is not self.loader:
+            return
+        previous = self.capture_state()
+        if previous is not None and previous.path != self.loader.file_keeper.path:
+            self.workspace.put(previous)
+        worker = self.loader
+        self.set_file_keeper(worker.file_keeper)
+        self.loader = None
+        self.streaming = False
+        self.df_before_loading = None
+        self.df = df
+        self.redraw.mark(table=True, all_series=True, title=True, view=True)
+        self.redraw.flush()
+        if self.file_keeper.partial:
+            # загружены последние дни записи, более ранние строки догружаются при прокрутке вверх
+            self.table.scrollToBottom()
+        self.button_add_row.setEnabled(True)
+        self.button_delete_row.setEnabled(True)
+        self.button_save_changes.setEnabled(False)
+        self.button_save_changes.setStyleSheet("background-color: lightgray")
+        self.show_patient_tab()
+        drawer_and_up.instrument.record("load_any_file", worker.started_at, len(df))
+
+    def show_partial(self, df):
+        """
+        Показывает уже прочитанную часть файла при потоковой загрузке. Если сигналы копятся быстрее,
+        чем GUI их обрабатывает, устаревшие части пропускаются.
+        :param df: прочитанная часть таблицы
+        :return:
+        """
+        worker = self.sender()
+        if worker is not self.loader or df is not worker.latest_partial:
+            return
+        first = not self.streaming
+        if first:
+            self.streaming = True
+            self.df_before_loading = self.df
+            self.button_add_row.setEnabled(False)
+            self.button_delete_row.setEnabled(False)
             self.button_save_changes.setEnabled(False)
-            self.button_save_changes.setStyleSheet("background-color: lightgray")
-        except ValueError as e:
-            msg = QtW.QMessageBox()
-            msg.setWindowTitle("Loading file error")
-            msg.setText(str(e))
-            msg.setIcon(QtW.QMessageBox.Critical)
-            msg.exec_()
+            self.file_title.setText(worker.file_keeper.file_name)
+        self.df = df
+        # части, пришедшие быстрее интервала перерисовки, показываются одной перерисовкой
+        self.redraw.mark(table=True, all_series=True, view=first)
+
+    def restore_after_loading(self):
+        """
+        После отмены или ошибки потоковой загрузки возвращает на экран таблицу, открытую до неё.
+        :return:
+        """
+        if not self.streaming:
+            return
+        self.streaming = False
+        self.df = self.df_before_loading
+        self.df_before_loading = None
+        if self.df is None:
+            self.clear_patient()
+            return
+        self.redraw.mark(table=True, all_series=True, title=True, view=True)
+        self.redraw.flush()
+        self.button_add_row.setEnabled(True)
+        self.button_delete_row.setEnabled(True)
+        self.button_save_changes.setEnabled(not self.file_keeper.status_saved)
+
+    def loading_cancelled(self):
+        if self.sender() is self.loader:
+            self.loader = None
+            self.restore_after_loading()
+
+    def loading_failed(self, text):
+        if self.sender() is not self.loader:
+            return
+        self.loader = None
+        self.restore_after_loading()
+        msg = QtW.QMessageBox()
+        msg.setWindowTitle("Loading file error")
+        msg.setText(text)
+        msg.setIcon(QtW.QMessageBox.Critical)
+        msg.exec_()
 
     def get_text_file(self):
-        if not self.file_keeper.status_saved:
-            self.ask_if_save_file()
         dialog = QtW.QFileDialog()
         dialog.setFileMode(QtW.QFileDialog.AnyFile)
         dialog.setFilter(QtC.QDir.Files)
 
         if dialog.exec_():
             file_name = dialog.selectedFiles()
-            self.file_keeper = drawer_and_up.filehandler.FileHandler(file_name[0],
-                                                                     self.config_dict["Table"])
-            self.load_any_file()
+            self.open_patient(file_name[0])
 
     def ask_if_save_file(self):
         save_reply = QtW.QMessageBox.question(self, 'Message',
@@ -173,19 +387,14 @@ class MainWindow(QtW.QWidget):
                                               QtW.QMessageBox.No, QtW.QMessageBox.No)
 
         if save_reply == QtW.QMessageBox.Yes:
-            self.file_keeper.save_file(self.df)
-            self.button_save_changes.setEnabled(False)
-            self.button_save_changes.setStyleSheet("background-color: lightgray")
+            self.save_changes()
 
     def create_text_file(self):
-        if not self.file_keeper.status_saved:
-            self.ask_if_save_file()
         file_name = QtW.QFileDialog.getSaveFileName(self, 'Create File')
         try:
-            self.file_keeper = drawer_and_up.filehandler.FileHandler(file_name[0],
-                                                                     self.config_dict["Table"])
-            self.file_keeper.create_file()
-            self.load_any_file()
+            file_keeper = drawer_and_up.filehandler.FileHandler(file_name[0], self.config_dict["Table"])
+            file_keeper.create_file()
+            self.load_any_file(file_keeper)
         except ValueError as e:
             msg = QtW.QMessageBox()
             msg.setWindowTitle("Creating file error")
@@ -193,19 +402,172 @@ class MainWindow(QtW.QWidget):
             msg.setIcon(QtW.QMessageBox.Critical)
             msg.exec_()
 
+    def open_patient(self, path):
+        """
+        Показывает пациента: уже открытый берётся из памяти (или перечитывается, если был выгружен из кеша),
+        новый открывается в новой вкладке. Несохранённые изменения текущего пациента остаются при нём.
+        :param path: путь файла пациента
+        :return:
+        """
+        if path == self.file_keeper.path and self.df is not None:
+            return
+        state = self.workspace.take(path)
+        if state is None:
+            self.load_any_file(drawer_and_up.filehandler.FileHandler(path, self.config_dict["Table"]))
+            return
+        previous = self.capture_state()
+        if previous is not None:
+            self.workspace.put(previous)
+        self.apply_state(state)
+
+    def patient_selected(self, index):
+        if index < 0 or self.loader is not None:
+            return
+        self.open_patient(self.patient_tabs.tabData(index))
+
+    def close_patient(self, index):
+        """
+        Закрывает вкладку пациента, предложив сохранить изменения. Фоновый пациент с несохранёнными изменениями
+        (такие всегда в памяти) сначала показывается, остальные фоновые просто забываются.
+        :param index: номер вкладки
+        :return:
+        """
+        if self.loader is not None:
+            return
+        path = self.patient_tabs.tabData(index)
+        if path != self.file_keeper.path:
+            state = self.workspace.take(path)
+            if state is None or not state.unsaved:
+                self.patient_tabs.blockSignals(True)
+                self.patient_tabs.removeTab(index)
+                self.patient_tabs.blockSignals(False)
+                self.show_patient_tab()
+                return
+            previous = self.capture_state()
+            if previous is not None:
+                self.workspace.put(previous)
+            self.apply_state(state)
+        if not self.file_keeper.status_saved:
+            self.ask_if_save_file()
+        self.patient_tabs.blockSignals(True)
+        self.patient_tabs.removeTab(self.patient_tabs.currentIndex())
+        self.patient_tabs.blockSignals(False)
+        self.clear_patient()
+        if self.patient_tabs.count() > 0:
+            self.patient_selected(self.patient_tabs.currentIndex())
+
+    def capture_state(self):
+        """
+        :return: PatientState показанного пациента или None, если файл не открыт. Во время потоковой загрузки
+        на экране часть нового файла, поэтому берётся таблица, открытая до неё, без массивов графика.
+        """
+        # массивы серий должны соответствовать таблице
+        self.redraw.flush()
+        if self.streaming:
+            if self.df_before_loading is None:
+                return None
+            return drawer_and_up.workspace.PatientState(self.file_keeper, self.df_before_loading)
+        if self.df is None:
+            return None
+        return drawer_and_up.workspace.PatientState(
+            self.file_keeper, self.df, dict(self.series_data), self.series_of_row, self.point_of_row,
+            self.selected_rows(), tuple(self.plot.p1.viewRange()[0]))
+
+    def apply_state(self, state):
+        """
+        Показывает сохранённое в PatientState без пересчёта таблицы и серий графика.
+        :param state: PatientState
+        :return:
+        """
+        self.set_file_keeper(state.file_keeper)
+        self.df = state.df
+        if state.series_data is None:
+            self.redraw.mark(all_series=True)
+        else:
+            self.series_data = dict(state.series_data)
+            for heading, (x_, y_, rows) in self.series_data.items():
+                self.plot.set_series_data(heading, x_, y_, **self.config_dict["Plot"]["PointsStyle"][heading])
+            self.series_of_row = state.series_of_row
+            self.point_of_row = state.point_of_row
+        self.redraw.mark(table=True, title=True, view=True)
+        self.redraw.flush()
+        if state.x_range is not None:
+            self.plot.p1.setXRange(*state.x_range, padding=0)
+            self.plot.update_series_views()
+        self.select_rows(state.selected_rows)
+        self.table_clicked()
+        self.button_add_row.setEnabled(True)
+        self.button_delete_row.setEnabled(True)
+        self.status_changed(self.file_keeper.status_saved)
+        self.show_patient_tab()
+
+    def clear_patient(self):
+        # ни одного открытого пациента
+        self.set_file_keeper(drawer_and_up.filehandler.FileHandler("no_path/nowhere.np", self.config_dict["Table"]))
+        self.df = None
+        self.file_title.setText("Patient name")
+        self.table_model.set_frame(None)
+        self.series_data.clear()
+        for heading in self.series_headings():
+            self.plot.set_series_data(heading, np.empty(0), np.empty(0),
+                                      **self.config_dict["Plot"]["PointsStyle"][heading])
+        self.series_of_row = np.empty(0, dtype=np.int64)
+        self.point_of_row = np.empty(0, dtype=np.int64)
+        self.highlight_rows([])
+        self.button_add_row.setEnabled(False)
+        self.button_delete_row.setEnabled(False)
+        self.status_changed(True)
+
+    def show_patient_tab(self):
+        # делает текущей вкладку показанного пациента (создаёт её при первом открытии) и обновляет отметки
+        path = self.file_keeper.path
+        self.patient_tabs.blockSignals(True)
+        index = next((i for i in range(self.patient_tabs.count()) if self.patient_tabs.tabData(i) == path), -1)
+        if index < 0:
+            index = self.patient_tabs.addTab(self.file_keeper.file_name)
+            self.patient_tabs.setTabData(index, path)
+            self.patient_tabs.setTabToolTip(index, path)
+        self.patient_tabs.setCurrentIndex(index)
+        self.patient_tabs.blockSignals(False)
+        self.update_patient_tabs()
+
+    def update_patient_tabs(self):
+        # звёздочка у пациентов с несохранёнными изменениями; выгруженные из кеша пациенты всегда сохранены
+        unsaved = {state.path for state in self.workspace.states if state.unsaved}
+        if not self.file_keeper.status_saved:
+            unsaved.add(self.file_keeper.path)
+        for index in range(self.patient_tabs.count()):
+            path = self.patient_tabs.tabData(index)
+            name = drawer_and_up.filehandler.parse_filename(path)[0]
+            self.patient_tabs.setTabText(index, name + " *" if path in unsaved else name)
+
     def add_new_row(self):
-        rows_pull = set()
+        # выделение должно относиться к показанной таблице
+        self.redraw.flush()
         date = None
-        for elem in self.table.selectedItems():
-            rows_pull.add(elem.row())
-        for row in rows_pull:
-            sub_section = self.df.loc[row]
-            date = sub_section["DATE"]
+        for row in self.selected_rows():
+            date = drawer_and_up.dates.date_from_timestamp(self.df["EPOCH"].iat[row])
         w = drawer_and_up.popup.InputDialog(self.config_dict["InputDialog"], date)
         values = w.get_results()
         if values is not None:
-            self.df = pd.concat([self.df, values], ignore_index=True)
-            self.add_or_delete_action()
+            self.insert_new_rows(values)
+
+    @drawer_and_up.instrument.timed("insert_new_rows", rows=lambda _, window, values:
+                                    drawer_and_up.instrument.frame_rows(window.df))
+    def insert_new_rows(self, values):
+        """
+        Добавляет строки, введённые в InputDialog, в таблицу, журнал изменений и на график.
+        :param values: pd.DataFrame строк с колонками DATE, TYPE, VALUE, COMMENT
+        :return:
+        """
+        values["EPOCH"] = drawer_and_up.dates.timestamps_from_dates(values["DATE"])
+        values = drawer_and_up.typed.to_typed(values)
+        values["INVALID"] = drawer_and_up.validators.invalid_rows(values)
+        self.ensure_loaded(values["EPOCH"].to_numpy())
+        self.file_keeper.record_change(added=values)
+        positions = self.insert_rows(values)
+        self.add_or_delete_action(self.touched_series(values["TYPE"]))
+        self.table.scrollTo(self.table_model.index(int(positions[0]), 0))
 
     def delete_row(self):
         reply = QtW.QMessageBox.question(self, 'Message',
@@ -213,150 +575,652 @@ class MainWindow(QtW.QWidget):
                                          QtW.QMessageBox.No, QtW.QMessageBox.No)
 
         if reply == QtW.QMessageBox.Yes:
-            index_list = []
-            for model_index in self.table.selectionModel().selectedRows():
-                index = QtC.QPersistentModelIndex(model_index)
-                index_list.append(index)
+            self.redraw.flush()
+            rows = self.selected_rows()
+            touched = self.touched_series(self.df["TYPE"].to_numpy()[rows])
+            self.file_keeper.record_change(removed=self.df.iloc[rows])
+            self.drop_rows(rows)
+            self.add_or_delete_action(touched)
+
+    def set_file_keeper(self, file_keeper):
+        # кнопка сохранения и автосохранение следят за статусом только текущего файла
+        if self.file_keeper is not None:
+            self.file_keeper.status_listeners.remove(self.status_changed)
+        self.file_keeper = file_keeper
+        file_keeper.status_listeners.append(self.status_changed)
+
+    def status_changed(self, saved):
+        """
+        Вызывается FileHandler.set_status_saved: меняет вид кнопки сохранения и запускает таймер автосохранения
+        на Table :: AutoSave секунд (0 — без автосохранения) от первого несохранённого изменения.
+        :param saved: новое значение status_saved
+        :return:
+        """
+        if saved:
+            self.autosave_timer.stop()
+            self.button_save_changes.setStyleSheet("background-color: lightgray")
+        else:
+            self.button_save_changes.setStyleSheet("background-color: yellow")
+            interval = self.config_dict["Table"].get("AutoSave", 0)
+            if interval > 0 and not self.autosave_timer.isActive():
+                self.autosave_timer.start(int(interval * 1000))
+        self.button_save_changes.setEnabled(not saved and self.saver is None)
+        self.update_patient_tabs()
 
-            for index in index_list:
-                self.df = self.df.drop(self.df.index[index.row()])
-                self.table.removeRow(index.row())
-            self.add_or_delete_action()
+    def autosave(self):
+        if self.file_keeper.status_saved or self.file_keeper.status_opening or self.streaming:
+            return
+        self.save_changes()
 
     def save_changes(self):
-        self.file_keeper.save_file(self.df)
+        """
+        Сохранение изменений в отдельном потоке (обычно дописыванием в журнал) по копии таблицы, так что GUI
+        не ждёт записи на диск. Статус «сохранено» ставится по окончании записи, если за это время таблица
+        не менялась.
+        :return:
+        """
+        if self.saver is not None:
+            self.save_requested = True
+            return
+        # дописанные другими программами строки должны попасть в копию, если файл будет переписан целиком
+        self.check_appended()
+        if self.loader is not None:
+            # файл переписан другой программой и открывается заново без несохранённых изменений
+            return
+        worker = drawer_and_up.saver.SaveWorker(self.file_keeper, self.df.copy(), self)
+        worker.saved.connect(self.save_finished)
+        worker.failed.connect(self.save_failed)
+        worker.compaction_failed.connect(self.compaction_failed)
+        worker.finished.connect(self.saver_done)
+        worker.finished.connect(worker.deleteLater)
+        self.saver = worker
         self.button_save_changes.setEnabled(False)
-        self.button_save_changes.setStyleSheet("background-color: lightgray")
+        self.button_save_changes.setText("Saving...")
+        worker.start()
+
+    def save_finished(self):
+        worker = self.sender()
+        if worker.file_keeper.revision == worker.revision:
+            worker.file_keeper.set_status_saved(True)
+
+    def save_failed(self, text):
+        msg = QtW.QMessageBox()
+        msg.setWindowTitle("Saving error")
+        msg.setText(text)
+        msg.setIcon(QtW.QMessageBox.Critical)
+        msg.exec_()
+
+    def compaction_failed(self, text):
+        # изменения уже в журнале, но файл не переписан, и журнал растёт
+        msg = QtW.QMessageBox()
+        msg.setWindowTitle("Journal compaction error")
+        msg.setText("Changes are saved to the journal, but {0} could not be rewritten: {1}".format(
+            self.sender().file_keeper.file_name, text))
+        msg.setIcon(QtW.QMessageBox.Warning)
+        msg.exec_()
 
+    def saver_done(self):
+        self.saver = None
+        self.update_patient_tabs()
+        self.button_save_changes.setText("Save changes")
+        self.button_save_changes.setEnabled(not self.file_keeper.status_saved)
+        if self.save_requested:
+            self.save_requested = False
+            if not self.file_keeper.status_saved:
+                self.save_changes()
+
+    def wait_saving(self):
+        # файл должен быть записан до выхода из программы
+        while self.saver is not None:
+            self.saver.wait()
+            QtW.QApplication.processEvents()
+
+    @drawer_and_up.instrument.timed("set_default_view", rows=lambda _, window: drawer_and_up.instrument.frame_rows(window.df))
     def set_default_view(self):
         """
         Приводит график к одному, стандартному виду. Меняет масштаб осей: 0 .. 90 для скорости, 0 .. 30000 для AC,
-        минимальная и максимальная даты для нижней оси
+        минимальная и максимальная даты для нижней оси. Для длинных записей (больше PlotWidget :: DefaultView ::
+        FullRangeRows строк) по нижней оси показываются только последние LastDays дней.
         :return:
         """
         self.plot.p1.setYRange(-1, 90)
         self.plot.p2.setYRange(0, 30000)
-        if (self.df is None) or (len(self.df["DATE"].values) == 0):
-            x_ = timestamps_from_dates(["01/01/2021 01:10", "01/01/2021 17:41"])
+        if (self.df is None) or (len(self.df["EPOCH"].values) == 0):
+            x_ = drawer_and_up.dates.timestamps_from_dates(["01/01/2021 01:10", "01/01/2021 17:41"])
         else:
-            x_ = timestamps_from_dates([self.df["DATE"].values[0], self.df["DATE"].values[-1]])
+            x_ = self.df["EPOCH"].values[[0, -1]]
+            view_config = self.config_dict["PlotWidget"].get("DefaultView", dict())
+            if len(self.df) > view_config.get("FullRangeRows", len(self.df)):
+                x_[0] = max(x_[0], x_[1] - view_config["LastDays"] * 24 * 3600)
         self.plot.p1.setXRange(x_[0], x_[1])
+        self.plot.update_series_views()
 
+    def update_title(self):
+        title = self.file_keeper.file_name
+        if self.df is not None and self.file_keeper.partial:
+            # показана часть записи из базы
+            pages = self.file_keeper.pages
+            start = drawer_and_up.dates.date_from_timestamp(max(pages.start, pages.first))
+            if pages.stop is None:
+                title = "{0} (from {1})".format(title, start)
+            else:
+                title = "{0} ({1} - {2})".format(title, start, drawer_and_up.dates.date_from_timestamp(pages.stop - 1))
+        if self.df is not None and "INVALID" in self.df.columns:
+            count = int(self.df["INVALID"].sum())
+            if count > 0:
+                title = "{0} ({1} rows with invalid values)".format(title, count)
+        self.file_title.setText(title)
+
+    @drawer_and_up.instrument.timed("update_table", rows=lambda _, window: drawer_and_up.instrument.frame_rows(window.df))
     def update_table(self):
-        self.table.setData(self.df.to_dict('index'))
-
-    def add_or_delete_action(self):
-        self.df.sort_values(by="DATE", key=timestamps_from_dates, inplace=True)
-        self.file_keeper.set_status_opening(True)
-        self.update_table()
-        # а затем обратно включаю её
-        self.file_keeper.set_status_opening(False)
+        self.table_model.set_frame(self.df)
+        self.table.resizeColumnsToContents()
+
+    def selected_rows(self):
+        """
+        :return: отсортированный список номеров выделенных строк таблицы
+        """
+        return sorted({index.row() for index in self.table.selectionModel().selectedIndexes()})
+
+    def insert_rows(self, values):
+        """
+        Вставляет новые строки на их места по времени бинарным поиском по колонке EPOCH, без полной сортировки.
+        Строки с одинаковым временем встают после уже существующих.
+        :param values: pd.DataFrame новых строк с колонкой EPOCH
+        :return: np.ndarray позиций новых строк в self.df
+        """
+        self.df, positions = drawer_and_up.filehandler.insert_sorted(self.df, values)
+        self.shift_point_rows(inserted=positions)
+        return positions + np.arange(len(values))
+
+    def drop_rows(self, rows):
+        """
+        Удаляет строки по их позициям одной векторной операцией.
+        :param rows: номера строк
+        :return:
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        keep = np.ones(len(self.df), dtype=bool)
+        keep[rows] = False
+        self.df = self.df[keep].reset_index(drop=True)
+        self.shift_point_rows(removed=rows)
+
+    def row_in_order(self, row):
+        """
+        :param row: номер строки
+        :return: True, если EPOCH строки не нарушает порядок относительно соседей
+        """
+        epochs = self.df["EPOCH"].to_numpy()
+        return ((row == 0 or epochs[row - 1] <= epochs[row])
+                and (row == len(epochs) - 1 or epochs[row] <= epochs[row + 1]))
+
+    def check_appended(self):
+        """
+        Режим наблюдения (Table :: Watch): строки, дописанные в конец показанного CSV другими программами,
+        дочитываются (FileHandler.read_appended) и вставляются в таблицу и на график без перечитывания файла.
+        Укороченный или переписанный файл открывается заново. Во время загрузки и сохранения файл не опрашивается.
+        :return:
+        """
+        keeper = self.file_keeper
+        if (self.df is None or self.streaming or self.loader is not None or self.saver is not None
+                or keeper is None or not keeper.watched):
+            return
+        try:
+            rows = keeper.read_appended()
+        except (OSError, ValueError) as e:
+            # ошибка показывается один раз, дальше файл не опрашивается
+            keeper.stop_watching()
+            msg = QtW.QMessageBox()
+            msg.setWindowTitle("Watching file error")
+            msg.setText("{0}: {1}".format(keeper.file_name, e))
+            msg.setIcon(QtW.QMessageBox.Critical)
+            msg.exec_()
+            return
+        if rows is None:
+            self.file_replaced()
+        elif len(rows) > 0:
+            self.show_new_rows(rows)
+
+    def file_replaced(self):
+        # несохранённые изменения при перечитывании пропадут, поэтому без согласия файл больше не опрашивается
+        keeper = self.file_keeper
+        keeper.stop_watching()
+        if not keeper.status_saved:
+            reply = QtW.QMessageBox.question(self, 'Message',
+                                             "{0} was changed by another program. Reload it and discard "
+                                             "unsaved changes?".format(keeper.file_name),
+                                             QtW.QMessageBox.Yes | QtW.QMessageBox.No, QtW.QMessageBox.No)
+            if reply != QtW.QMessageBox.Yes:
+                return
+        self.load_any_file(keeper)
+
+    def show_new_rows(self, rows):
+        """
+        Вставляет новые строки записи (дочитанные из файла или принятые по сокету) в таблицу и на график.
+        Если таблица была прокручена до конца, а график показывал последние точки, оба продолжают показывать
+        конец записи.
+        :param rows: pd.DataFrame из typed.to_typed с колонкой INVALID
+        :return:
+        """
+        self.redraw.flush()
+        bar = self.table.verticalScrollBar()
+        following = bar.value() >= bar.maximum()
+        count = len(self.df)
+        last = self.df["EPOCH"].iat[-1] if count > 0 else None
+        positions = self.insert_rows(rows)
+        # дописанные строки обычно новее всех: тогда модель таблицы не сбрасывается
+        at_end = bool(positions[0] == count)
+        self.redraw.mark(appended=at_end, table=not at_end, series=self.touched_series(rows["TYPE"]), title=True)
+        self.redraw.flush()
+        if following:
+            self.table.scrollToBottom()
+        left, right = self.plot.p1.viewRange()[0]
+        if last is not None and right >= last:
+            shift = self.df["EPOCH"].iat[-1] - last
+            self.plot.p1.setXRange(left + shift, right + shift, padding=0)
+
+    def deliver_readings(self):
+        """
+        Забирает показания, накопленные IngestServer с прошлого вызова, и раскладывает их по пациентам: показанному
+        они вставляются одной перерисовкой, открытым в фоне — только в таблицу (серии пересчитаются при показе).
+        Показания считаются несохранёнными изменениями. Показания пациентов, которые не открыты, отбрасываются
+        (IngestServer.dropped). Пока файл загружается, показания ждут в очереди.
+        :return:
+        """
+        if self.ingest is None or self.streaming or self.loader is not None:
+            return
+        groups = drawer_and_up.ingest.by_patient(self.ingest.queue.take())
+        if not groups:
+            return
+        for patient, rows in groups.items():
+            if self.df is not None and drawer_and_up.ingest.matches(patient, self.file_keeper.path):
+                self.add_readings(rows)
+                continue
+            state = next((state for state in self.workspace.states
+                          if drawer_and_up.ingest.matches(patient, state.path)), None)
+            if state is None:
+                self.ingest.dropped += len(rows)
+                continue
+            if state.file_keeper.pages is not None:
+                # как ensure_loaded: сначала страницы базы, в которые попадают показания, затем новые границы
+                epochs = rows["EPOCH"].to_numpy()
+                part = state.file_keeper.load_pages(int(epochs.min()), int(epochs.max()))
+                if part is not None and len(part) > 0:
+                    state.df = drawer_and_up.filehandler.insert_sorted(state.df, part)[0]
+                state.file_keeper.pages.include(epochs)
+            state.df = drawer_and_up.filehandler.insert_sorted(state.df, rows)[0]
+            state.series_data = None
+            state.size = drawer_and_up.workspace.estimate_bytes(state.df)
+            state.file_keeper.record_change(added=rows)
+            state.file_keeper.set_status_saved(False)
+        self.update_patient_tabs()
+
+    def add_readings(self, rows):
+        """
+        Вставляет принятые показания в таблицу показанного пациента как добавленные строки.
+        :param rows: pd.DataFrame из typed.to_typed с колонкой INVALID
+        :return:
+        """
+        self.redraw.flush()
+        self.ensure_loaded(rows["EPOCH"].to_numpy())
+        self.file_keeper.record_change(added=rows)
         self.file_keeper.set_status_saved(False)
-        self.update_plot()
-        self.set_default_view()
+        self.show_new_rows(rows)
+
+    def view_range_changed(self, *_):
+        if self.file_keeper is not None and self.file_keeper.partial:
+            self.page_timer.start()
+
+    def load_visible_pages(self):
+        # видимый промежуток графика после остановки
+        if self.df is None or self.streaming or not self.file_keeper.partial:
+            return
+        left, right = self.plot.p1.viewRange()[0]
+        self.show_pages(int(np.floor(left)), int(np.ceil(right)))
+
+    def table_scrolled(self, _action):
+        """
+        Прокрутка таблицы выше первой или ниже последней строки догружает соседнюю страницу базы (пустые
+        страницы пропускаются). Сигнал actionTriggered приходит, когда sliderPosition уже сдвинут, а value — ещё нет.
+        """
+        pages = self.file_keeper.pages if self.file_keeper is not None else None
+        if self.df is None or self.streaming or pages is None:
+            return
+        bar = self.table.verticalScrollBar()
+        position = bar.sliderPosition()
+        if position <= bar.minimum():
+            while pages.start > pages.first:
+                if self.show_pages(pages.start - 1, pages.start - 1):
+                    break
+        elif position >= bar.maximum():
+            while pages.stop is not None and pages.stop <= pages.last:
+                if self.show_pages(pages.stop, pages.stop):
+                    break
+
+    def show_pages(self, left, right):
+        """
+        Догружает страницы базы для промежутка [left, right] и показывает их, оставляя первую видимую строку
+        таблицы на месте. Если сохранённая таблица заняла больше Table :: PageMemoryMB мегабайт, страницы дальше
+        соседних с промежутком выгружаются (при возврате к ним они читаются из базы заново).
+        :param left: наименьший нужный EPOCH
+        :param right: наибольший нужный EPOCH
+        :return: число добавленных строк
+        """
+        self.redraw.flush()
+        top = self.table.rowAt(0)
+        loaded = self.load_history(left, right)
+        removed = self.unload_pages(left, right)
+        if len(loaded) == 0 and len(removed) == 0:
+            return 0
+        self.redraw.mark(title=True)
+        self.redraw.flush()
+        if top >= 0:
+            top += int(np.searchsorted(loaded, top, side="right"))
+            top -= int(np.searchsorted(removed, top))
+            top = min(max(top, 0), len(self.df) - 1)
+            self.table.scrollTo(self.table_model.index(top, 0), QtW.QAbstractItemView.PositionAtTop)
+        return len(loaded)
+
+    def load_history(self, left, right):
+        """
+        Вставляет в таблицу строки недостающих страниц базы (FileHandler.load_pages). Изменениями они не считаются.
+        :return: отсортированные позиции вставки в старой нумерации (как для np.insert)
+        """
+        part = self.file_keeper.load_pages(left, right)
+        if part is None or len(part) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = self.insert_rows(part)
+        self.redraw.mark(table=True, all_series=True, title=True)
+        return positions - np.arange(len(positions))
+
+    def unload_pages(self, left, right):
+        """
+        :return: номера выгруженных строк (до выгрузки)
+        """
+        pages = self.file_keeper.pages
+        limit = self.config_dict["Table"].get("PageMemoryMB", 0)
+        # несохранённые правки из базы не прочитать, поэтому выгружается только сохранённая таблица
+        if (pages is None or limit <= 0 or not self.file_keeper.status_saved or self.saver is not None
+                or drawer_and_up.workspace.estimate_bytes(self.df) <= limit * 2 ** 20):
+            return np.empty(0, dtype=np.int64)
+        start, stop = pages.shrink(left, right)
+        epochs = self.df["EPOCH"].to_numpy()
+        outside = epochs < start
+        if stop is not None:
+            outside |= epochs >= stop
+        rows = np.flatnonzero(outside)
+        if len(rows) > 0:
+            self.drop_rows(rows)
+            self.redraw.mark(table=True, all_series=True, title=True)
+        return rows
+
+    def ensure_loaded(self, epochs):
+        """
+        Перед вставкой строк с временем epochs догружает страницы базы, в которые они попадают, чтобы загруженная
+        часть оставалась сплошным промежутком времени.
+        :param epochs: EPOCH вставляемых строк
+        :return: позиции вставки догруженных строк, см. load_history
+        """
+        pages = self.file_keeper.pages
+        if pages is None or len(epochs) == 0:
+            return np.empty(0, dtype=np.int64)
+        loaded = self.load_history(int(np.min(epochs)), int(np.max(epochs)))
+        pages.include(epochs)
+        return loaded
+
+    def add_or_delete_action(self, touched=None):
         self.file_keeper.set_status_saved(False)
-        self.button_save_changes.setEnabled(True)
-        self.button_save_changes.setStyleSheet("background-color: yellow")
+        self.redraw.mark(table=True, title=True, view=True, series=touched or (), all_series=touched is None)
+
+    def apply_redraw(self, pending):
+        """
+        Выполняет накопленную RedrawScheduler перерисовку: сброс модели таблицы, добавление строк в её конец
+        или обновление отдельных строк, пересчёт изменившихся серий, заголовок и вид графика по умолчанию.
+        :param pending: drawer_and_up.redraw.Redraw
+        :return:
+        """
+        if self.df is None:
+            return
+        if pending.table:
+            self.update_table()
+        else:
+            if pending.appended:
+                self.table_model.append_rows(self.df)
+            if pending.rows:
+                self.table_model.refresh_rows(min(pending.rows), max(pending.rows))
+        if pending.title:
+            self.update_title()
+        if pending.all_series or pending.series:
+            self.update_plot(None if pending.all_series else pending.series)
+        if pending.view:
+            self.set_default_view()
 
     # TODO: переписать, добавить проверку исключений
-    def table_changed(self, row, column):
+    def table_changed(self, row, column, text):
         # если в таблицу записываются данные, а не вносятся изменения, то просто ничего не делаем
-        if self.file_keeper.status_opening:
+        if self.file_keeper.status_opening or self.streaming:
             pass
         # а вот если вносятся изменения, то вносим их
         else:
-            item = self.table.item(row, column)
-            temp_var = re.sub(",", ".", item.text())
-            self.df.iat[row, column] = temp_var
-            self.file_keeper.set_status_saved(False)
-            self.update_plot()
-            self.set_default_view()
+            temp_var = re.sub(",", ".", text)
+            heading = self.table_model.columns[column]
+            old_record = self.df.iloc[[row]].copy()
+            # серии, которых касается правка: тип строки до изменения и, если меняется сам TYPE, новый тип
+            touched = self.touched_series([self.df["TYPE"].iat[row], temp_var if heading == "TYPE" else None])
+            # правка собирается в строковой записи строки и переводится обратно в типизированную целиком
+            record = drawer_and_up.typed.to_strings(old_record)
+            record["EPOCH"] = old_record["EPOCH"].to_numpy()
+            if heading == "DATE":
+                try:
+                    record["EPOCH"] = drawer_and_up.dates.timestamps_from_dates([temp_var])
+                except (ValueError, OverflowError) as e:
+                    # в DataFrame ничего не пишем, в ячейке остаётся прежнее значение
+                    msg = QtW.QMessageBox()
+                    msg.setWindowTitle("Wrong date")
+                    msg.setText(str(e))
+                    msg.setIcon(QtW.QMessageBox.Critical)
+                    msg.exec_()
+                    return
+                # новая дата может попасть в ещё не загруженную страницу базы; догруженные строки сдвигают row
+                loaded = self.ensure_loaded(record["EPOCH"].to_numpy())
+                row += int(np.searchsorted(loaded, row, side="right"))
+            record[heading] = temp_var
+            if heading in ("TYPE", "VALUE"):
+                # те же правила, что и при вводе через InputDialog; неверное значение в DataFrame не пишем
+                row_type, row_value = record["TYPE"].iat[0], record["VALUE"].iat[0]
+                if drawer_and_up.validators.bad_values([row_type], [row_value])[0]:
+                    msg = QtW.QMessageBox()
+                    msg.setWindowTitle("Wrong value")
+                    msg.setText("{0} is not a valid value for {1}".format(row_value, row_type))
+                    msg.setIcon(QtW.QMessageBox.Critical)
+                    msg.exec_()
+                    return
+            record = drawer_and_up.typed.to_typed(record)
+            record["INVALID"] = False if heading in ("TYPE", "VALUE") else old_record["INVALID"].to_numpy()
+            drawer_and_up.typed.set_row(self.df, row, record)
+            self.file_keeper.record_change(added=record, removed=old_record)
+            if heading == "DATE" and not self.row_in_order(row):
+                # строка с новой датой переезжает на своё место, чтобы DataFrame оставался отсортированным
+                moved = self.df.iloc[[row]]
+                self.drop_rows([row])
+                self.insert_rows(moved)
+                self.redraw.mark(table=True)
+            else:
+                self.redraw.mark(rows=[row])
             self.file_keeper.set_status_saved(False)
-            self.button_save_changes.setEnabled(True)
-            self.button_save_changes.setStyleSheet("background-color: yellow")
+            # при вставке из буфера или правке из кода перерисовка одна на всю пачку ячеек
+            self.redraw.mark(series=touched, title=True, view=True)
 
-    def update_plot(self):
+    @drawer_and_up.instrument.timed("update_plot", rows=lambda _, window, *args, **kwargs:
+                                    drawer_and_up.instrument.frame_rows(window.df))
+    def update_plot(self, headings=None):
         """
-        Обновление данных на графике,
-        обновляются все объявленные серии, прочим передаётся пустой массив.
+        Обновление данных на графике. Пересчитываются и передаются в PlotDataItem только серии из headings,
+        для остальных остаются закешированные в self.series_data массивы x/y.
+        :param headings: названия изменившихся серий (TYPE), по умолчанию обновляются все объявленные серии
         :return:
         """
-        for heading in self.config_dict["Plot"]["ToUpdate"]:
-            mask = self.df[self.df["TYPE"] == heading].index
-            if len(mask) > 0:
-                x_ = timestamps_from_dates(self.df[self.config_dict["Plot"]["AxisItems"]["bottomAxis"]][mask].values)
-                y_ = self.config_dict["Plot"]["Coefficients"][heading] * self.df["VALUE"][mask].values.astype(float)
-            else:
-                x_, y_ = [], []
-            self.scatter_plots[heading].setData(x=x_, y=y_,
-                                                **self.config_dict["Plot"]["PointsStyle"][heading])
-
-        mask = self.df[(self.df["TYPE"] == "Event") & (self.df["VALUE"] != "")].index
-        if len(mask) > 0:
-            x_ = timestamps_from_dates(self.df[self.config_dict["Plot"]["AxisItems"]["bottomAxis"]][mask].values)
-            y_ = np.array([-1 for _ in range(len(x_))])
+        if headings is None:
+            headings = self.series_headings()
+        for heading in headings:
+            if heading not in self.scatter_plots:
+                continue
+            x_, y_, rows = self.series_arrays(heading)
+            self.series_data[heading] = (x_, y_, rows)
+            self.plot.set_series_data(heading, x_, y_, **self.config_dict["Plot"]["PointsStyle"][heading])
+        self.update_point_index()
+        self.table_clicked()
+
+    def update_point_index(self):
+        """
+        Пересобирает обратный индекс строка -> (серия, номер точки) по закешированным номерам строк серий.
+        :return:
+        """
+        self.series_of_row = np.full(len(self.df), -1, dtype=np.int64)
+        self.point_of_row = np.full(len(self.df), -1, dtype=np.int64)
+        for code, heading in enumerate(self.series_headings()):
+            if heading in self.series_data:
+                rows = self.series_data[heading][2]
+                self.series_of_row[rows] = code
+                self.point_of_row[rows] = np.arange(len(rows))
+
+    def shift_point_rows(self, removed=None, inserted=None):
+        """
+        Сдвигает закешированные номера строк серий после удаления или вставки строк в self.df,
+        не пересчитывая сами серии.
+        :param removed: отсортированные номера удалённых строк (в старой нумерации)
+        :param inserted: отсортированные позиции вставки (в старой нумерации, как для np.insert)
+        :return:
+        """
+        for heading, (x_, y_, rows) in self.series_data.items():
+            if removed is not None:
+                rows = rows - np.searchsorted(removed, rows)
+            if inserted is not None:
+                rows = rows + np.searchsorted(inserted, rows, side="right")
+            self.series_data[heading] = (x_, y_, rows)
+
+    def series_headings(self):
+        return self.config_dict["Plot"]["ToUpdate"] + ["Event"]
+
+    def series_side(self, heading):
+        """
+        :param heading: название серии
+        :return: "right" для серий правой оси, "left" для остальных
+        """
+        return "right" if heading in self.config_dict["Plot"]["AxisItems"]["rightAxis"] else "left"
+
+    def touched_series(self, types):
+        """
+        :param types: значения колонки TYPE изменённых строк
+        :return: множество серий графика, которые нужно перерисовать
+        """
+        return {heading for heading in types if heading in self.scatter_plots}
+
+    def series_arrays(self, heading):
+        """
+        Вычисляет массивы точек одной серии из колонок EPOCH, TYPE и VALUE.
+        :param heading: название серии
+        :return: (x, y, номера строк self.df) np.ndarray
+        """
+        # TYPE хранится категориями, поэтому серия выбирается сравнением целых кодов
+        types = self.df["TYPE"].cat
+        epochs = self.df["EPOCH"].to_numpy()
+        if heading in types.categories:
+            mask = types.codes.to_numpy() == types.categories.get_loc(heading)
+        else:
+            mask = np.zeros(len(epochs), dtype=bool)
+        if heading == "Event":
+            x_ = epochs[mask]
+            y_ = np.full(len(x_), -1)
         else:
-            x_, y_ = [], []
-        self.scatter_plots["Event"].setData(x=x_, y=y_,
-                                            **self.config_dict["Plot"]["PointsStyle"]["Event"])
+            # строки с недопустимыми значениями на график не попадают
+            if "INVALID" in self.df.columns:
+                mask &= ~self.df["INVALID"].to_numpy(dtype=bool)
+            x_ = epochs[mask]
+            y_ = self.config_dict["Plot"]["Coefficients"][heading] * self.df["VALUE"].to_numpy(dtype=float)[mask]
+        return x_, y_, np.flatnonzero(mask)
 
     def draw_plot(self):
         """
         Вызывается один раз при запуске приложения для первичной отрисовки графика
         :return:
         """
-        x_ = timestamps_from_dates(["01/01/2021 01:10", "01/01/2021 17:41"])
+        import pyqtgraph as pg
+        x_ = drawer_and_up.dates.timestamps_from_dates(["01/01/2021 01:10", "01/01/2021 17:41"])
         for heading in self.config_dict["Plot"]["AxisItems"]["leftAxis"]:
             y_ = [1, 2]
             self.scatter_plots[heading] = pg.PlotDataItem(x=x_, y=y_)
-            self.plot.p1.addItem(self.scatter_plots[heading])
+            self.plot.add_series(heading, self.scatter_plots[heading], self.plot.p1)
         for heading in self.config_dict["Plot"]["AxisItems"]["rightAxis"]:
             y_ = [2000, 3000]
             self.scatter_plots[heading] = pg.PlotDataItem(x=x_, y=y_)
-            self.plot.p2.addItem(self.scatter_plots[heading])
+            self.plot.add_series(heading, self.scatter_plots[heading], self.plot.p2)
         y_ = [-1, -1]
         self.scatter_plots["Event"] = pg.PlotDataItem(x=x_, y=y_,
                                                       **self.config_dict["Plot"]["PointsStyle"]["Event"])
-        self.plot.p1.addItem(self.scatter_plots["Event"])
+        self.plot.add_series("Event", self.scatter_plots["Event"], self.plot.p1)
         for heading in self.scatter_plots:
             self.scatter_plots[heading].sigPointsClicked.connect(self.points_clicked)
+        for side, view in (("left", self.plot.p1), ("right", self.plot.p2)):
+            self.highlights[side] = pg.ScatterPlotItem(pen=pg.mkPen("#000000", width=2), brush=None,
+                                                     antialias=True)
+            self.highlights[side].setZValue(10)
+            self.highlights[side].setAcceptedMouseButtons(QtC.Qt.NoButton)
+            view.addItem(self.highlights[side])
 
     def points_clicked(self, scatter, pts):
-        _ = scatter
-        for point in self.chosen_points:
-            point.resetPen()
-        for elem in pts:
-            self.chosen_points.append(elem)
-            elem.setPen("#000000")
-            date = date_from_timestamp(elem.pos()[0])
-            value = elem.pos()[1]
-            top_res = 0
-            for s_d in np.where(self.df["DATE"] == date)[0]:
-                try:
-                    table_var = float(self.df.loc[s_d]["VALUE"]
-                                      ) * self.config_dict["Plot"]["Coefficients"][self.df.loc[s_d]["TYPE"]]
-                    if table_var == value:
-                        top_res = s_d
-                except ValueError:
-                    if value == -1:
-                        top_res = s_d
-            self.table.selectRow(top_res)
+        heading = next(heading for heading, item in self.scatter_plots.items() if item is scatter)
+        rows = self.series_data[heading][2][self.plot.source_index(heading, [elem.index() for elem in pts])]
+        # номера точек относятся к показанным на графике данным, а выделение — к таблице после перерисовки
+        self.redraw.flush()
+        self.select_rows(rows)
 
     def table_clicked(self):
-        for point in self.chosen_points:
-            point.resetPen()
-        rows_pull = set()
-        for elem in self.table.selectedItems():
-            rows_pull.add(elem.row())
-        for row in rows_pull:
-            sub_section = self.df.loc[row]
-            date = sub_section["DATE"]
-            heading = sub_section["TYPE"]
-            points = self.scatter_plots[heading].scatter.points()
-            for point in points:
-                if date == date_from_timestamp(point.pos()[0]):
-                    self.chosen_points.append(point)
-                    point.setPen("#000000")
+        self.highlight_rows(self.selected_rows())
+
+    def select_rows(self, rows):
+        """
+        Выделяет строки таблицы одной операцией; подсветку точек затем обновляет table_clicked.
+        :param rows: номера строк
+        :return:
+        """
+        selection = QtC.QItemSelection()
+        last_column = self.table_model.columnCount() - 1
+        for row in rows:
+            selection.select(self.table_model.index(int(row), 0), self.table_model.index(int(row), last_column))
+        self.table.selectionModel().select(selection, QtC.QItemSelectionModel.ClearAndSelect)
+        if len(rows) > 0:
+            self.table.scrollTo(self.table_model.index(int(rows[0]), 0))
+
+    def highlight_rows(self, rows):
+        """
+        Подсвечивает точки выделенных строк отдельным слоем поверх серий, поэтому при новом выделении
+        сбрасывается только текущая подсветка.
+        :param rows: номера строк
+        :return:
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        spots = {side: {"x": [], "y": [], "symbol": [], "size": []} for side in self.highlights}
+        if len(rows) > 0 and len(self.point_of_row) == len(self.df):
+            headings = self.series_headings()
+            codes = self.series_of_row[rows]
+            points = self.point_of_row[rows]
+            for code in np.unique(codes[codes >= 0]):
+                heading = headings[code]
+                x_, y_, _ = self.series_data[heading]
+                index = points[codes == code]
+                style = self.config_dict["Plot"]["PointsStyle"][heading]
+                side = spots[self.series_side(heading)]
+                side["x"].append(x_[index])
+                side["y"].append(y_[index])
+                side["symbol"] += [style.get("symbol", "o")] * len(index)
+                side["size"] += [style.get("symbolSize", 10)] * len(index)
+        for side, item in self.highlights.items():
+            if spots[side]["symbol"]:
+                item.setData(x=np.concatenate(spots[side]["x"]), y=np.concatenate(spots[side]["y"]),
+                             symbol=spots[side]["symbol"], size=spots[side]["size"])
+            else:
+                item.clear()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,13 @@
-from . import popup
-from . import pyqtdrawer
-from . import filehandler
+import importlib
+
+# подмодули импортируются при первом обращении (drawer_and_up.filehandler и т. д.), чтобы окно показывалось
+# до загрузки pandas и pyqtgraph
+__all__ = ("dates", "popup", "pyqtdrawer", "legend", "database", "filehandler", "tablemodel", "loader", "saver", "workspace",
+           "instrument", "validators", "typed", "settings", "redraw", "paging", "batch", "synthetic", "benchmark",
+           "ingest", "merge")
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
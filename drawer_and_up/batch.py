@@ -0,0 +1,142 @@
+import os
+import json
+import argparse
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from . import dates
+from . import settings
+from . import typed
+from . import validators
+from .filehandler import FileHandler, normalize_frame
+
+# расширения файлов пациентов, которые обрабатываются в каталоге
+SOURCE_EXTENSIONS = (".csv", ".xls", ".xlsx", ".ods", ".sqlite")
+# форматы, в которые умеет писать FileHandler.save_file
+TARGET_EXTENSIONS = (".csv", ".xlsx", ".sqlite")
+
+
+def validate_rows(df: pd.DataFrame, types):
+    """
+    Проверка строк сырой таблицы: разбираемая дата, известный тип, значение по правилам validators.VALUE_RULES.
+    :param df: pd.DataFrame, прочитанный FileHandler.load_file
+    :param types: допустимые значения TYPE (InputDialog :: Types :: Enum)
+    :return: (маска ошибочных строк, список ошибок {"row", "column", "value", "message"}), row — номер строки
+    в файле с учётом заголовка
+    """
+    bad = np.zeros(len(df), dtype=bool)
+    errors = list()
+
+    def report(mask, column, message):
+        for row in np.flatnonzero(mask & ~bad):
+            value = df[column].iat[row]
+            errors.append({"row": int(row) + 2, "column": column,
+                           "value": None if pd.isna(value) else str(value), "message": message})
+        bad[mask] = True
+
+    report(dates.invalid_dates(df["DATE"]), "DATE", "wrong date")
+    type_values = df["TYPE"].to_numpy(dtype=object)
+    report(~np.isin(type_values, list(types)), "TYPE", "unknown type")
+    report(validators.bad_values(type_values, df["VALUE"].to_numpy(dtype=object)), "VALUE", "value out of range")
+    errors.sort(key=lambda error: error["row"])
+    return bad, errors
+
+
+def target_path(source, source_dir, out_dir, extension):
+    relative = os.path.relpath(source, source_dir)
+    return os.path.join(out_dir, os.path.splitext(relative)[0] + extension)
+
+
+def process_file(source, target, q_dict, types, strict=False):
+    """
+    Обработка одного файла в процессе пула: чтение, проверка, приведение запятых и дат, запись в target.
+    Строки с ошибками в результат не попадают; при strict файл с ошибками не записывается вовсе.
+    Журнал сохранений рядом с исходным файлом накатывается на результат.
+    :return: dict отчёта по файлу
+    """
+    result = {"source": source, "target": None, "rows": 0, "written": 0, "errors": list(), "status": "ok"}
+    try:
+        source_keeper = FileHandler(source, q_dict)
+        raw = source_keeper.load_file()
+        result["rows"] = len(raw)
+        missing = [column for column in q_dict["Headings"] if column not in raw.columns]
+        if missing:
+            raise ValueError("{0} has no columns {1}".format(source_keeper.file_name, ", ".join(missing)))
+        bad, result["errors"] = validate_rows(raw, types)
+        if bad.any():
+            result["status"] = "invalid"
+            if strict:
+                return result
+        df = typed.to_typed(normalize_frame(raw[~bad].reset_index(drop=True)))
+        if os.path.isfile(source_keeper.journal_path):
+            df = source_keeper.replay_journal(df)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        FileHandler(target, q_dict).save_file(df)
+        result["target"] = target
+        result["written"] = len(df)
+    except Exception as e:
+        result["status"] = "failed"
+        result["message"] = str(e)
+    return result
+
+
+def find_sources(source_dir):
+    # скрытые файлы (кеш, журнал, временные файлы сохранения) пропускаются
+    sources = list()
+    for directory, dir_names, file_names in os.walk(source_dir):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith("."))
+        for file_name in sorted(file_names):
+            if not file_name.startswith(".") and os.path.splitext(file_name)[1].lower() in SOURCE_EXTENSIONS:
+                sources.append(os.path.join(directory, file_name))
+    return sources
+
+
+def run(source_dir, out_dir, config, extension=".csv", jobs=None, strict=False):
+    """
+    Обрабатывает все файлы пациентов в source_dir (рекурсивно) пулом процессов, повторяя структуру каталогов
+    в out_dir.
+    :param config: содержимое configs.json
+    :param extension: формат результата, один из TARGET_EXTENSIONS
+    :param jobs: число процессов (по умолчанию по числу ядер)
+    :return: dict отчёта
+    """
+    if extension not in TARGET_EXTENSIONS:
+        raise ValueError("{0} does not have suitable extension".format(extension))
+    # кеш и журнал нужны только для работы в окне
+    q_dict = dict(config["Table"], Cache=False, Journal=False)
+    types = config["InputDialog"]["Types"]["Enum"]
+    sources = find_sources(source_dir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_file, source, target_path(source, source_dir, out_dir, extension),
+                               q_dict, types, strict) for source in sources]
+        files = [future.result() for future in futures]
+    summary = {status: sum(1 for result in files if result["status"] == status)
+               for status in ("ok", "invalid", "failed")}
+    summary["files"] = len(files)
+    summary["rows"] = sum(result["rows"] for result in files)
+    summary["written"] = sum(result["written"] for result in files)
+    return {"summary": summary, "files": files}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Validate, normalize and convert a directory of patient files without the GUI.")
+    parser.add_argument("source", help="directory with .csv, .xls, .xlsx and .ods files")
+    parser.add_argument("output", help="directory for converted files")
+    parser.add_argument("--to", choices=[extension[1:] for extension in TARGET_EXTENSIONS], default="csv",
+                        help="target format")
+    parser.add_argument("--report", default=None, help="JSON report path (default: <output>/report.json)")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--strict", action="store_true", help="do not write files that contain invalid rows")
+    parser.add_argument("--config", default="configs.json", help="configuration file")
+    args = parser.parse_args(argv)
+    config = settings.load_config(args.config)
+    report = run(args.source, args.output, config, "." + args.to, args.jobs, args.strict)
+    report_path = args.report or os.path.join(args.output, "report.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    summary = report["summary"]
+    print("{files} files: {ok} ok, {invalid} with invalid rows, {failed} failed; {written} of {rows} rows written"
+          .format(**summary))
+    return 1 if summary["failed"] else 0
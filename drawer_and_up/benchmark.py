@@ -0,0 +1,278 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from . import dates
+from . import ingest
+from . import settings
+from . import typed
+from . import synthetic
+from .filehandler import FileHandler, normalize_frame
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+FORMATS = (".csv", ".xlsx", ".sqlite")
+# во сколько раз лучшее время может вырасти относительно сравниваемого прогона, прежде чем считаться регрессией
+DEFAULT_THRESHOLD = 1.2
+# разница меньше этой (в секундах) считается шумом
+MIN_DIFFERENCE = 0.002
+
+
+def measure(function, repeat, setup=None):
+    """
+    :param function: измеряемая функция; получает результат setup, если он задан
+    :param repeat: число запусков
+    :param setup: функция без аргументов, готовит данные для каждого запуска (не входит во время)
+    :return: список времён запусков в секундах
+    """
+    runs = list()
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        function(*args)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def result(case, rows, runs, file_format=None, **extra):
+    return dict({"case": case, "rows": rows, "format": file_format, "median": float(np.median(runs)),
+                 "min": float(np.min(runs)), "runs": runs}, **extra)
+
+
+def file_cases(raw, q_dict, directory, formats, repeat):
+    """
+    Чтение файла (FileHandler.load_file) в каждом формате, для базы — ещё и первой страницы (load_table).
+    Формат, для которого не установлен модуль записи или чтения (openpyxl для XLSX), пропускается с пометкой skipped.
+    :param raw: pd.DataFrame строк из synthetic.generate_records
+    :return: список результатов
+    """
+    results = list()
+    for file_format in formats:
+        path = os.path.join(directory, "records{0}".format(file_format))
+        try:
+            synthetic.write_records(raw, path, q_dict["Delimiter"])
+            handler = FileHandler(path, q_dict)
+            runs = measure(handler.load_file, repeat)
+        except ImportError as e:
+            results.append({"case": "load_file", "rows": len(raw), "format": file_format, "skipped": str(e)})
+            continue
+        results.append(result("load_file", len(raw), runs, file_format))
+        if handler.is_database and q_dict.get("PageDays", 0) > 0:
+            # первая страница длинной записи (последние Table :: PageDays дней), как при открытии в окне
+            results.append(result("load_first_page", len(raw), measure(handler.load_table, repeat), file_format))
+    return results
+
+
+def frame_cases(raw, repeat):
+    """
+    Разбор дат, приведение прочитанной таблицы (normalize_frame: запятые, даты, сортировка), отдельно сортировка
+    по EPOCH, перевод в typed.to_typed и проверка тех же строк, пришедших на сокет приёма показаний в NDJSON.
+    :return: (список результатов, таблица из typed.to_typed)
+    """
+    rows = len(raw)
+    results = [
+        result("timestamps_from_dates", rows, measure(dates.timestamps_from_dates, repeat,
+                                                      lambda: raw["DATE"].to_numpy(dtype=object))),
+        result("normalize_frame", rows, measure(normalize_frame, repeat, raw.copy)),
+    ]
+    unsorted = raw.copy()
+    unsorted["EPOCH"] = dates.timestamps_from_dates(raw["DATE"].to_numpy(dtype=object))
+    results.append(result("sort", rows, measure(
+        lambda df: df.sort_values(by="EPOCH", kind="mergesort", inplace=True, ignore_index=True),
+        repeat, unsorted.copy)))
+    normalized = normalize_frame(raw.copy())
+    results.append(result("to_typed", rows, measure(typed.to_typed, repeat, lambda: normalized)))
+    lines = [json.dumps({"patient": "records", "date": date, "type": kind, "value": value},
+                        ensure_ascii=False).encode("utf-8")
+             for date, kind, value in raw[["DATE", "TYPE", "VALUE"]].itertuples(index=False)]
+    results.append(result("parse_readings", rows, measure(lambda: ingest.parse_readings(lines, ";", typed.TYPES),
+                                                          repeat)))
+    return results, typed.to_typed(normalized)
+
+
+class _Spot:
+    # точка, как её передаёт сигнал sigPointsClicked: нужен только номер в PlotDataItem
+    def __init__(self, index):
+        self._index = index
+
+    def index(self):
+        return self._index
+
+
+def open_window(config):
+    """
+    Главное окно на платформе Qt offscreen (если платформа не задана явно).
+    :return: (QApplication, app_window.MainWindow)
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import PyQt5.QtWidgets as QtW
+    import app_window
+    app = QtW.QApplication.instance() or QtW.QApplication(sys.argv)
+    return app, app_window.MainWindow(config)
+
+
+def window_cases(app, window, df, repeat, clicks=10, seed=0):
+    """
+    Обновление таблицы и графика и выбор точек щелчком (points_clicked -> выделение строк -> подсветка точек)
+    в настоящем окне.
+    :param app: QApplication
+    :param window: app_window.MainWindow из open_window
+    :param df: pd.DataFrame из typed.to_typed с колонкой INVALID
+    :param clicks: число точек, выбираемых за один щелчок
+    :return: список результатов
+    """
+    rows = len(df)
+    window.df = df
+    results = [result("update_table", rows, measure(window.update_table, repeat))]
+    window.update_plot()
+    window.set_default_view()
+    app.processEvents()
+    results.append(result("update_plot", rows, measure(window.update_plot, repeat)))
+    heading = max(window.series_data, key=lambda name: len(window.plot.series[name]["shown"]))
+    shown = len(window.plot.series[heading]["shown"])
+    rng = np.random.default_rng(seed)
+
+    def click():
+        return [_Spot(int(index)) for index in rng.integers(0, shown, size=min(clicks, shown))]
+    runs = measure(lambda spots: window.points_clicked(window.scatter_plots[heading], spots), repeat, click)
+    results.append(result("click_lookup", rows, runs, series=heading))
+    app.processEvents()
+    return results
+
+
+def startup_cases(repeat):
+    """
+    Холодный запуск приложения (main.py --startup-time) в отдельном процессе на платформе Qt offscreen:
+    время от начала выполнения main.py до первой отрисовки окна и до готовности графика и таблицы.
+    :return: список результатов
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ = dict(os.environ)
+    environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    shown, ready = list(), list()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "main.py", "--startup-time"], capture_output=True, text=True,
+                                cwd=root, env=environ)
+        match = re.search(r"shown in (\d+) ms, ready in (\d+) ms", output.stdout)
+        if match is None:
+            return [{"case": "startup_shown", "rows": 0, "format": None,
+                     "skipped": output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "no output"}]
+        shown.append(int(match.group(1)) / 1000)
+        ready.append(int(match.group(2)) / 1000)
+    return [result("startup_shown", 0, shown), result("startup_ready", 0, ready)]
+
+
+def run(config, sizes=DEFAULT_SIZES, formats=FORMATS, repeat=3, window=True, seed=0, progress=print):
+    """
+    Прогон всех случаев на синтетических записях каждого размера.
+    :param config: содержимое configs.json
+    :param sizes: числа строк
+    :param formats: форматы файлов для load_file
+    :param repeat: число запусков каждого случая, в результат идут медиана и минимум
+    :param window: измерять случаи, которым нужно окно, и запуск приложения
+    :param progress: функция от строки о ходе прогона
+    :return: dict результатов вместе с описанием окружения
+    """
+    q_dict = dict(config["Table"], Cache=False, Journal=False)
+    results = list()
+    if window:
+        progress("startup")
+        results += startup_cases(repeat)
+    app, main_window = open_window(config) if window else (None, None)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            progress("{0} rows".format(rows))
+            raw = synthetic.generate_records(rows, config, seed=seed)
+            results += file_cases(raw, q_dict, directory, formats, repeat)
+            frame_results, df = frame_cases(raw, repeat)
+            results += frame_results
+            if window:
+                df["INVALID"] = False
+                results += window_cases(app, main_window, df, repeat, seed=seed)
+    if window:
+        main_window.hide()
+    return {"environment": environment(), "repeat": repeat, "seed": seed, "results": results}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform()}
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Сравнение с другим прогоном по совпадающим (случай, формат, строки). Сравниваются лучшие времена: они меньше
+    медиан зависят от посторонней нагрузки.
+    :return: список строк таблицы сравнения и список регрессий (время выросло больше чем в threshold раз
+    и больше чем на MIN_DIFFERENCE)
+    """
+    def key(item):
+        return item["case"], item["format"], item["rows"]
+    before = {key(item): item for item in baseline["results"] if "min" in item}
+    lines, regressions = list(), list()
+    for item in report["results"]:
+        old = before.get(key(item))
+        if old is None or "min" not in item:
+            continue
+        ratio = item["min"] / old["min"] if old["min"] > 0 else float("inf")
+        line = "{0:<22} {1:<7} {2:>8} {3:>10.4f} {4:>10.4f} {5:>7.2f}x".format(
+            item["case"], item["format"] or "", item["rows"], old["min"], item["min"], ratio)
+        if ratio > threshold and item["min"] - old["min"] > MIN_DIFFERENCE:
+            line += "  REGRESSION"
+            regressions.append(key(item))
+        lines.append(line)
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time the hot paths on synthetic patient records and save the results for comparison.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated row counts")
+    parser.add_argument("--formats", default=",".join(file_format[1:] for file_format in FORMATS),
+                        help="comma-separated file formats for load_file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    parser.add_argument("--no-window", action="store_true", help="skip the cases that need the Qt window")
+    parser.add_argument("--output", default=None,
+                        help="results path (default: benchmarks/<commit>.json)")
+    parser.add_argument("--compare", default=None, help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument("--config", default="configs.json", help="configuration file")
+    args = parser.parse_args(argv)
+    config = settings.load_config(args.config)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    formats = ["." + file_format.strip(".") for file_format in args.formats.split(",") if file_format]
+    report = run(config, sizes, formats, args.repeat, not args.no_window, args.seed)
+    output = args.output or os.path.join("benchmarks", "{0}.json".format(report["environment"]["commit"] or "local"))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    for item in report["results"]:
+        if "skipped" in item:
+            print("{0:<22} {1:<7} {2:>8}  skipped: {3}".format(item["case"], item["format"] or "", item["rows"],
+                                                             item["skipped"]))
+        else:
+            print("{0:<22} {1:<7} {2:>8} {3:>10.4f} s".format(item["case"], item["format"] or "", item["rows"],
+                                                             item["median"]))
+    print("results saved to {0}".format(output))
+    if args.compare is None:
+        return 0
+    with open(args.compare, "r", encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    lines, regressions = compare(report, baseline, args.threshold)
+    print("{0:<22} {1:<7} {2:>8} {3:>10} {4:>10} {5:>8}".format("case", "format", "rows", "before", "after", "ratio"))
+    print("\n".join(lines))
+    return 1 if regressions else 0
@@ -0,0 +1,224 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from . import typed
+
+# версия схемы файла .sqlite, хранится в таблице meta
+SCHEMA_VERSION = 1
+# колонки таблицы records для колонок таблицы в памяти (typed.to_typed); прочие колонки файла хранятся текстом
+# в колонках extra_0, extra_1, ... в порядке, записанном в meta
+COLUMNS = (("EPOCH", "epoch INTEGER NOT NULL"), ("TYPE", "type TEXT"), ("VALUE", "value REAL"),
+           ("EVENT", "event TEXT"), ("COMMENT", "comment TEXT"))
+# сколько ждать, пока другой процесс держит блокировку записи, с
+BUSY_TIMEOUT = 10
+
+
+def connect(path, write=False):
+    """
+    :param path: путь к файлу .sqlite
+    :param write: соединение для записи: включается WAL, чтобы читатели не ждали пишущего
+    :return: sqlite3.Connection в режиме autocommit (транзакции открываются явно)
+    """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    if write:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL")
+    return connection
+
+
+def _extra_names(count):
+    return ["extra_{0}".format(i) for i in range(count)]
+
+
+def _record_columns(columns):
+    # колонки records без id для колонок файла columns
+    return [definition.split()[0] for _, definition in COLUMNS] + _extra_names(len(columns) - len(typed.FILE_COLUMNS))
+
+
+def file_columns(connection, path):
+    """
+    :param connection: соединение из connect
+    :param path: путь к файлу, для сообщения об ошибке
+    :return: колонки файла в порядке записи (DATE, TYPE, VALUE, COMMENT и прочие колонки Table :: Headings)
+    """
+    try:
+        meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        raise ValueError("{0} is not a patient database".format(path))
+    if meta.get("version") != str(SCHEMA_VERSION):
+        raise ValueError("{0}: unsupported database version {1}".format(path, meta.get("version")))
+    return json.loads(meta["columns"])
+
+
+def _create(connection, columns):
+    # таблица строк создаётся без индекса: при полной записи индекс строится после вставки
+    extras = _extra_names(len(columns) - len(typed.FILE_COLUMNS))
+    connection.execute("DROP TABLE IF EXISTS records")
+    connection.execute("CREATE TABLE records (id INTEGER PRIMARY KEY, {0})".format(
+        ", ".join([definition for _, definition in COLUMNS] + [name + " TEXT" for name in extras])))
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           [("version", str(SCHEMA_VERSION)), ("columns", json.dumps(columns))])
+
+
+def _create_indexes(connection):
+    # (type, epoch) — для выборки серий и поиска удаляемой строки, epoch — для страниц по времени (paging)
+    connection.execute("CREATE INDEX IF NOT EXISTS records_type_epoch ON records (type, epoch)")
+    connection.execute("CREATE INDEX IF NOT EXISTS records_epoch ON records (epoch)")
+
+
+def _nullable(values):
+    # пропуски pandas (NaN, None) -> NULL; массив колонки не меняется (он может быть самой колонкой таблицы)
+    values = np.asarray(values, dtype=object)
+    return np.where(pd.isna(values), None, values)
+
+
+def _rows(df: pd.DataFrame, columns):
+    """
+    :param df: pd.DataFrame из typed.to_typed
+    :param columns: колонки файла (file_columns)
+    :return: список кортежей значений в порядке колонок records без id
+    """
+    arrays = [df["EPOCH"].to_numpy(dtype=np.int64).tolist()]
+    for column in ("TYPE", "VALUE", "EVENT", "COMMENT"):
+        arrays.append(_nullable(df[column].to_numpy(dtype=object)).tolist())
+    for column in columns[len(typed.FILE_COLUMNS):]:
+        arrays.append(_nullable(df[column].to_numpy(dtype=object) if column in df.columns
+                                else np.full(len(df), None, dtype=object)).tolist())
+    return list(zip(*arrays))
+
+
+def write_frame(path, df: pd.DataFrame):
+    """
+    Полная запись таблицы одной транзакцией: читатели до её конца видят прежнее содержимое.
+    :param path: путь к файлу .sqlite (создаётся, если его нет)
+    :param df: pd.DataFrame из typed.to_typed
+    :return:
+    """
+    columns = typed.display_columns(df)
+    names = _record_columns(columns)
+    connection = connect(path, write=True)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            _create(connection, columns)
+            connection.executemany("INSERT INTO records ({0}) VALUES ({1})".format(
+                ", ".join(names), ", ".join("?" * len(names))), _rows(df, columns))
+            _create_indexes(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+
+
+def apply_changes(path, changes):
+    """
+    Построчная запись изменений одной транзакцией. Удаляемая строка ищется по индексу (type, epoch) среди строк
+    с теми же значениями всех колонок; удаление, для которого строки нет, пропускается, как в журнале.
+    :param path: путь к файлу .sqlite
+    :param changes: список пар (операция "+" или "-", pd.DataFrame строк из typed.to_typed) в порядке изменений
+    :return:
+    """
+    connection = connect(path, write=True)
+    try:
+        columns = file_columns(connection, path)
+        names = _record_columns(columns)
+        insert = "INSERT INTO records ({0}) VALUES ({1})".format(", ".join(names), ", ".join("?" * len(names)))
+        # IS сравнивает и пропуски: NULL IS NULL
+        delete = ("DELETE FROM records WHERE id = (SELECT id FROM records WHERE {0} ORDER BY id LIMIT 1)"
+                  .format(" AND ".join("{0} IS ?".format(name) for name in names)))
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # в базах, записанных до появления индекса по epoch, он строится при первом сохранении
+            _create_indexes(connection)
+            for op, rows in changes:
+                if op == "+":
+                    connection.executemany(insert, _rows(rows, columns))
+                else:
+                    for row in _rows(rows, columns):
+                        connection.execute(delete, row)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+
+
+def read_frame(path, start=None, stop=None, types=None):
+    """
+    Чтение строк в порядке времени (строки с одинаковым временем — в порядке добавления).
+    :param path: путь к файлу .sqlite
+    :param start: наименьший EPOCH (включительно), None — без ограничения
+    :param stop: наибольший EPOCH (включительно), None — без ограничения
+    :param types: значения TYPE, None — все типы
+    :return: pd.DataFrame из typed.to_typed (без колонки INVALID)
+    """
+    connection = connect(path)
+    try:
+        columns = file_columns(connection, path)
+        names = _record_columns(columns)
+        conditions, parameters = list(), list()
+        if types is not None:
+            types = list(types)
+            conditions.append("type IN ({0})".format(", ".join("?" * len(types))))
+            parameters += types
+        if start is not None:
+            conditions.append("epoch >= ?")
+            parameters.append(int(start))
+        if stop is not None:
+            conditions.append("epoch <= ?")
+            parameters.append(int(stop))
+        query = "SELECT id, {0} FROM records".format(", ".join(names))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+    return _frame(rows, columns)
+
+
+def epoch_bounds(path):
+    """
+    Время первой и последней строки по индексу, без чтения таблицы.
+    :param path: путь к файлу .sqlite
+    :return: (наименьший EPOCH, наибольший EPOCH) или (None, None) для пустой таблицы
+    """
+    connection = connect(path)
+    try:
+        file_columns(connection, path)
+        # MIN и MAX по индексу берутся отдельными запросами: вместе SQLite считает их обходом всей таблицы
+        first = connection.execute("SELECT MIN(epoch) FROM records").fetchone()[0]
+        last = connection.execute("SELECT MAX(epoch) FROM records").fetchone()[0]
+    finally:
+        connection.close()
+    return first, last
+
+
+def _frame(rows, columns):
+    # столбцы выборки: id, epoch, type, value, event, comment, extra_0, ...; from_records разбирает кортежи
+    # в массивы колонок без промежуточных списков Python
+    names = ["id"] + _record_columns(columns)
+    records = pd.DataFrame.from_records(rows, columns=names)
+    ids = records["id"].to_numpy(dtype=np.int64)
+    epochs = records["epoch"].to_numpy(dtype=np.int64)
+    order = np.lexsort((ids, epochs))
+
+    def text(name):
+        # NULL -> NaN, как у строк, прочитанных pandas
+        values = records[name].to_numpy(dtype=object)[order]
+        values[pd.isna(values)] = np.nan
+        return values
+    df = pd.DataFrame({
+        "EPOCH": epochs[order],
+        "TYPE": typed.categorical(text("type"), typed.TYPES),
+        "VALUE": records["value"].to_numpy(dtype=float, na_value=np.nan)[order],
+        "EVENT": typed.text_column(text("event")),
+        "COMMENT": typed.text_column(text("comment")),
+    })
+    for column, name in zip(columns[len(typed.FILE_COLUMNS):], names[len(COLUMNS) + 1:]):
+        df[column] = text(name)
+    return df
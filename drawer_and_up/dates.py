@@ -0,0 +1,226 @@
+import time
+import datetime
+import numpy as np
+import pandas as pd
+
+DATE_PATTERN = "%d/%m/%Y %H:%M"
+ISO_PATTERN = "%Y-%m-%d %H:%M:%S"
+# ожидаемый формат в сообщении об ошибке разбора; строка без "/" разбирается как ISO, но могла быть и неудачной
+# попыткой ввести основной формат
+EXPECTED_FORMATS = {DATE_PATTERN: "dd/mm/YYYY HH:MM", ISO_PATTERN: "dd/mm/YYYY HH:MM or YYYY-mm-dd HH:MM:SS"}
+
+# раскладка строк фиксированной ширины: (позиция, длина) для года, месяца, дня, часа, минуты, секунды
+# и (позиция, символ) для разделителей
+_LAYOUTS = {
+    DATE_PATTERN: {
+        "width": 16,
+        "fields": ((6, 4), (3, 2), (0, 2), (11, 2), (14, 2), None),
+        "separators": ((2, "/"), (5, "/"), (10, " "), (13, ":")),
+    },
+    ISO_PATTERN: {
+        "width": 19,
+        "fields": ((0, 4), (5, 2), (8, 2), (11, 2), (14, 2), (17, 2)),
+        "separators": ((4, "-"), (7, "-"), (10, " "), (13, ":"), (16, ":")),
+    },
+}
+
+
+def _compose(years, months, days, hours, minutes, seconds):
+    """
+    Собирает naive datetime64[s] из целочисленных компонент.
+    :return: (np.ndarray datetime64[s], маска корректных дат)
+    """
+    month_start = ((years - 1970) * 12 + months - 1).astype("datetime64[M]")
+    days_in_month = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(np.int64)
+    valid = ((months >= 1) & (months <= 12) & (days >= 1) & (days <= days_in_month)
+             & (hours < 24) & (minutes < 60) & (seconds < 60))
+    naive = (month_start.astype("datetime64[D]").astype("datetime64[s]")
+             + ((days - 1) * 86400 + hours * 3600 + minutes * 60 + seconds).astype("timedelta64[s]"))
+    return naive, valid
+
+
+def _parse_fixed(text, pattern):
+    """
+    Быстрый разбор строк строго заданной ширины (с ведущими нулями) арифметикой над кодами символов.
+    :param text: np.ndarray строк (unicode dtype)
+    :param pattern: DATE_PATTERN или ISO_PATTERN
+    :return: (np.ndarray datetime64[s], маска строк, разобранных без ошибок)
+    """
+    layout = _LAYOUTS[pattern]
+    width = layout["width"]
+    count = len(text)
+    max_width = text.dtype.itemsize // 4
+    if count == 0 or max_width < width:
+        return np.zeros(count, dtype="datetime64[s]"), np.zeros(count, dtype=bool)
+    codes = text.view(np.uint32).reshape(count, max_width)
+    ok = np.ones(count, dtype=bool)
+    if max_width > width:
+        ok &= codes[:, width] == 0
+    for position, symbol in layout["separators"]:
+        ok &= codes[:, position] == ord(symbol)
+    components = []
+    for field in layout["fields"]:
+        if field is None:
+            components.append(np.zeros(count, dtype=np.int64))
+            continue
+        start, length = field
+        chunk = codes[:, start:start + length].astype(np.int64) - ord("0")
+        ok &= ((chunk >= 0) & (chunk <= 9)).all(axis=1)
+        value = chunk[:, 0]
+        for i in range(1, length):
+            value = value * 10 + chunk[:, i]
+        components.append(value)
+    # значения в неразобранных строках заменяем на безопасные, чтобы не получить переполнение в datetime64
+    components = [np.where(ok, value, 1) for value in components]
+    naive, valid = _compose(*components)
+    return naive, ok & valid
+
+
+def parse_dates(array):
+    """
+    Векторный разбор строк дат в форматах dd/mm/YYYY HH:MM и YYYY-mm-dd HH:MM:SS. Формат определяется
+    для файла целиком, смешанный файл разбирается по маскам. Строки без ведущих нулей разбираются через pandas,
+    некорректные приводят к ValueError.
+    :param array: последовательность строк дат
+    :return: (np.ndarray naive datetime64[s], маска строк, уже записанных в виде DATE_PATTERN)
+    """
+    dates = np.asarray(array, dtype=object)
+    dates = np.where(pd.isna(dates), "", dates)
+    text = dates.astype(str)
+    count = len(text)
+    naive = np.zeros(count, dtype="datetime64[s]")
+    canonical = np.zeros(count, dtype=bool)
+    if count == 0:
+        return naive, canonical
+    is_dmy = (text.view(np.uint32).reshape(count, -1) == ord("/")).any(axis=1)
+    for pattern, mask in ((DATE_PATTERN, is_dmy), (ISO_PATTERN, ~is_dmy)):
+        if not mask.any():
+            continue
+        subset = text if mask.all() else text[mask]
+        parsed, ok = _parse_fixed(subset, pattern)
+        if not ok.all():
+            # сообщение pandas об ошибке длинное и с советами про format, поэтому ошибки собираем сами
+            slow = pd.to_datetime(pd.Series(subset[~ok]), format=pattern, errors="coerce")
+            if slow.isna().any():
+                raise ValueError("Wrong date {0!r}, expected {1}".format(
+                    str(subset[~ok][slow.isna().to_numpy()][0]), EXPECTED_FORMATS[pattern]))
+            parsed[~ok] = slow.to_numpy(dtype="datetime64[s]")
+        naive[mask] = parsed
+        if pattern == DATE_PATTERN:
+            canonical[mask] = ok
+    return naive, canonical
+
+
+def invalid_dates(array):
+    """
+    Маска строк дат, которые не разбираются parse_dates. Файл без ошибок проверяется одним векторным разбором,
+    иначе каждая уникальная строка разбирается отдельно.
+    :param array: последовательность строк дат
+    :return: np.ndarray bool
+    """
+    dates = np.asarray(array, dtype=object)
+    try:
+        parse_dates(dates)
+        return np.zeros(len(dates), dtype=bool)
+    except ValueError:
+        pass
+    inverse, uniques = pd.factorize(dates)
+    bad = np.zeros(len(uniques) + 1, dtype=bool)
+    for code, value in enumerate(uniques):
+        try:
+            parse_dates([value])
+        except (ValueError, OverflowError):
+            bad[code] = True
+    # код -1 — пропуск
+    bad[-1] = True
+    return bad[inverse]
+
+
+def epochs_from_datetimes(naive):
+    """
+    Перевод наивных локальных дат в секунды эпохи так же, как это делает time.mktime.
+    Смещение часового пояса (с учётом перехода на летнее время) считается один раз на каждый уникальный час.
+    :param naive: np.ndarray datetime64[s]
+    :return: np.ndarray int64
+    """
+    naive = np.asarray(naive, dtype="datetime64[s]").astype(np.int64)
+    if naive.size == 0:
+        return naive
+    hours, inverse = np.unique(naive // 3600, return_inverse=True)
+    offsets = np.array([time.mktime((datetime.datetime(1970, 1, 1) + datetime.timedelta(hours=int(h))).timetuple())
+                        - int(h) * 3600 for h in hours], dtype=np.int64)
+    return naive + offsets[inverse.ravel()]
+
+
+def format_dates(naive):
+    """
+    Векторное форматирование naive datetime64 в строки вида dd/mm/YYYY HH:MM.
+    :param naive: np.ndarray datetime64
+    :return: np.ndarray строк
+    """
+    naive = np.asarray(naive, dtype="datetime64[m]")
+    count = len(naive)
+    months = naive.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]").astype(np.int64) + 1970
+    month_numbers = months.astype(np.int64) % 12 + 1
+    days = (naive.astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64) + 1
+    minutes_of_day = (naive - naive.astype("datetime64[D]")).astype(np.int64)
+    codes = np.empty((count, 16), dtype=np.uint32)
+    for start, length, value in ((0, 2, days), (3, 2, month_numbers), (6, 4, years),
+                                 (11, 2, minutes_of_day // 60), (14, 2, minutes_of_day % 60)):
+        for i in range(length - 1, -1, -1):
+            codes[:, start + i] = value % 10 + ord("0")
+            value = value // 10
+    for position, symbol in _LAYOUTS[DATE_PATTERN]["separators"]:
+        codes[:, position] = ord(symbol)
+    return codes.view("<U16").ravel()
+
+
+def dates_from_epochs(epochs):
+    """
+    Векторный обратный перевод секунд эпохи в строки dd/mm/YYYY HH:MM по местному времени,
+    как datetime.fromtimestamp; смещение часового пояса считается один раз на каждый уникальный час.
+    :param epochs: np.ndarray int64
+    :return: np.ndarray строк
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if epochs.size == 0:
+        return np.empty(0, dtype="<U16")
+    hours, inverse = np.unique(epochs // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(int(h) * 3600).tm_gmtoff for h in hours], dtype=np.int64)
+    return format_dates((epochs + offsets[inverse.ravel()]).astype("datetime64[s]"))
+
+
+def timestamps_from_dates(array):
+    naive, _ = parse_dates(array)
+    return epochs_from_datetimes(naive)
+
+
+def date_from_timestamp(value):
+    res = datetime.datetime.fromtimestamp(int(value)).strftime(DATE_PATTERN)
+    return res
+
+
+def reformat_dates(value):
+    ts = timestamps_from_dates([value])
+    date = date_from_timestamp(ts[0])
+    return date
+
+
+def normalize_dates(df):
+    """
+    Приводит колонку DATE к виду dd/mm/YYYY HH:MM и добавляет колонку EPOCH (int64, секунды эпохи),
+    по которой далее идут сортировка, отрисовка и расчёт диапазонов. Уже приведённые строки не переписываются.
+    :param df: pd.DataFrame с колонкой DATE
+    :return: тот же pd.DataFrame
+    """
+    if len(df) > 0:
+        naive, canonical = parse_dates(df["DATE"])
+        if not canonical.all():
+            dates = df["DATE"].to_numpy(dtype=object, copy=True)
+            dates[~canonical] = format_dates(naive[~canonical]).astype(object)
+            df["DATE"] = dates
+        df["EPOCH"] = epochs_from_datetimes(naive)
+    else:
+        df["EPOCH"] = np.empty(0, dtype=np.int64)
+    return df
@@ -1,5 +1,27 @@
+import io
 import os
+import threading
+import numpy as np
 import pandas as pd
+from . import database
+from . import dates
+from . import instrument
+from . import paging
+from . import typed
+from . import validators
+
+# колонки, которые есть только в памяти и не сохраняются в файл: время в секундах эпохи, текст событий
+# (typed.to_typed) и маска строк с недопустимыми значениями (validators.invalid_rows)
+SERVICE_COLUMNS = typed.INTERNAL_COLUMNS
+# версия формата кеша, при изменении формата старые кеши считаются устаревшими
+CACHE_VERSION = 3
+# колонка журнала с типом записи: "+" — строка добавлена, "-" — строка удалена (правка — пара "-" и "+")
+JOURNAL_OP = "OP"
+# расширение файла базы SQLite (database): изменения пишутся в неё построчно, без журнала и кеша
+DATABASE_EXTENSION = ".sqlite"
+# сколько последних прочитанных байт CSV сверяется перед дочитыванием (read_appended): если они изменились,
+# файл переписан, а не дополнен
+TAIL_MARK_BYTES = 64
 
 
 def parse_filename(_path: str):
@@ -8,21 +30,232 @@ def parse_filename(_path: str):
     return file_name, extension
 
 
+def _no_progress(percent, text):
+    pass
+
+
+def normalize_frame(df: pd.DataFrame, progress=_no_progress):
+    """
+    Приведение только что прочитанной таблицы: запятые в VALUE, даты в DATE и EPOCH, сортировка по времени.
+    :param df: pd.DataFrame, прочитанный load_file
+    :param progress: функция (проценты, название этапа), вызывается перед каждым этапом
+    :return: тот же pd.DataFrame
+    """
+    # нужно убедиться, что DataFrame не пуст (иначе хер нам, а не сортировка)
+    if df.size > 0:
+        progress(40, "Fixing decimal commas")
+        # исправляем запятые
+        df["VALUE"] = df["VALUE"].str.replace(",", ".", regex=False)
+    progress(55, "Parsing dates")
+    # один раз разбираем даты в колонку EPOCH и сортируем по ней (на всякий случай)
+    dates.normalize_dates(df)
+    progress(75, "Sorting")
+    df.sort_values(by="EPOCH", kind="mergesort", inplace=True, ignore_index=True)
+    return df
+
+
+class _Prefix(io.RawIOBase):
+    # первые size байт открытого файла: строки, дописанные во время чтения, дочитает read_appended
+    def __init__(self, handle, size):
+        super(_Prefix, self).__init__()
+        self._handle = handle
+        self._left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._handle.read(min(len(buffer), self._left))
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+
+def _no_rows():
+    df = typed.empty_frame()
+    df["INVALID"] = np.zeros(0, dtype=bool)
+    return df
+
+
+def insert_sorted(df: pd.DataFrame, values: pd.DataFrame):
+    """
+    Вставляет строки на их места по времени бинарным поиском по колонке EPOCH, без полной сортировки.
+    Строки с одинаковым временем встают после уже существующих.
+    :param df: pd.DataFrame, отсортированный по EPOCH
+    :param values: pd.DataFrame новых строк с колонкой EPOCH
+    :return: (новый pd.DataFrame, позиции вставки в нумерации df, как для np.insert)
+    """
+    # категориальные колонки склеиваются без перехода в object, только если категории совпадают
+    df = df.copy(deep=False)
+    values = typed.conform(df, values)
+    values = values.sort_values(by="EPOCH", kind="mergesort", ignore_index=True)
+    positions = np.searchsorted(df["EPOCH"].to_numpy(), values["EPOCH"].to_numpy(), side="right")
+    count = len(df)
+    order = np.insert(np.arange(count), positions, np.arange(count, count + len(values)))
+    return pd.concat([df, values], ignore_index=True).take(order).reset_index(drop=True), positions
+
+
+def sort_by_time(df: pd.DataFrame):
+    """
+    Стабильная сортировка по EPOCH: строки с одинаковым временем сохраняют порядок. Уже упорядоченная таблица
+    (файл записан по времени) возвращается без копирования.
+    :param df: pd.DataFrame с колонкой EPOCH
+    :return: pd.DataFrame
+    """
+    epochs = df["EPOCH"].to_numpy()
+    if (epochs[1:] >= epochs[:-1]).all():
+        return df
+    return df.take(np.argsort(epochs, kind="stable")).reset_index(drop=True)
+
+
+def pack_strings(values):
+    """
+    Упаковка строковой колонки для кеша: коды уникальных значений и сами уникальные значения. Если строки
+    примерно одной длины, уникальные значения хранятся массивом фиксированной ширины, иначе — подряд в utf-8
+    с массивом смещений, чтобы одна длинная строка не раздувала весь массив.
+    :param values: последовательность строк (пропуски допустимы)
+    :return: dict массивов; пропуски кодируются -1
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = [str(value) for value in uniques]
+    lengths = np.array([len(value) for value in uniques], dtype=np.int64)
+    packed = {"codes": codes.astype(np.int32)}
+    if len(uniques) == 0 or lengths.max() * len(uniques) <= 2 * lengths.sum() + len(uniques):
+        packed["uniques"] = np.array(uniques, dtype=str)
+    else:
+        encoded = [value.encode("utf-8") for value in uniques]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        packed["blob"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        packed["offsets"] = offsets
+    return packed
+
+
+def unpack_strings(packed):
+    """
+    Обратное к pack_strings преобразование.
+    :param packed: dict массивов из pack_strings
+    :return: np.ndarray строк (object), пропуски — np.nan
+    """
+    if "uniques" in packed:
+        uniques = np.append(packed["uniques"].astype(object), np.nan)
+    else:
+        raw = packed["blob"].tobytes()
+        offsets = packed["offsets"]
+        uniques = np.empty(len(offsets), dtype=object)
+        uniques[:-1] = [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        uniques[-1] = np.nan
+    # последний элемент — для кода -1
+    return uniques[packed["codes"]]
+
+
+def _prefixed(cache, prefix):
+    # массивы кеша с ключами prefix + ..., ключи без префикса
+    return {key[len(prefix):]: cache[key] for key in cache.files if key.startswith(prefix)}
+
+
+def same_records(df: pd.DataFrame, record):
+    """
+    :param df: pd.DataFrame строк-кандидатов
+    :param record: значения одной строки в порядке колонок df
+    :return: маска строк df, совпадающих с record во всех колонках (пропуск равен пропуску)
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in zip(df.columns, record):
+        values = df[column].to_numpy(dtype=object)
+        if pd.isna(value):
+            mask &= pd.isna(values)
+        else:
+            mask &= values == value
+    return mask
+
+
+def apply_journal(df: pd.DataFrame, journal: pd.DataFrame):
+    """
+    Накатывает записи журнала на таблицу по порядку: подряд идущие добавления вставляются одним insert_sorted,
+    удаляемая строка ищется только среди строк с тем же EPOCH. Запись об удалении, для которой строки нет,
+    пропускается.
+    :param df: pd.DataFrame из typed.to_typed, отсортированный по времени
+    :param journal: pd.DataFrame журнала (колонка JOURNAL_OP и колонки файла), уже приведённый normalize_dates
+    :return: новый pd.DataFrame
+    """
+    ops = journal[JOURNAL_OP].to_numpy(dtype=object)
+    records = typed.to_typed(journal.drop(columns=[JOURNAL_OP]))
+    columns = [column for column in records.columns if column != "INVALID"]
+    # границы серий одинаковых операций
+    bounds = np.flatnonzero(ops[1:] != ops[:-1]) + 1
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(ops)]):
+        group = records.iloc[start:stop].reset_index(drop=True)
+        if ops[start] == "+":
+            df = insert_sorted(df, group[list(df.columns)])[0]
+            continue
+        epochs = df["EPOCH"].to_numpy()
+        keep = np.ones(len(df), dtype=bool)
+        for record, epoch in zip(group[columns].itertuples(index=False), group["EPOCH"].to_numpy()):
+            first, last = np.searchsorted(epochs, [epoch, epoch + 1])
+            found = np.flatnonzero(same_records(df[columns].iloc[first:last], record) & keep[first:last])
+            if len(found) > 0:
+                keep[first + found[0]] = False
+        df = df[keep].reset_index(drop=True)
+    return df
+
+
 class FileHandler:
+    """
+    Чтение и запись файла таблицы. Для CSV и XLSX сохранение может идти через журнал: изменения, о которых
+    сообщено через record_change, дописываются в файл журнала рядом с таблицей (save_file стоит O(изменений)),
+    а при открытии журнал накатывается на прочитанную таблицу. Когда в журнале набирается Table :: JournalRows
+    записей, таблица целиком переписывается (compact) и журнал очищается.
+    Файл целиком всегда пишется во временный файл рядом и подменяет исходный через os.replace, так что сбой
+    во время записи не портит файл пациента. Запись (store) можно выполнять в фоновом потоке.
+    Файл .sqlite (DATABASE_EXTENSION) — база с индексом (type, epoch): изменения вносятся в неё построчно одной
+    транзакцией, а read_range читает только строки из промежутка времени. Длинная запись из базы (дольше
+    Table :: PageDays дней) открывается не целиком: читаются последние PageDays дней, а более ранние страницы
+    догружаются load_pages (pages — границы загруженной части).
+    Строки, дописанные в конец CSV другими программами после чтения, дочитывает read_appended: запоминается,
+    сколько байт файла уже прочитано, и разбираются только новые полные строки.
+    """
     def __init__(self, path, q_dict):
         self._status_saved = True
         self._status_opening = False
         self._path = path
         self._file_name, self._file_extension = parse_filename(self._path)
         self.q_dict = q_dict
+        # несохранённые записи журнала (pd.DataFrame с колонкой JOURNAL_OP)
+        self._pending = list()
+        # число строк в файле с учётом журнала; None — неизвестно, сохранять только целиком
+        self._saved_rows = None
+        self._journal_rows = 0
+        # загруженная часть базы (paging.Pages); None — таблица прочитана целиком
+        self.pages = None
+        # прочитанная часть CSV для read_appended: число байт, последние байты, заголовок и номер файла;
+        # _tail_offset None — файл не наблюдается
+        self._tail_offset = None
+        self._tail_mark = b""
+        self._tail_header = b""
+        self._tail_inode = None
+        # номер изменения таблицы, растёт при каждом set_status_saved(False)
+        self._revision = 0
+        # функции от нового состояния status_saved, вызываются при каждом set_status_saved
+        self.status_listeners = list()
+        # запись файла и журнала из фонового уплотнения и из потока GUI не должны пересекаться
+        self._write_lock = threading.RLock()
 
     @property
     def status_saved(self):
         return self._status_saved
 
+    @property
+    def revision(self):
+        return self._revision
+
     def set_status_saved(self, state=False):
         if isinstance(state, bool):
             self._status_saved = state
+            if not state:
+                self._revision += 1
+            for listener in self.status_listeners:
+                listener(state)
         else:
             raise ValueError("State bool type expected, got {}".format(type(state)))
 
@@ -48,28 +281,561 @@ class FileHandler:
     def file_extension(self):
         return self._file_extension
 
-    def load_file(self):
+    @property
+    def is_database(self):
+        return self.file_extension == DATABASE_EXTENSION
+
+    @property
+    def watched(self):
+        return self._tail_offset is not None
+
+    @property
+    def partial(self):
+        # в памяти только часть строк базы: сохранять можно только построчно
+        return self.pages is not None and not self.pages.complete
+
+    @property
+    def cache_path(self):
+        directory, file_name = os.path.split(self.path)
+        return os.path.join(directory, ".{0}.cache.npz".format(file_name))
+
+    @property
+    def journal_path(self):
+        directory, file_name = os.path.split(self.path)
+        return os.path.join(directory, ".{0}.journal.csv".format(file_name))
+
+    @property
+    def needs_compaction(self):
+        return self._journal_rows >= self.q_dict.get("JournalRows", 0) > 0
+
+    @instrument.timed("load_table", rows=lambda df, *_, **__: len(df))
+    def load_table(self, progress=_no_progress, partial=None):
+        """
+        Загрузка уже приведённой таблицы (normalize_frame). Если рядом с файлом лежит действительный кеш
+        (тот же размер и время изменения файла), таблица читается из него, иначе файл разбирается заново,
+        а кеш перестраивается.
+        :param progress: функция (проценты, название этапа), вызывается перед каждым этапом;
+        исключение из неё прерывает загрузку
+        :param partial: функция от уже прочитанной части таблицы, вызывается после каждого куска CSV
+        :return: pd.DataFrame из typed.to_typed с колонкой INVALID, отсортированный по времени
+        """
+        progress(0, "Reading cache")
+        self._tail_offset = None
+        # размер и время изменения файла до чтения: дописанное во время чтения не читается и не попадает в кеш
+        key = None if self.is_database else self._source_key()
+        df = self.read_cache(key)
+        if df is None:
+            df = self.read_normalized(progress, partial, None if key is None else int(key[1]))
+            if not self.is_database:
+                progress(90, "Writing cache")
+                self.write_cache(df, key=key)
+        if self.file_extension == ".csv":
+            self._watch_from(int(key[1]))
+        if os.path.isfile(self.journal_path):
+            progress(95, "Replaying journal")
+            df = self.replay_journal(df)
+        progress(97, "Validating values")
+        df["INVALID"] = validators.invalid_rows(df)
+        self._pending = list()
+        self._saved_rows = len(df)
+        progress(100, "Done")
+        return df
+
+    def replay_journal(self, df: pd.DataFrame):
+        """
+        Накатывает журнал рядом с файлом на прочитанную таблицу (кеш хранит таблицу без журнала).
+        :param df: pd.DataFrame из typed.to_typed, отсортированный по времени
+        :return: pd.DataFrame с учётом журнала
+        """
+        with self._write_lock:
+            journal = pd.read_csv(self.journal_path, sep=self.q_dict["Delimiter"], dtype=str)
+        self._journal_rows = len(journal)
+        # недописанная при сбое последняя запись пропускается
+        journal = journal[journal[JOURNAL_OP].isin(["+", "-"]) & journal["DATE"].notna()]
+        if len(journal) == 0:
+            return df
+        return apply_journal(df, dates.normalize_dates(journal))
+
+    def read_normalized(self, progress=_no_progress, partial=None, size=None):
+        """
+        Чтение файла с приведением. CSV при заданном Table :: ChunkRows читается кусками по ChunkRows строк:
+        каждый кусок сразу приводится, так что в памяти одновременно находятся приведённые куски и один сырой кусок;
+        в конце куски склеиваются и один раз стабильно сортируются (для строк одного времени порядок тот же,
+        что при сортировке всего файла). Прочитанная часть передаётся в partial каждый раз, когда число
+        прочитанных строк удваивается, поэтому её склейки в сумме копируют не больше двух таблиц.
+        :param progress: см. load_table
+        :param partial: см. load_table
+        :param size: сколько первых байт CSV читать, по умолчанию весь файл
+        :return: pd.DataFrame из typed.to_typed, отсортированный по времени
+        """
+        if self.is_database:
+            progress(5, "Reading database")
+            self.pages = None
+            page_seconds = self.q_dict.get("PageDays", 0) * paging.DAY
+            first, last = database.epoch_bounds(self.path) if page_seconds > 0 else (None, None)
+            if first is None or last - first < page_seconds:
+                return database.read_frame(self.path)
+            self.pages = paging.Pages(first, last, page_seconds)
+            return database.read_frame(self.path, start=self.pages.start)
+        chunk_rows = self.q_dict.get("ChunkRows", 0)
+        if self.file_extension != ".csv" or not chunk_rows:
+            progress(5, "Reading file")
+            df = normalize_frame(self.load_file(size), progress)
+            progress(80, "Converting columns")
+            return typed.to_typed(df)
+        if size is None:
+            size = os.path.getsize(self.path)
+        chunks = list()
+        rows = 0
+        shown = 0
+        with open(self.path, "rb") as handle:
+            for chunk in pd.read_csv(io.BufferedReader(_Prefix(handle, size)), sep=self.q_dict["Delimiter"],
+                                     dtype=str, chunksize=chunk_rows):
+                progress(min(int(85 * handle.tell() / max(size, 1)), 85), "Reading file")
+                chunks.append(typed.to_typed(normalize_frame(chunk)))
+                rows += len(chunks[-1])
+                if partial is not None and rows >= 2 * shown:
+                    partial(sort_by_time(typed.concat(chunks)))
+                    shown = rows
+        if not chunks:
+            # в файле только заголовок
+            return typed.to_typed(normalize_frame(self.load_file(size)))
+        df = typed.concat(chunks)
+        # куски уже склеены: до сортировки в памяти остаётся только склейка
+        chunks.clear()
+        progress(85, "Sorting")
+        return sort_by_time(df)
+
+    def read_range(self, start=None, stop=None, types=None):
+        """
+        Строки из промежутка времени, например видимого окна графика, без чтения всей таблицы.
+        Только для базы (DATABASE_EXTENSION); несохранённые изменения не учитываются.
+        :param start: наименьший EPOCH (включительно), None — без ограничения
+        :param stop: наибольший EPOCH (включительно), None — без ограничения
+        :param types: значения TYPE, None — все типы
+        :return: pd.DataFrame из typed.to_typed с колонкой INVALID, отсортированный по времени
+        """
+        if not self.is_database:
+            raise ValueError("{0} is not a database".format(self.file_name))
+        df = database.read_frame(self.path, start, stop, types)
+        df["INVALID"] = validators.invalid_rows(df)
+        return df
+
+    def load_pages(self, left, right):
+        """
+        Догружает страницы базы, которых не хватает, чтобы в памяти была часть записи от left до right.
+        Строки этих страниц ещё не могут быть в таблице, поэтому их можно просто вставить (insert_sorted).
+        :param left: наименьший нужный EPOCH
+        :param right: наибольший нужный EPOCH
+        :return: pd.DataFrame из read_range с прочитанными строками или None, если всё уже загружено
+        """
+        if self.pages is None:
+            return None
+        parts = list()
+        for start, stop in self.pages.missing(left, right):
+            parts.append(self.read_range(start, stop - 1))
+            self.pages.loaded(start, stop)
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+    def _source_key(self, path=None):
+        stat = os.stat(self.path if path is None else path)
+        return np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def read_cache(self, key=None):
+        """
+        :param key: _source_key файла, по умолчанию текущий
+        :return: pd.DataFrame из кеша или None, если кеша нет, он выключен или устарел
+        """
+        if not self.q_dict.get("Cache", False) or self.is_database or not os.path.isfile(self.cache_path):
+            return None
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                if (not np.array_equal(cache["key"], self._source_key() if key is None else key)
+                        or str(cache["delimiter"]) != self.q_dict["Delimiter"]):
+                    return None
+                columns = {"EPOCH": cache["epoch"]}
+                for column, kind in zip(cache["columns"], cache["kinds"]):
+                    column = str(column)
+                    if kind == "category":
+                        categories = unpack_strings(_prefixed(cache, column + ".categories."))
+                        columns[column] = pd.Categorical.from_codes(cache[column + ".codes"], categories=categories)
+                    elif kind == "float":
+                        columns[column] = cache[column + ".values"]
+                    else:
+                        columns[column] = unpack_strings(_prefixed(cache, column + "."))
+                return pd.DataFrame(columns)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write_cache(self, df: pd.DataFrame, path=None, key=None):
+        """
+        Записывает таблицу (typed.to_typed) в кеш рядом с файлом: категориальные колонки — кодами и категориями,
+        числа — как есть, прочие колонки — через pack_strings. Ошибки записи (например, каталог только для чтения)
+        не мешают работе.
+        :param df: pd.DataFrame из typed.to_typed
+        :param path: файл, для которого пишется кеш (по умолчанию self.path)
+        :param key: _source_key прочитанного файла, по умолчанию текущий
+        :return:
+        """
+        handler = self if path is None else FileHandler(path, self.q_dict)
+        if not self.q_dict.get("Cache", False) or handler.is_database:
+            return
+        columns = [column for column in df.columns if column not in ("EPOCH", "INVALID")]
+        arrays = {
+            "key": handler._source_key() if key is None else key,
+            "delimiter": np.array(self.q_dict["Delimiter"]),
+            "columns": np.array(columns),
+            "epoch": df["EPOCH"].to_numpy(dtype=np.int64),
+        }
+        kinds = list()
+        for column in columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                kinds.append("category")
+                arrays[column + ".codes"] = values.cat.codes.to_numpy(dtype=np.int32)
+                for key, array in pack_strings(values.cat.categories).items():
+                    arrays[column + ".categories." + key] = array
+            elif values.dtype == float:
+                kinds.append("float")
+                arrays[column + ".values"] = values.to_numpy(dtype=float)
+            else:
+                kinds.append("string")
+                for key, array in pack_strings(values).items():
+                    arrays[column + "." + key] = array
+        arrays["kinds"] = np.array(kinds)
+        temp_path = handler.cache_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as cache:
+                np.savez(cache, **arrays)
+            os.replace(temp_path, handler.cache_path)
+        except OSError:
+            pass
+
+    def load_file(self, size=None):
         if self.file_extension in [".xlsx", ".xls", ".ods"]:
             df = pd.read_excel(self.path, dtype=str)
+        elif self.file_extension == ".csv" and size is not None:
+            with open(self.path, "rb") as handle:
+                df = pd.read_csv(io.BufferedReader(_Prefix(handle, size)), sep=self.q_dict["Delimiter"], dtype=str)
         elif self.file_extension == ".csv":
             df = pd.read_csv(self.path, sep=self.q_dict["Delimiter"], dtype=str)
+        elif self.is_database:
+            # строки в том виде, в котором они пишутся в CSV
+            df = typed.to_strings(database.read_frame(self.path))
         else:
             raise ValueError("{0} is not CSV".format(self.file_name))
         return df
 
+    def _watch_from(self, size):
+        """
+        Запоминает, что первые size байт CSV прочитаны и соответствуют таблице в памяти.
+        :param size: число прочитанных (или только что записанных) байт
+        :return:
+        """
+        with open(self.path, "rb") as handle:
+            header = handle.readline()
+            handle.seek(max(size - TAIL_MARK_BYTES, 0))
+            mark = handle.read(size - handle.tell())
+            inode = os.fstat(handle.fileno()).st_ino
+        if not header.endswith(b"\n"):
+            # в файле нет даже строки заголовка
+            self._tail_offset = None
+            return
+        self._tail_header, self._tail_mark, self._tail_inode, self._tail_offset = header, mark, inode, size
+
+    def _unread_lines(self):
+        """
+        Полные строки, дописанные в конец наблюдаемого CSV и ещё не дочитанные read_appended. Вызывается
+        под _write_lock перед заменой файла.
+        :return: bytes (пустые, если новых строк нет или файл переписан другим)
+        """
+        try:
+            with open(self.path, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                if stat.st_ino != self._tail_inode or stat.st_size <= self._tail_offset:
+                    return b""
+                handle.seek(self._tail_offset - len(self._tail_mark))
+                if handle.read(len(self._tail_mark)) != self._tail_mark:
+                    return b""
+                data = handle.read(stat.st_size - self._tail_offset)
+        except OSError:
+            return b""
+        return data[:data.rfind(b"\n") + 1]
+
+    def stop_watching(self):
+        self._tail_offset = None
+
+    def read_appended(self):
+        """
+        Дочитывает строки, дописанные в конец CSV после последнего чтения или записи. Недописанная последняя
+        строка (без перевода строки) остаётся до следующего вызова. Вызывается в потоке GUI; пока идёт запись
+        файла, ничего не читает.
+        :return: pd.DataFrame из typed.to_typed с колонкой INVALID (пустой, если новых строк нет) или None,
+        если файл укорочен, переписан или заменён другим и его нужно прочитать заново
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return _no_rows()
+        try:
+            with open(self.path, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                if stat.st_ino != self._tail_inode or stat.st_size < self._tail_offset:
+                    return None
+                handle.seek(self._tail_offset - len(self._tail_mark))
+                if handle.read(len(self._tail_mark)) != self._tail_mark:
+                    return None
+                data = handle.read(stat.st_size - self._tail_offset)
+        finally:
+            self._write_lock.release()
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return _no_rows()
+        lines = data[:end]
+        df = pd.read_csv(io.BytesIO(self._tail_header + lines), sep=self.q_dict["Delimiter"], dtype=str)
+        df = typed.to_typed(normalize_frame(df))
+        df["INVALID"] = validators.invalid_rows(df)
+        self._tail_offset += end
+        self._tail_mark = (self._tail_mark + lines)[-TAIL_MARK_BYTES:]
+        if self._saved_rows is not None:
+            # дочитанные строки уже есть в файле
+            self._saved_rows += len(df)
+        return df
+
+    def record_change(self, added=None, removed=None):
+        """
+        Запоминает изменение таблицы для следующего сохранения через журнал. Правка строки передаётся
+        как удаление старой строки и добавление новой. Для базы строки хранятся как есть (время с секундами
+        и числа без перевода в текст), чтобы удаление нашло строку по точному совпадению.
+        :param added: pd.DataFrame добавленных строк (typed.to_typed)
+        :param removed: pd.DataFrame удалённых строк (в том виде, в котором они были в таблице)
+        :return:
+        """
+        for op, rows in (("-", removed), ("+", added)):
+            if rows is None or len(rows) == 0:
+                continue
+            if self.is_database:
+                entries = rows.drop(columns=["INVALID"], errors="ignore").reset_index(drop=True)
+            else:
+                entries = typed.to_strings(rows)
+            entries.insert(0, JOURNAL_OP, op)
+            self._pending.append(entries)
+
+    def take_pending(self):
+        """
+        Забирает накопленные изменения для сохранения; вызывается в потоке GUI одновременно со снятием копии
+        таблицы, дальнейшие изменения копятся для следующего сохранения.
+        :return: список pd.DataFrame записей журнала
+        """
+        pending, self._pending = self._pending, list()
+        return pending
+
+    def _can_append(self, df: pd.DataFrame, pending):
+        """
+        Журнал применим, если файл уже записан на своё место и все изменения таблицы известны: проверяется,
+        что число строк в файле с учётом изменений совпадает с таблицей. Для частично загруженной базы число строк
+        не сравнивается: построчная запись не зависит от незагруженных строк.
+        """
+        if self.partial:
+            return os.path.isfile(self.path)
+        if self._saved_rows is None or not os.path.isfile(self.path):
+            return False
+        if not self.is_database and (not self.q_dict.get("Journal", False)
+                                     or self.file_extension not in (".csv", ".xlsx")):
+            return False
+        delta = sum(int((entries[JOURNAL_OP] == "+").sum()) - int((entries[JOURNAL_OP] == "-").sum())
+                    for entries in pending)
+        return self._saved_rows + delta == len(df)
+
+    def journal_size(self):
+        """
+        :return: размер файла журнала в байтах (0, если журнала нет)
+        """
+        with self._write_lock:
+            return os.path.getsize(self.journal_path) if os.path.isfile(self.journal_path) else 0
+
+    @instrument.timed("save_file", rows=lambda _, handler, df: len(df))
     def save_file(self, df: pd.DataFrame):
+        """
+        Синхронное сохранение таблицы в потоке вызова (см. store).
+        :param df: pd.DataFrame
+        :return:
+        """
+        self.store(df, self.take_pending())
+        self.set_status_saved(True)
+
+    @instrument.timed("store", rows=lambda _, handler, df, pending: len(df))
+    def store(self, df: pd.DataFrame, pending):
+        """
+        Записывает таблицу: дописывает изменения в журнал (в базу — построчно), если это возможно, иначе
+        переписывает файл целиком и удаляет журнал. Статус сохранения не меняет. При ошибке следующее сохранение будет полным,
+        поскольку записанные изменения уже забраны; частично загруженная база (partial) целиком не переписывается,
+        и при ошибке изменения возвращаются в очередь.
+        :param df: pd.DataFrame (копия, если запись идёт в фоне)
+        :param pending: изменения из take_pending, соответствующие df
+        :return:
+        """
+        with self._write_lock:
+            try:
+                if self._can_append(df, pending):
+                    if self.is_database:
+                        database.apply_changes(self.path, [(entries[JOURNAL_OP].iat[0],
+                                                            entries.drop(columns=[JOURNAL_OP]))
+                                                           for entries in pending])
+                    elif pending:
+                        self.append_journal(pd.concat(pending, ignore_index=True))
+                elif self.partial:
+                    # полная запись части базы потеряла бы незагруженные строки
+                    raise ValueError("{0} is loaded partially and cannot be rewritten".format(self.file_name))
+                else:
+                    self.write_file(df)
+                    if os.path.isfile(self.journal_path):
+                        os.remove(self.journal_path)
+                    self._journal_rows = 0
+            except Exception:
+                self._saved_rows = None
+                if self.partial:
+                    # транзакция отменена целиком: изменения вернутся в следующее сохранение, а не в полную запись
+                    self._pending[:0] = pending
+                raise
+            self._saved_rows = len(df)
+
+    def append_journal(self, entries: pd.DataFrame):
+        header = not os.path.isfile(self.journal_path)
+        with open(self.journal_path, "a", encoding="utf-8", newline="") as journal:
+            entries.to_csv(journal, sep=self.q_dict["Delimiter"], index=False, header=header)
+            journal.flush()
+            os.fsync(journal.fileno())
+        self._journal_rows += len(entries)
+
+    def append_rows(self, rows: pd.DataFrame):
+        """
+        Дописывает строки в конец файла, не читая его (приём показаний без окна, см. ingest.serve): в базу —
+        одной транзакцией, в CSV — в колонки заголовка файла. Порядок по времени восстановится при чтении.
+        :param rows: pd.DataFrame из typed.to_typed
+        :return:
+        """
+        with self._write_lock:
+            if self.is_database:
+                database.apply_changes(self.path, [("+", rows.drop(columns=["INVALID"], errors="ignore"))])
+                return
+            if self.file_extension != ".csv":
+                raise ValueError("{0} does not support appending rows".format(self.file_name))
+            delimiter = self.q_dict["Delimiter"]
+            with open(self.path, "rb") as handle:
+                header = handle.readline()
+                empty = os.fstat(handle.fileno()).st_size == 0
+                if not empty:
+                    handle.seek(-1, os.SEEK_END)
+                last = handle.read(1)
+            lines = typed.to_strings(rows)
+            if empty:
+                # в пустом файле нет даже заголовка: он пишется, как в create_file
+                for column in self.q_dict["Headings"]:
+                    if column not in lines.columns and column not in typed.FILE_COLUMNS:
+                        lines[column] = np.nan
+            else:
+                lines = lines.reindex(columns=header.decode("utf-8-sig").rstrip("\r\n").split(delimiter))
+            with open(self.path, "a", encoding="utf-8", newline="") as handle:
+                if not empty and last != b"\n":
+                    handle.write("\n")
+                lines.to_csv(handle, sep=delimiter, index=False, header=empty)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def compact(self, df: pd.DataFrame, journal_offset):
+        """
+        Уплотнение журнала: таблица переписывается целиком, а из журнала удаляется всё, что в неё вошло.
+        Может вызываться из фонового потока с копией таблицы: записи, дописанные в журнал после снятия копии
+        (дальше journal_offset байт), остаются в журнале.
+        :param df: копия таблицы, соответствующая файлу с журналом длиной journal_offset байт
+        :param journal_offset: journal_size() на момент снятия копии
+        :return:
+        """
+        with self._write_lock:
+            self.write_file(df)
+            if not os.path.isfile(self.journal_path):
+                return
+            with open(self.journal_path, "rb") as journal:
+                header = journal.readline()
+                journal.seek(max(journal_offset, len(header)))
+                tail = journal.read()
+            if tail:
+                temp_path = self.journal_path + ".tmp"
+                with open(temp_path, "wb") as journal:
+                    journal.write(header + tail)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                os.replace(temp_path, self.journal_path)
+                # строк в хвосте может быть больше, чем записей: комментарий в кавычках бывает многострочным
+                self._journal_rows = len(pd.read_csv(io.BytesIO(header + tail), sep=self.q_dict["Delimiter"],
+                                                     dtype=str))
+            else:
+                os.remove(self.journal_path)
+                self._journal_rows = 0
+
+    def write_file(self, df: pd.DataFrame):
+        """
+        Полная запись таблицы в файл (xls и ods сохраняются рядом как xlsx). База переписывается одной
+        транзакцией на месте: подмена файла через os.replace сломала бы соединения других читателей.
+        :param df: pd.DataFrame из typed.to_typed
+        :return:
+        """
+        if self.is_database:
+            database.write_frame(self.path, df)
+            return
+        full_df = df
+        # в файл пишутся строки, служебные колонки не пишутся
+        df = typed.to_strings(df)
         if self.file_extension == ".xlsx":
-            df.to_excel(self.path, index=False)
+            new_path = self.path
         elif self.file_extension == ".xls" or self.file_extension == ".ods":
             path, _ = os.path.splitext(self.path)
             new_path = path + ".xlsx"
-            df.to_excel(new_path, index=False)
         elif self.file_extension == ".csv":
-            df.to_csv(self.path, sep=self.q_dict["Delimiter"], index=False)
+            new_path = self.path
         else:
             raise ValueError("{0} does not have suitable extension".format(self.file_name))
-        self.set_status_saved(True)
+        # временный файл в том же каталоге (os.replace атомарен только в пределах одной файловой системы)
+        # с тем же расширением, по которому pandas выбирает формат
+        directory, file_name = os.path.split(new_path)
+        temp_path = os.path.join(directory, ".~" + file_name)
+        try:
+            # fsync на Windows требует дескриптора, открытого на запись
+            if new_path.endswith(".xlsx"):
+                df.to_excel(temp_path, index=False)
+                with open(temp_path, "r+b") as handle:
+                    os.fsync(handle.fileno())
+                    stat = os.fstat(handle.fileno())
+                written = stat.st_size
+            else:
+                with open(temp_path, "w", encoding="utf-8", newline="") as handle:
+                    df.to_csv(handle, sep=self.q_dict["Delimiter"], index=False)
+                    handle.flush()
+                    written = os.fstat(handle.fileno()).st_size
+                    if new_path == self.path and self.watched:
+                        # строки, дописанные другой программой после последнего read_appended, переносятся
+                        # в новый файл за таблицей и будут дочитаны как дописанные
+                        handle.buffer.write(self._unread_lines())
+                        handle.flush()
+                    os.fsync(handle.fileno())
+                    stat = os.fstat(handle.fileno())
+            os.replace(temp_path, new_path)
+        except BaseException:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+        # таблица в памяти уже приведена, поэтому сразу обновляем кеш для записанного файла. Ключ — размер записанной
+        # таблицы: если за ней перенесены недочитанные строки или файл успели дописать, кеш с файлом не совпадёт
+        # и при открытии файл будет прочитан целиком
+        self.write_cache(full_df, new_path, key=np.array([CACHE_VERSION, written, stat.st_mtime_ns], dtype=np.int64))
+        if new_path.endswith(".csv") and self.watched:
+            # записанный файл соответствует таблице; дописанное после записи дочитает read_appended
+            self._watch_from(written)
 
     def create_file(self):
-        empty_df = pd.DataFrame(columns=self.q_dict["Headings"])
+        empty_df = typed.empty_frame()
+        for column in self.q_dict["Headings"]:
+            if column not in empty_df.columns and column not in typed.FILE_COLUMNS:
+                empty_df[column] = pd.Series(dtype=object)
         self.save_file(empty_df)
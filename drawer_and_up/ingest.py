@@ -0,0 +1,453 @@
+import os
+import sys
+import json
+import time
+import select
+import socket
+import argparse
+import threading
+import socketserver
+from collections import deque
+import numpy as np
+import pandas as pd
+from . import dates
+from . import settings
+from . import typed
+from . import validators
+from .batch import validate_rows
+
+# колонки показания: пациент (имя файла с расширением или без) и строка таблицы; EPOCH — время в секундах
+# (отправитель может передать его числом вместо даты)
+READING_COLUMNS = ("PATIENT", "DATE", "TYPE", "VALUE", "COMMENT", "EPOCH")
+# сколько байт читается из сокета за раз
+RECV_BYTES = 1 << 16
+# до скольких байт набирается пачка из уже пришедших данных: проверка пачки стоит несколько миллисекунд
+# независимо от её длины, поэтому частые короткие посылки проверяются вместе
+BATCH_BYTES = 1 << 20
+# сколько последних отклонённых показаний хранится для просмотра
+KEPT_ERRORS = 100
+# допустимое время числом: от суток после начала эпохи до конца 9998 года — дата в местном времени
+# при любом часовом поясе остаётся в пределах 1970–9999 годов (год пишется четырьмя цифрами)
+EPOCH_RANGE = (86400, 253370764799)
+
+
+def parse_address(address):
+    """
+    :param address: "host:port" для TCP или "unix:путь" для сокета Unix
+    :return: (семейство сокета, адрес для bind и connect)
+    """
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets are not supported on this platform")
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError("wrong ingest address {0!r}, expected host:port or unix:path".format(address))
+    return socket.AF_INET, (host, int(port))
+
+
+def matches(patient, path):
+    """
+    :param patient: поле patient показания
+    :param path: путь файла пациента
+    :return: True, если показание относится к этому файлу
+    """
+    file_name = os.path.basename(path)
+    return patient in (file_name, os.path.splitext(file_name)[0])
+
+
+def _split_line(line, delimiter):
+    # строка NDJSON или CSV (patient, date, type, value[, comment]) -> кортеж в порядке READING_COLUMNS
+    if line.startswith((b"{", b"[")):
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError("not a JSON object")
+        epoch = item.get("epoch")
+        if item.get("date") is None and epoch is None:
+            raise ValueError("date or epoch is missing")
+        if epoch is not None and (isinstance(epoch, bool) or not isinstance(epoch, (int, float))):
+            raise ValueError("epoch must be a number")
+        # json пропускает Infinity, NaN и числа любой длины, а перевод в дату их не переносит
+        if epoch is not None and not EPOCH_RANGE[0] <= epoch <= EPOCH_RANGE[1]:
+            raise ValueError("epoch {0} is out of range".format(epoch))
+        value = item.get("value")
+        if isinstance(value, float) and value.is_integer():
+            # 300.0 из JSON — то же целое, что и 300: текст "300.0" не прошёл бы правило целых значений
+            value = int(value)
+        return (str(item["patient"]), item.get("date"), str(item["type"]), "" if value is None else str(value),
+                item.get("comment"), epoch)
+    fields = line.decode("utf-8").split(delimiter)
+    if not 4 <= len(fields) <= 5:
+        raise ValueError("expected patient, date, type, value and optional comment")
+    return (fields[0], fields[1], fields[2], fields[3], fields[4] if len(fields) == 5 else None, None)
+
+
+def parse_readings(lines, delimiter, types):
+    """
+    Разбор и проверка пачки строк: дата разбирается, тип входит в types, значение не пусто и проходит правила
+    validators.VALUE_RULES (те же, что popup.check_abstract_velocity, check_abstract_enoxa и
+    check_abstract_infusion), проверка векторная на всю пачку.
+    :param lines: список строк bytes (NDJSON или CSV с разделителем delimiter)
+    :param delimiter: разделитель полей CSV (Table :: Delimiter)
+    :param types: допустимые значения TYPE (Ingest :: Types)
+    :return: (pd.DataFrame принятых показаний с колонками READING_COLUMNS,
+    список ошибок {"line", "message"}; line — номер строки в пачке)
+    """
+    records, numbers, errors = list(), list(), list()
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(_split_line(line, delimiter))
+            numbers.append(number)
+        except (ValueError, KeyError, UnicodeDecodeError) as e:
+            errors.append({"line": number, "message": str(e)})
+    df = pd.DataFrame.from_records(records, columns=list(READING_COLUMNS))
+    numbers = np.asarray(numbers, dtype=np.int64)
+    epochs = df["EPOCH"].to_numpy(dtype=float, na_value=np.nan)
+    given = ~np.isnan(epochs)
+    if given.any():
+        # время числом проверяется тем же разбором, что и текст даты
+        dates_ = df["DATE"].to_numpy(dtype=object, copy=True)
+        dates_[given] = dates.dates_from_epochs(epochs[given].astype(np.int64))
+        df["DATE"] = dates_
+    bad, problems = validate_rows(df, types)
+    empty = (df["VALUE"].to_numpy(dtype=object) == "") & ~bad
+    for row in np.flatnonzero(empty):
+        problems.append({"row": int(row) + 2, "message": "value is missing"})
+    bad |= empty
+    errors += [{"line": int(numbers[problem["row"] - 2]), "message": problem["message"]} for problem in problems]
+    errors.sort(key=lambda error: error["line"])
+    df = df[~bad].reset_index(drop=True)
+    # время — с точностью до минуты, как оно будет записано в файл
+    df["EPOCH"] = dates.timestamps_from_dates(df["DATE"].to_numpy(dtype=object))
+    df["VALUE"] = df["VALUE"].str.replace(",", ".", regex=False)
+    return df, errors
+
+
+def by_patient(batches):
+    """
+    :param batches: пачки из ReadingQueue.take
+    :return: dict пациент -> pd.DataFrame строк из typed.to_typed с колонкой INVALID, в порядке поступления
+    """
+    if not batches:
+        return dict()
+    readings = pd.concat(batches, ignore_index=True)
+    groups = dict()
+    for patient, rows in readings.groupby("PATIENT", sort=False):
+        rows = typed.to_typed(rows.drop(columns=["PATIENT"]).reset_index(drop=True))
+        rows["INVALID"] = validators.invalid_rows(rows)
+        groups[patient] = rows
+    return groups
+
+
+class ReadingQueue:
+    """
+    Очередь проверенных показаний между потоками подключений и потребителем (окно или запись в файлы).
+    Хранит пачки и ограничена числом строк capacity: пока очередь полна, put ждёт, так что быстрый отправитель
+    притормаживается через управление потоком TCP, а память не растёт. Пачка больше capacity принимается
+    в пустую очередь целиком.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._batches = deque()
+        self._rows = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._rows
+
+    def put(self, batch):
+        """
+        :param batch: pd.DataFrame показаний
+        :return: False, если очередь закрыта и пачка не принята
+        """
+        with self._condition:
+            while self._rows > 0 and self._rows + len(batch) > self.capacity and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return False
+            self._batches.append(batch)
+            self._rows += len(batch)
+            return True
+
+    def take(self):
+        """
+        :return: список всех пачек в очереди (очередь опустошается)
+        """
+        with self._condition:
+            batches = list(self._batches)
+            self._batches.clear()
+            self._rows = 0
+            self._condition.notify_all()
+            return batches
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    # одно подключение: в пачку идёт всё, что уже пришло (до BATCH_BYTES), недописанная строка ждёт следующей
+    def handle(self):
+        ingest = self.server.ingest
+        rest = b""
+        closed = False
+        while not closed:
+            chunks = [rest]
+            size = 0
+            try:
+                while size < BATCH_BYTES:
+                    data = self.request.recv(RECV_BYTES)
+                    if not data:
+                        closed = True
+                        break
+                    chunks.append(data)
+                    size += len(data)
+                    if not select.select([self.request], [], [], 0)[0]:
+                        break
+            except OSError:
+                closed = True
+            lines = b"".join(chunks).split(b"\n")
+            rest = lines.pop()
+            if lines and not self.accept(lines):
+                return
+        if rest.strip():
+            self.accept([rest])
+
+    def accept(self, lines):
+        # неожиданная ошибка проверки отклоняет одну пачку, а не всё подключение
+        try:
+            return self.server.ingest.accept(lines)
+        except Exception as e:
+            self.server.ingest.reject(lines, e)
+            return True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class IngestServer:
+    """
+    Приём показаний мониторов по TCP или сокету Unix: строки NDJSON
+        {"patient": "ivanov", "date": "05/02/2021 10:00", "type": "Vtop", "value": 12.5, "comment": "..."}
+    (вместо date можно передать epoch — секунды) или CSV patient;date;type;value[;comment] с разделителем
+    Table :: Delimiter. Каждое подключение обслуживается своим потоком; проверенные показания попадают
+    в ReadingQueue (queue), отклонённые считаются в rejected, последние KEPT_ERRORS из них — в errors.
+    Отправителям ничего не отвечается.
+    """
+    def __init__(self, address, types, delimiter=";", capacity=100000):
+        self.family, self._bind = parse_address(address)
+        self.types = list(types)
+        self.delimiter = delimiter
+        self.queue = ReadingQueue(capacity)
+        self.received = 0
+        self.rejected = 0
+        self.errors = deque(maxlen=KEPT_ERRORS)
+        # принятые показания, которые потребителю некуда записать (пациент не открыт, нет файла)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        :return: адрес, который слушает сервер (для порта 0 — выбранный системой)
+        """
+        if self._server is None:
+            return None
+        if self.family == socket.AF_INET:
+            host, port = self._server.server_address[:2]
+            return "{0}:{1}".format(host, port)
+        return "unix:" + self._server.server_address
+
+    def start(self):
+        if self.family == socket.AF_INET:
+            self._server = _TCPServer(self._bind, _Handler)
+        else:
+            if os.path.exists(self._bind):
+                # сокет, оставшийся от прошлого запуска
+                os.remove(self._bind)
+            self._server = _UnixServer(self._bind, _Handler)
+        self._server.ingest = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ingest", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self.queue.close()
+        self._server.shutdown()
+        self._server.server_close()
+        if self.family != socket.AF_INET and os.path.exists(self._bind):
+            os.remove(self._bind)
+        self._server = None
+
+    def accept(self, lines):
+        """
+        Проверяет строки одного чтения и ставит принятые показания в очередь одной пачкой.
+        :param lines: список строк bytes
+        :return: False, если сервер остановлен
+        """
+        df, errors = parse_readings(lines, self.delimiter, self.types)
+        with self._lock:
+            self.received += len(df)
+            self.rejected += len(errors)
+            for error in errors:
+                self.errors.append(dict(error, text=lines[error["line"]][:200].decode("utf-8", "replace")))
+        return len(df) == 0 or self.queue.put(df)
+
+    def reject(self, lines, error):
+        """
+        Отклоняет пачку целиком, если её проверка завершилась ошибкой.
+        :param lines: список строк bytes
+        :param error: исключение
+        :return:
+        """
+        numbers = [number for number, line in enumerate(lines) if line.strip()]
+        with self._lock:
+            self.rejected += len(numbers)
+            if numbers:
+                self.errors.append({"line": numbers[0], "message": "batch of {0} lines rejected: {1!r}".format(
+                    len(numbers), error), "text": lines[numbers[0]][:200].decode("utf-8", "replace")})
+
+
+def fake_readings(patient, count, config, types, seed=0, form="json"):
+    """
+    Показания для проверки сервера из synthetic.generate_records: только типы types, даты в обоих форматах,
+    часть значений с десятичной запятой.
+    :param form: "json" (NDJSON) или "csv"
+    :return: список строк bytes с переводом строки
+    """
+    from . import synthetic
+    raw = synthetic.generate_records(count * 3, config, seed=seed)
+    raw = raw[raw["TYPE"].isin(types)].head(count)
+    delimiter = config["Table"]["Delimiter"]
+    lines = list()
+    for date, kind, value, comment in raw[["DATE", "TYPE", "VALUE", "COMMENT"]].itertuples(index=False):
+        comment = None if pd.isna(comment) else comment
+        if form == "json":
+            item = {"patient": patient, "date": date, "type": kind, "value": value}
+            if comment is not None:
+                item["comment"] = comment
+            lines.append(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+        else:
+            fields = [patient, date, kind, value] + ([comment] if comment is not None else [])
+            lines.append(delimiter.join(fields).encode("utf-8") + b"\n")
+    return lines
+
+
+def send_readings(address, lines, rate=None, chunk=100):
+    """
+    Отправляет строки на сервер кусками по chunk строк.
+    :param address: адрес сервера, см. parse_address
+    :param lines: строки bytes с переводом строки
+    :param rate: показаний в секунду, None — без ограничения
+    :return: время отправки в секундах
+    """
+    family, target = parse_address(address)
+    start = time.perf_counter()
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.connect(target)
+        for first in range(0, len(lines), chunk):
+            connection.sendall(b"".join(lines[first:first + chunk]))
+            if rate:
+                delay = start + (first + chunk) / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    return time.perf_counter() - start
+
+
+def patient_files(directory):
+    """
+    :return: dict пациент -> путь к CSV или базе в каталоге directory; пациент — имя файла с расширением
+    и без него (если есть и CSV, и база, без расширения выбирается CSV)
+    """
+    files = dict()
+    for name in sorted(os.listdir(directory), reverse=True):
+        stem, extension = os.path.splitext(name)
+        if extension in (".csv", ".sqlite") and not name.startswith("."):
+            files[name] = files[stem] = os.path.join(directory, name)
+    return files
+
+
+def serve(directory, config, address, rate, progress=print):
+    """
+    Работа без окна: принятые показания раз в 1 / rate секунд дописываются в файлы пациентов каталога
+    (FileHandler.append_rows). Окно, открывшее такой CSV в режиме наблюдения (Table :: Watch), их покажет.
+    Показания пациентов без файла отбрасываются. Останавливается по Ctrl+C.
+    :return:
+    """
+    from .filehandler import FileHandler
+    ingest_config = config["Ingest"]
+    q_dict = dict(config["Table"], Cache=False)
+    server = IngestServer(address, ingest_config["Types"], config["Table"]["Delimiter"],
+                          ingest_config["QueueRows"]).start()
+    progress("listening on {0}".format(server.address))
+    written = 0
+    try:
+        while True:
+            time.sleep(1 / rate)
+            groups = by_patient(server.queue.take())
+            if not groups:
+                continue
+            files = patient_files(directory)
+            for patient, rows in groups.items():
+                path = files.get(patient)
+                if path is None:
+                    server.dropped += len(rows)
+                    continue
+                FileHandler(path, q_dict).append_rows(rows)
+                written += len(rows)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    progress("{0} readings written, {1} for unknown patients, {2} rejected".format(written, server.dropped,
+                                                                                    server.rejected))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receive monitor readings over a local socket, or send fake ones.")
+    parser.add_argument("--config", default="configs.json", help="configuration file")
+    parser.add_argument("--address", default=None, help="host:port or unix:path (default: Ingest :: Address)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="append received readings to the patient files in a directory")
+    serve_parser.add_argument("directory", help="directory with <patient>.csv and <patient>.sqlite files")
+    serve_parser.add_argument("--rate", type=float, default=None, help="writes per second (default: Ingest :: RateHz)")
+    send_parser = commands.add_parser("send", help="send synthetic readings for one patient")
+    send_parser.add_argument("patient", help="patient file name with or without extension")
+    send_parser.add_argument("--count", type=int, default=10000, help="number of readings")
+    send_parser.add_argument("--rate", type=float, default=None, help="readings per second (default: unlimited)")
+    send_parser.add_argument("--format", choices=("json", "csv"), default="json", help="line format")
+    send_parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args(argv)
+    config = settings.load_config(args.config)
+    address = args.address or config["Ingest"]["Address"]
+    if not address:
+        parser.error("no address: set Ingest :: Address or pass --address")
+    if args.command == "serve":
+        serve(args.directory, config, address, args.rate or config["Ingest"]["RateHz"])
+        return 0
+    lines = fake_readings(args.patient, args.count, config, config["Ingest"]["Types"], args.seed, args.format)
+    elapsed = send_readings(address, lines, args.rate)
+    print("{0} readings sent in {1:.2f} s".format(len(lines), elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
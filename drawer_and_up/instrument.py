@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import atexit
+import cProfile
+import logging
+import threading
+import functools
+import itertools
+import collections
+import numpy as np
+
+# переменная окружения, включающая замеры без правки configs.json: "1" — замеры, "cprofile" или "sampling" —
+# замеры и профиль медленных вызовов
+ENVIRONMENT_VARIABLE = "HICOMUNA_INSTRUMENT"
+# границы корзин гистограммы, мс
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+PROFILERS = ("cprofile", "sampling")
+
+logger = logging.getLogger("hicomuna.instrument")
+_recorder = None
+
+
+class SamplingProfiler:
+    """
+    Выборочный профиль одного потока: фоновый поток каждые interval секунд снимает стек вызовов и считает,
+    сколько раз встретился каждый стек. Результат пишется в свёрнутом виде (стек через ";" и число выборок),
+    который читают flamegraph.pl и speedscope.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def enable(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def disable(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename),
+                                                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, "w", encoding="utf-8") as handle:
+            for stack, count in self.stacks.most_common():
+                handle.write("{0} {1}\n".format(stack, count))
+
+
+class Recorder:
+    """
+    Скользящие гистограммы длительностей операций (последние window замеров каждой операции) и журнал медленных
+    вызовов: вызов дольше slow_ms пишется в logger вместе с числом строк, а при заданном profiler профиль
+    такого вызова сохраняется в profile_dir.
+    """
+    def __init__(self, slow_ms=200, window=1000, profiler=None, profile_dir="profiles"):
+        if profiler not in PROFILERS + (None,):
+            raise ValueError("Unknown profiler {0}".format(profiler))
+        self.slow_ms = slow_ms
+        self.window = window
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._durations = dict()
+        self._lock = threading.Lock()
+        # вложенные замеры (save_file -> store) профилируются только снаружи, один профилировщик на поток
+        self._local = threading.local()
+        self._profile_numbers = itertools.count(1)
+
+    def call(self, name, rows, function, args, kwargs):
+        depth = getattr(self._local, "depth", 0)
+        profile = None
+        if self.profiler is not None and depth == 0:
+            profile = cProfile.Profile() if self.profiler == "cprofile" else SamplingProfiler()
+            try:
+                profile.enable()
+            except ValueError:
+                # в другом потоке уже идёт профиль (начиная с Python 3.12 cProfile бывает только один)
+                profile = None
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._local.depth = depth
+            if profile is not None:
+                profile.disable()
+        count = None
+        if rows is not None and elapsed_ms >= self.slow_ms:
+            try:
+                count = rows(result, *args, **kwargs)
+            except Exception:
+                pass
+        self.finish(name, elapsed_ms, count, profile)
+        return result
+
+    def finish(self, name, elapsed_ms, count=None, profile=None):
+        """
+        Добавляет замер в гистограмму и пишет медленный вызов в logger.
+        :param name: название операции
+        :param elapsed_ms: длительность, мс
+        :param count: число строк для журнала
+        :param profile: профиль вызова или None
+        :return:
+        """
+        self.add(name, elapsed_ms)
+        if elapsed_ms >= self.slow_ms:
+            path = self.save_profile(name, profile) if profile is not None else None
+            logger.warning("%s took %.1f ms, rows: %s%s", name, elapsed_ms, count,
+                           "" if path is None else ", profile: " + path)
+
+    def add(self, name, elapsed_ms):
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = collections.deque(maxlen=self.window)
+            durations.append(elapsed_ms)
+
+    def save_profile(self, name, profile):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        extension = ".prof" if isinstance(profile, cProfile.Profile) else ".folded"
+        path = os.path.join(self.profile_dir, "{0}-{1}-{2}{3}".format(
+            name, time.strftime("%Y%m%d-%H%M%S"), next(self._profile_numbers), extension))
+        try:
+            profile.dump_stats(path)
+        except OSError:
+            return None
+        return path
+
+    def summary(self):
+        """
+        :return: dict название операции -> {"count", "p50", "p95", "max", "buckets"}; длительности в мс,
+        buckets — число замеров не дольше каждой границы BUCKETS_MS и последняя корзина для остальных
+        """
+        with self._lock:
+            snapshot = {name: np.array(durations) for name, durations in self._durations.items()}
+        result = dict()
+        for name, durations in snapshot.items():
+            counts = np.bincount(np.searchsorted(BUCKETS_MS, durations), minlength=len(BUCKETS_MS) + 1)
+            result[name] = {"count": len(durations), "p50": float(np.percentile(durations, 50)),
+                            "p95": float(np.percentile(durations, 95)), "max": float(durations.max()),
+                            "buckets": counts.tolist()}
+        return result
+
+    def log_summary(self):
+        for name, stats in sorted(self.summary().items()):
+            logger.info("%s: %d calls, p50 %.1f ms, p95 %.1f ms, max %.1f ms, buckets %s",
+                        name, stats["count"], stats["p50"], stats["p95"], stats["max"],
+                        " ".join("<={0}:{1}".format(bound, count) for bound, count
+                                 in zip(BUCKETS_MS + ("inf",), stats["buckets"]) if count))
+
+
+def timed(name, rows=None):
+    """
+    Декоратор замера операции. Пока замеры выключены, вызов стоит одной проверки глобальной переменной.
+    :param name: название операции в гистограммах и журнале
+    :param rows: функция (результат, аргументы вызова) -> число строк для журнала медленных вызовов
+    :return:
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return function(*args, **kwargs)
+            return recorder.call(name, rows, function, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, start, count=None):
+    """
+    Замер операции, которая заканчивается не в том вызове, где началась (например, загрузка в фоновом потоке).
+    :param name: название операции
+    :param start: time.perf_counter() в начале операции
+    :param count: число строк для журнала медленных вызовов
+    :return:
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.finish(name, (time.perf_counter() - start) * 1000, count)
+
+
+def frame_rows(df):
+    return 0 if df is None else len(df)
+
+
+def configure(q_dict=None):
+    """
+    Включает или выключает замеры по разделу Instrumentation из configs.json; переменная окружения
+    ENVIRONMENT_VARIABLE включает их независимо от Enabled и может задать профилировщик.
+    :param q_dict: раздел Instrumentation ({"Enabled", "SlowMs", "Window", "Profiler", "ProfileDir", "LogFile"})
+    :return: Recorder или None, если замеры выключены
+    """
+    global _recorder
+    q_dict = dict() if q_dict is None else q_dict
+    switch = os.environ.get(ENVIRONMENT_VARIABLE, "").strip().lower()
+    enabled = q_dict.get("Enabled", False) or switch not in ("", "0", "off", "false")
+    if not enabled:
+        _recorder = None
+        return None
+    profiler = switch if switch in PROFILERS else q_dict.get("Profiler") or None
+    recorder = Recorder(q_dict.get("SlowMs", 200), q_dict.get("Window", 1000), profiler,
+                        q_dict.get("ProfileDir", "profiles"))
+    log_file = q_dict.get("LogFile", "hicomuna_perf.log")
+    if log_file and not any(getattr(handler, "baseFilename", None) == os.path.abspath(log_file)
+                            for handler in logger.handlers):
+        handler = logging.FileHandler(log_file, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    _recorder = recorder
+    return recorder
+
+
+def recorder():
+    return _recorder
+
+
+@atexit.register
+def _log_summary_at_exit():
+    if _recorder is not None:
+        _recorder.log_summary()
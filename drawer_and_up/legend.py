@@ -0,0 +1,99 @@
+import math
+import PyQt5.QtWidgets as QtW
+import PyQt5.QtGui as QtG
+import PyQt5.QtCore as QtC
+
+# размер значка серии, px
+ICON_SIZE = 20
+
+
+def make_color(text):
+    """
+    Цвет в записи pyqtgraph: #RRGGBB или #RRGGBBAA (QColor читает восемь цифр как #AARRGGBB) или имя цвета.
+    :return: QtG.QColor
+    """
+    text = str(text)
+    if text.startswith("#") and len(text) == 9:
+        color = QtG.QColor(text[:7])
+        color.setAlpha(int(text[7:], 16))
+        return color
+    return QtG.QColor(text)
+
+
+def _polygon(corners, radius, inner=None, rotation=-90):
+    # правильный многоугольник (или звезда, если задан внутренний радиус) с вершиной вверху
+    count = corners * 2 if inner is not None else corners
+    points = list()
+    for i in range(count):
+        angle = math.radians(rotation + 360 * i / count)
+        r = inner if inner is not None and i % 2 else radius
+        points.append(QtC.QPointF(r * math.cos(angle), r * math.sin(angle)))
+    path = QtG.QPainterPath()
+    path.addPolygon(QtG.QPolygonF(points))
+    path.closeSubpath()
+    return path
+
+
+def symbol_path(symbol, radius):
+    """
+    Контур маркера pyqtgraph вокруг (0, 0); неизвестные маркеры рисуются кругом.
+    :param symbol: код маркера PlotDataItem (o, s, t, d, p, h, star)
+    :return: QtG.QPainterPath
+    """
+    if symbol == "s":
+        path = QtG.QPainterPath()
+        path.addRect(QtC.QRectF(-radius, -radius, 2 * radius, 2 * radius))
+        return path
+    if symbol == "t":
+        return _polygon(3, radius, rotation=90)
+    if symbol == "d":
+        return _polygon(4, radius)
+    if symbol == "p":
+        return _polygon(5, radius)
+    if symbol == "h":
+        return _polygon(6, radius, rotation=0)
+    if symbol == "star":
+        return _polygon(5, radius, inner=radius * 0.4)
+    path = QtG.QPainterPath()
+    path.addEllipse(QtC.QPointF(0, 0), radius, radius)
+    return path
+
+
+def series_icon(style, size=ICON_SIZE):
+    """
+    Значок серии, как на графике: отрезок линии цветом pen и маркер в середине цветом symbolBrush.
+    :param style: параметры серии из Plot :: PointsStyle
+    :return: QtG.QPixmap
+    """
+    pixmap = QtG.QPixmap(size * 2, size)
+    pixmap.fill(QtC.Qt.transparent)
+    painter = QtG.QPainter(pixmap)
+    painter.setRenderHint(QtG.QPainter.Antialiasing)
+    pen = make_color(style.get("pen", "#000000"))
+    if pen.alpha() > 0:
+        painter.setPen(QtG.QPen(pen, 2))
+        painter.drawLine(QtC.QPointF(2, size / 2), QtC.QPointF(size * 2 - 2, size / 2))
+    painter.translate(size, size / 2)
+    painter.setPen(QtG.QPen(make_color(style.get("symbolPen", "#C8C8C8")), 1))
+    painter.setBrush(QtG.QBrush(make_color(style.get("symbolBrush", "#646464"))))
+    painter.drawPath(symbol_path(style.get("symbol", "o"), size * 0.35))
+    painter.end()
+    return pixmap
+
+
+class Legend(QtW.QWidget):
+    """
+    Легенда графика из обычных виджетов: значок и название каждой серии из Plot :: PointsStyle в несколько
+    столбцов. В отличие от отдельного графика pyqtgraph, не требует сцены и строится за миллисекунды.
+    """
+    def __init__(self, config, columns=4, parent=None):
+        super(Legend, self).__init__(parent)
+        grid = QtW.QGridLayout(self)
+        grid.setContentsMargins(0, 0, 0, 0)
+        grid.setHorizontalSpacing(16)
+        for i, (name, style) in enumerate(config.items()):
+            icon = QtW.QLabel()
+            icon.setPixmap(series_icon(style))
+            grid.addWidget(icon, i // columns, 2 * (i % columns))
+            grid.addWidget(QtW.QLabel(name), i // columns, 2 * (i % columns) + 1)
+        grid.setColumnStretch(2 * columns, 1)
@@ -0,0 +1,66 @@
+import time
+import PyQt5.QtCore as QtC
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class LoadWorker(QtC.QThread):
+    """
+    Загрузка и приведение таблицы (FileHandler.load_table) в отдельном потоке. В поток GUI возвращается
+    только готовый DataFrame сигналом loaded, виджеты обновляются уже там.
+    Отмена проверяется между этапами загрузки. При потоковом чтении CSV после каждого куска отправляется
+    уже прочитанная часть сигналом partial_loaded; в GUI имеет смысл показывать только последнюю (latest_partial).
+    """
+    progress = QtC.pyqtSignal(int, str)
+    partial_loaded = QtC.pyqtSignal(object)
+    loaded = QtC.pyqtSignal(object)
+    failed = QtC.pyqtSignal(str)
+    cancelled = QtC.pyqtSignal()
+
+    def __init__(self, file_keeper, parent=None):
+        super(LoadWorker, self).__init__(parent)
+        self.file_keeper = file_keeper
+        # начало загрузки для замера load_any_file (instrument.record), который заканчивается в потоке GUI
+        self.started_at = time.perf_counter()
+        self._cancel_requested = False
+        self.latest_partial = None
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def report(self, percent, text):
+        """
+        Передаётся в FileHandler.load_table как progress; при запрошенной отмене прерывает загрузку.
+        :param percent: 0 .. 100
+        :param text: название этапа
+        :return:
+        """
+        if self._cancel_requested:
+            raise LoadCancelled()
+        self.progress.emit(percent, text)
+
+    def report_partial(self, df):
+        """
+        Передаётся в FileHandler.load_table как partial. Переданный DataFrame дальше потоком не меняется.
+        :param df: прочитанная часть таблицы
+        :return:
+        """
+        self.latest_partial = df
+        self.partial_loaded.emit(df)
+
+    def run(self):
+        try:
+            df = self.file_keeper.load_table(progress=self.report, partial=self.report_partial)
+        except LoadCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            # исключение в потоке иначе просто потеряется, поэтому любую ошибку отдаём в GUI
+            self.failed.emit(str(e))
+            return
+        if self._cancel_requested:
+            self.cancelled.emit()
+        else:
+            self.loaded.emit(df)
@@ -0,0 +1,293 @@
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from . import database
+from . import paging
+from . import settings
+from . import typed
+from .batch import validate_rows
+from .filehandler import FileHandler, normalize_frame
+
+# расширения файлов, которые можно сливать
+SOURCE_EXTENSIONS = (".csv", ".xls", ".xlsx", ".ods", ".sqlite")
+# форматы, в которые результат дописывается кусками (FileHandler.append_rows)
+TARGET_EXTENSIONS = (".csv", ".sqlite")
+# строк в блоке отсортированного отрезка на диске: при слиянии в памяти по одному блоку на отрезок
+BLOCK_ROWS = 10000
+# за сколько дней читается кусок базы (строки в ней уже упорядочены по времени)
+DATABASE_DAYS = 30
+# сколько расхождений перечисляется в отчёте (считаются все)
+KEPT_CONFLICTS = 1000
+# колонки таблицы из typed.to_typed, по которым строки считаются одинаковыми: дата, тип и значение
+DUPLICATE_COLUMNS = ("EPOCH", "TYPE", "VALUE", "EVENT")
+# служебная колонка с номером исходного файла строки
+SOURCE_COLUMN = "SOURCE"
+
+
+class Run:
+    """
+    Отрезок одного исходного файла, упорядоченный по времени, записанный на диск блоками по BLOCK_ROWS строк.
+    Уже упорядоченный файл даёт один отрезок, неупорядоченный — по отрезку на каждый прочитанный кусок.
+    """
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.paths = list()
+        self.last = None
+
+    def extends(self, df: pd.DataFrame):
+        """
+        :return: True, если df (упорядоченный) продолжает отрезок без нарушения порядка
+        """
+        return self.last is None or df["EPOCH"].iat[0] >= self.last
+
+    def write(self, df: pd.DataFrame):
+        for first in range(0, len(df), BLOCK_ROWS):
+            path = os.path.join(self.directory, "{0}.{1}.pkl".format(self.name, len(self.paths)))
+            df.iloc[first:first + BLOCK_ROWS].reset_index(drop=True).to_pickle(path)
+            self.paths.append(path)
+        self.last = df["EPOCH"].iat[-1]
+
+    def read(self, number):
+        return pd.read_pickle(self.paths[number])
+
+
+def read_chunks(path, q_dict, types):
+    """
+    Читает исходный файл кусками: CSV — по Table :: ChunkRows строк, базу — по DATABASE_DAYS дней, Excel —
+    целиком. Строки с ошибками (batch.validate_rows) отбрасываются, каждый кусок приводится (normalize_frame)
+    и упорядочивается по времени — каждая строка сортируется один раз. Файл с журналом читается целиком,
+    чтобы журнал накатился на всю таблицу.
+    :param types: допустимые значения TYPE
+    :return: генератор пар (pd.DataFrame из typed.to_typed, список ошибок куска)
+    """
+    handler = FileHandler(path, q_dict)
+    if os.path.isfile(handler.journal_path):
+        df = handler.load_table().drop(columns=["INVALID"])
+        if len(df) > 0:
+            yield df, list()
+        return
+    if handler.is_database:
+        first, last = database.epoch_bounds(path)
+        if first is None:
+            return
+        for start in range(first, last + 1, DATABASE_DAYS * paging.DAY):
+            df = database.read_frame(path, start, min(start + DATABASE_DAYS * paging.DAY - 1, last))
+            if len(df) > 0:
+                yield df, list()
+        return
+    if handler.file_extension == ".csv":
+        chunks = pd.read_csv(path, sep=q_dict["Delimiter"], dtype=str, chunksize=q_dict.get("ChunkRows") or None)
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+    else:
+        chunks = [handler.load_file()]
+    offset = 0
+    for raw in chunks:
+        raw = raw.reset_index(drop=True)
+        missing = [column for column in q_dict["Headings"] if column not in raw.columns]
+        if missing:
+            raise ValueError("{0} has no columns {1}".format(handler.file_name, ", ".join(missing)))
+        bad, errors = validate_rows(raw, types)
+        for error in errors:
+            # номер строки во всём файле, а не в куске
+            error["row"] += offset
+        offset += len(raw)
+        raw = raw[~bad].reset_index(drop=True)
+        if len(raw) > 0:
+            yield typed.to_typed(normalize_frame(raw)), errors
+        elif errors:
+            yield None, errors
+
+
+def split_runs(path, number, q_dict, types, directory, columns):
+    """
+    Раскладывает исходный файл по упорядоченным отрезкам на диске.
+    :param number: номер файла среди исходных (колонка SOURCE)
+    :param columns: дополнительные колонки результата (Table :: Headings кроме typed.FILE_COLUMNS)
+    :return: (список Run, dict отчёта по файлу)
+    """
+    report = {"source": path, "rows": 0, "invalid": 0, "runs": 0, "errors": list()}
+    runs = list()
+    for df, errors in read_chunks(path, q_dict, types):
+        report["invalid"] += len(errors)
+        report["errors"] += errors
+        if df is None:
+            continue
+        report["rows"] += len(df)
+        # только колонки результата: у разных файлов могут быть разные лишние колонки
+        df = df.reindex(columns=["EPOCH", "TYPE", "VALUE", "EVENT", "COMMENT"] + columns)
+        # категории текстов у каждого куска свои, и при склейке блоков их пришлось бы сводить заново
+        for column in ["EVENT", "COMMENT"] + columns:
+            df[column] = df[column].to_numpy(dtype=object)
+        df[SOURCE_COLUMN] = number
+        if not runs or not runs[-1].extends(df):
+            runs.append(Run(directory, "{0}.{1}".format(number, len(runs))))
+        runs[-1].write(df)
+    report["rows"] += report["invalid"]
+    report["runs"] = len(runs)
+    return runs, report
+
+
+def merge_runs(runs):
+    """
+    Слияние упорядоченных отрезков по времени. В памяти по блоку каждого отрезка; на каждом шаге выдаются все
+    строки раньше наименьшего последнего времени среди блоков отрезков, которые ещё не дочитаны до конца, —
+    более ранних строк в непрочитанных блоках нет. Поэтому строки с одинаковым временем всегда выдаются вместе.
+    Выданные части склеиваются и упорядочиваются устойчивой сортировкой: строки с одинаковым временем идут
+    в порядке отрезков, то есть исходных файлов.
+    :param runs: список Run в порядке исходных файлов
+    :return: генератор pd.DataFrame
+    """
+    # positions — номер следующего непрочитанного блока каждого отрезка
+    blocks = [run.read(0) for run in runs]
+    positions = [1] * len(runs)
+    while True:
+        active = [number for number, block in enumerate(blocks) if block is not None]
+        if not active:
+            return
+        unread = [number for number in active if positions[number] < len(runs[number].paths)]
+        limit = min(blocks[number]["EPOCH"].iat[-1] for number in unread) if unread else None
+        parts = list()
+        for number in active:
+            block = blocks[number]
+            cut = len(block) if limit is None else int(np.searchsorted(block["EPOCH"].to_numpy(), limit, side="left"))
+            if cut == 0:
+                continue
+            parts.append(block.iloc[:cut])
+            blocks[number] = block.iloc[cut:].reset_index(drop=True) if cut < len(block) else None
+            if blocks[number] is None and positions[number] < len(runs[number].paths):
+                blocks[number] = runs[number].read(positions[number])
+                positions[number] += 1
+        if not parts:
+            # в блоках только строки со временем limit: к отрезкам, блок которых им кончается, читается следующий
+            for number in unread:
+                if blocks[number]["EPOCH"].iat[-1] == limit:
+                    blocks[number] = typed.concat([blocks[number], runs[number].read(positions[number])])
+                    positions[number] += 1
+            continue
+        df = typed.concat(parts)
+        order = np.argsort(df["EPOCH"].to_numpy(), kind="stable")
+        yield df.take(order).reset_index(drop=True)
+
+
+def find_duplicates(df: pd.DataFrame):
+    """
+    :param df: упорядоченный по времени кусок из merge_runs
+    :return: маска повторов: строк, у которых дата, тип и значение совпадают с более ранней строкой (по хешу
+    DUPLICATE_COLUMNS)
+    """
+    hashes = pd.util.hash_pandas_object(df[list(DUPLICATE_COLUMNS)], index=False).to_numpy()
+    return pd.Index(hashes).duplicated(keep="first")
+
+
+def find_conflicts(df: pd.DataFrame, sources, limit):
+    """
+    Расхождения — разные значения одного типа в одно и то же время.
+    :param df: кусок из merge_runs без повторов
+    :param sources: пути исходных файлов по номерам SOURCE
+    :param limit: сколько расхождений описать
+    :return: (число расхождений, список не больше limit описаний {"date", "type", "values", "sources"})
+    """
+    hashes = pd.util.hash_pandas_object(df[["EPOCH", "TYPE"]], index=False).to_numpy()
+    rows = np.flatnonzero(pd.Index(hashes).duplicated(keep=False))
+    if len(rows) == 0:
+        return 0, list()
+    # номера расхождений в порядке времени; описываются только первые limit
+    codes = pd.factorize(hashes[rows])[0]
+    count = int(codes.max()) + 1
+    kept = codes < limit
+    order = np.argsort(codes[kept], kind="stable")
+    rows, codes = rows[kept][order], codes[kept][order]
+    if len(rows) == 0:
+        return count, list()
+    strings = typed.to_strings(df.iloc[rows])
+    values = [None if pd.isna(value) else value for value in strings["VALUE"]]
+    numbers = df[SOURCE_COLUMN].to_numpy()[rows]
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    conflicts = list()
+    for first, stop in zip(np.r_[0, bounds], np.r_[bounds, len(codes)]):
+        conflicts.append({"date": strings["DATE"].iat[first], "type": strings["TYPE"].iat[first],
+                          "values": values[first:stop], "sources": [sources[number] for number in numbers[first:stop]]})
+    return count, conflicts
+
+
+def merge(sources, target, config, progress=print):
+    """
+    Сливает записи одного пациента из нескольких файлов в target. Каждый файл читается кусками, куски
+    упорядочиваются и записываются во временный каталог рядом с target, затем отрезки сливаются по времени
+    (merge_runs) и дописываются в target (FileHandler.append_rows), так что в памяти одновременно только куски,
+    а не все файлы. Повторы (та же дата, тип и значение; остаётся строка из файла, указанного раньше) отбрасываются,
+    разные значения одного типа в одно время записываются все и перечисляются в отчёте.
+    :param sources: пути исходных файлов
+    :param target: путь результата, один из TARGET_EXTENSIONS; не должен существовать
+    :param config: содержимое configs.json
+    :return: dict отчёта
+    """
+    extension = os.path.splitext(target)[1]
+    if extension not in TARGET_EXTENSIONS:
+        raise ValueError("{0} does not have suitable extension".format(os.path.basename(target)))
+    if os.path.exists(target):
+        raise ValueError("{0} already exists".format(target))
+    # кеш и журнал нужны только для работы в окне
+    q_dict = dict(config["Table"], Cache=False, Journal=False, PageDays=0)
+    types = config["InputDialog"]["Types"]["Enum"]
+    columns = [column for column in q_dict["Headings"] if column not in typed.FILE_COLUMNS]
+    summary = {"sources": len(sources), "rows": 0, "invalid": 0, "duplicates": 0, "conflicts": 0, "written": 0}
+    files = list()
+    conflicts = list()
+    directory = tempfile.mkdtemp(prefix=".~merge", dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        runs = list()
+        for number, source in enumerate(sources):
+            progress("reading {0}".format(source))
+            source_runs, report = split_runs(source, number, q_dict, types, directory, columns)
+            runs += source_runs
+            files.append(report)
+        progress("merging {0} sorted runs".format(len(runs)))
+        keeper = FileHandler(target, q_dict)
+        keeper.create_file()
+        for df in (merge_runs(runs) if runs else ()):
+            duplicates = find_duplicates(df)
+            df = df[~duplicates].reset_index(drop=True)
+            count, found = find_conflicts(df, sources, KEPT_CONFLICTS - len(conflicts))
+            summary["duplicates"] += int(duplicates.sum())
+            summary["conflicts"] += count
+            conflicts += found
+            keeper.append_rows(df.drop(columns=[SOURCE_COLUMN]))
+            summary["written"] += len(df)
+    except BaseException:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    summary["rows"] = sum(report["rows"] for report in files)
+    summary["invalid"] = sum(report["invalid"] for report in files)
+    return {"summary": summary, "files": files, "conflicts": conflicts}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge several files of one patient into one timeline without the GUI.")
+    parser.add_argument("sources", nargs="+", help=".csv, .xls, .xlsx, .ods and .sqlite files, earlier ones win "
+                                                   "among duplicates")
+    parser.add_argument("--output", required=True, help="new .csv or .sqlite file")
+    parser.add_argument("--report", default=None, help="JSON report path (default: <output>.report.json)")
+    parser.add_argument("--config", default="configs.json", help="configuration file")
+    args = parser.parse_args(argv)
+    for source in args.sources:
+        if os.path.splitext(source)[1].lower() not in SOURCE_EXTENSIONS:
+            parser.error("{0} does not have suitable extension".format(source))
+    config = settings.load_config(args.config)
+    report = merge(args.sources, args.output, config)
+    report_path = args.report or args.output + ".report.json"
+    with open(report_path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    print("{sources} files: {written} of {rows} rows written, {invalid} invalid, {duplicates} duplicates, "
+          "{conflicts} conflicts".format(**report["summary"]))
+    return 0
@@ -0,0 +1,81 @@
+import math
+
+# секунд в сутках
+DAY = 24 * 3600
+
+
+class Pages:
+    """
+    Часть записи из базы, загруженная в таблицу: строки с EPOCH от start (включительно) до stop (не включая;
+    None — до конца записи) из всей записи от first до last. Загружается и выгружается целыми страницами
+    по page_seconds секунд; границы страниц отсчитываются от последней записи на момент открытия,
+    так что первая страница — последние page_seconds секунд записи.
+    """
+    def __init__(self, first, last, page_seconds):
+        self.first = first
+        self.last = last
+        self.page_seconds = page_seconds
+        self._anchor = last + 1
+        self.start = self._anchor - page_seconds
+        self.stop = None
+
+    @property
+    def complete(self):
+        return self.start <= self.first and (self.stop is None or self.stop > self.last)
+
+    def edge_below(self, epoch):
+        # начало страницы, в которой лежит epoch
+        return self._anchor + math.floor((epoch - self._anchor) / self.page_seconds) * self.page_seconds
+
+    def missing(self, left, right):
+        """
+        :param left: левая граница нужного промежутка (EPOCH)
+        :param right: правая граница нужного промежутка (EPOCH)
+        :return: список промежутков (start, stop) целыми страницами, которых не хватает, чтобы загруженная
+        часть покрывала [left, right]; за пределы записи промежутки не выходят
+        """
+        ranges = list()
+        if left < self.start and self.start > self.first:
+            ranges.append((max(self.edge_below(left), self.edge_below(self.first)), self.start))
+        if self.stop is not None and right >= self.stop and self.stop <= self.last:
+            ranges.append((self.stop, min(self.edge_below(right), self.edge_below(self.last)) + self.page_seconds))
+        return ranges
+
+    def loaded(self, start, stop):
+        """
+        Отмечает загруженным промежуток из missing.
+        :return:
+        """
+        if stop == self.start:
+            self.start = start
+        elif self.stop is not None and start == self.stop:
+            self.stop = stop
+
+    def include(self, epochs):
+        """
+        Расширяет границы записи до добавленных строк. Вызывается после load_pages для тех же строк: тогда
+        между загруженной частью и строками вне прежних границ записи в базе ничего нет.
+        :param epochs: EPOCH добавленных строк
+        :return:
+        """
+        if len(epochs) == 0:
+            return
+        low, high = int(min(epochs)), int(max(epochs))
+        self.first = min(self.first, low)
+        self.last = max(self.last, high)
+        if low < self.start:
+            self.start = self.edge_below(low)
+        if self.stop is not None and high >= self.stop:
+            self.stop = self.edge_below(high) + self.page_seconds
+
+    def shrink(self, left, right):
+        """
+        Оставляет загруженными страницы промежутка [left, right] и по одной странице с каждой стороны.
+        :return: (новый start, новый stop); строки вне них надо убрать из таблицы
+        """
+        start = self.edge_below(left) - self.page_seconds
+        self.start = max(self.start, start)
+        stop = self.edge_below(right) + 2 * self.page_seconds
+        if stop <= self.last and (self.stop is None or stop < self.stop):
+            self.stop = stop
+        return self.start, self.stop
@@ -1,9 +1,9 @@
-import re
 from datetime import datetime, timedelta
 import PyQt5.QtWidgets as QtW
 import PyQt5.QtCore as QtC
 import numpy as np
 import pandas as pd
+from . import validators
 
 
 class DateEdit(QtW.QDateEdit):
@@ -30,44 +30,15 @@ class EventChoice(QtW.QComboBox):
 
 
 def check_abstract_velocity(value):
-    if value == "":
-        var_name = True
-    else:
-        try:
-            temp_var = re.sub(",", ".", value)
-            var_name = float(temp_var)
-            if (var_name < 0) or (var_name > 90):
-                var_name = False
-        except ValueError:
-            var_name = False
-    return var_name
+    return validators.check_value("Vtop", value)
 
 
 def check_abstract_enoxa(value):
-    if value == "":
-        var_name = True
-    else:
-        try:
-            temp_var = re.sub(",", ".", value)
-            temp_var = float(temp_var)
-            if (temp_var < 0) or (temp_var > 3):
-                var_name = False
-            else:
-                var_name = temp_var
-        except ValueError:
-            var_name = False
-    return var_name
+    return validators.check_value("Enoxa", value)
 
 
 def check_abstract_infusion(value):
-    if value == "":
-        var_name = True
-    else:
-        try:
-            var_name = int(value)
-        except ValueError:
-            var_name = False
-    return var_name
+    return validators.check_value("Infusion", value)
 
 
 class InputDialog(QtW.QDialog):
@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 import PyQt5.QtWidgets as QtW
 import pyqtgraph as pg
 
@@ -6,10 +7,42 @@ pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
 
+def peak_decimation(x, y, x_min, x_max, columns):
+    """
+    Отбор точек для отображения с сохранением пиков: в каждом столбце пикселей видимого диапазона остаются
+    точки с минимальным и максимальным y. Точки левее и правее диапазона попадают в два крайних столбца,
+    чтобы линия доходила до краёв графика.
+    :param x: отсортированный np.ndarray
+    :param y: np.ndarray той же длины
+    :param x_min: левая граница видимого диапазона
+    :param x_max: правая граница видимого диапазона
+    :param columns: ширина графика в пикселях
+    :return: отсортированный np.ndarray индексов точек или None, если прореживать не нужно
+    """
+    if x_max <= x_min or columns <= 0:
+        return None
+    first, last = np.searchsorted(x, [x_min, x_max], side="left")
+    if last - first <= 2 * columns:
+        return None
+    bins = np.clip(np.floor((x - x_min) * (columns / (x_max - x_min))), -1, columns).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(x)]))
+    y = np.asarray(y, dtype=float)
+    chosen = []
+    for reduce in (np.fmin, np.fmax):
+        candidates = np.flatnonzero(y == reduce.reduceat(y, starts)[segments])
+        # первая подходящая точка в каждом столбце
+        first_in_column = np.r_[True, segments[candidates][1:] != segments[candidates][:-1]]
+        chosen.append(candidates[first_in_column])
+    return np.union1d(chosen[0], chosen[1])
+
+
 class Plotter(QtW.QWidget):
     def __init__(self, config):
         self.my_config = config
         super().__init__()
+        # сглаживание не включается глобально: для серий из сотен тысяч точек оно заметно замедляет отрисовку,
+        # небольшие накладные элементы включают его сами (antialias=True)
         self.pw = pg.PlotWidget(axisItems={'bottom': pg.DateAxisItem('bottom')})
         self.p1 = self.pw.plotItem
         # right axis of the plot & linking to view
@@ -23,6 +56,14 @@ class Plotter(QtW.QWidget):
         # update while zooming
         self.update_views()
         self.p1.vb.sigResized.connect(self.update_views)
+        # серии: name -> {"item", "x", "y", "style", "shown", "window"}; shown — индексы отображаемых точек,
+        # window — (левая граница, правая граница, ширина диапазона при прореживании) переданного в item окна
+        self.series = dict()
+        self.decimation = self.my_config.get("Decimation", True)
+        self.window_margin = self.my_config.get("WindowMargin", 0.5)
+        # при перетаскивании окно пересчитывается не чаще RefreshRate раз в секунду
+        self.range_proxy = pg.SignalProxy(self.p1.sigXRangeChanged, rateLimit=self.my_config.get("RefreshRate", 30),
+                                          slot=self.update_series_views)
 
     def update_views(self):
         # view has resized; update auxiliary views to match
@@ -32,6 +73,79 @@ class Plotter(QtW.QWidget):
         # (probably this should be handled in ViewBox.resizeEvent)
         self.p2.linkedViewChanged(self.p1.vb, self.p2.XAxis)
 
+    def add_series(self, name, item, view):
+        """
+        Регистрирует серию, которая будет прореживаться по видимому диапазону.
+        :param name: название серии
+        :param item: pg.PlotDataItem
+        :param view: self.p1 или self.p2
+        :return:
+        """
+        view.addItem(item)
+        self.series[name] = {"item": item, "x": np.empty(0), "y": np.empty(0), "style": dict(),
+                             "shown": None, "window": None}
+
+    def set_series_data(self, name, x, y, **style):
+        """
+        Передаёт полные массивы серии; в PlotDataItem уходят только точки видимого окна (с прореживанием).
+        :param name: название серии
+        :param x: отсортированный np.ndarray
+        :param y: np.ndarray
+        :param style: параметры отображения для PlotDataItem.setData
+        :return:
+        """
+        series = self.series[name]
+        series["x"], series["y"], series["style"] = x, y, style
+        self.render_series(name, force=True)
+
+    def source_index(self, name, index):
+        """
+        :param name: название серии
+        :param index: индексы точек в PlotDataItem
+        :return: индексы тех же точек в полных массивах серии
+        """
+        shown = self.series[name]["shown"]
+        index = np.asarray(index, dtype=np.int64)
+        return index if shown is None else shown[index]
+
+    def render_series(self, name, force=False):
+        """
+        Передаёт в PlotDataItem точки видимого диапазона с запасом window_margin ширины диапазона с каждой стороны.
+        Окно находится бинарным поиском по отсортированному x. Пока видимый диапазон не выходит за переданное окно
+        (а при прореживании ещё и не меняется масштаб), данные не пересылаются.
+        :param name: название серии
+        :param force: пересчитать окно в любом случае
+        :return:
+        """
+        series = self.series[name]
+        x_min, x_max = self.p1.vb.viewRange()[0]
+        span = x_max - x_min
+        if not force and series["window"] is not None:
+            left, right, decimated_span = series["window"]
+            if left <= x_min and x_max <= right and (decimated_span is None or np.isclose(decimated_span, span)):
+                return
+        margin = span * self.window_margin
+        left, right = x_min - margin, x_max + margin
+        x, y = series["x"], series["y"]
+        first, last = np.searchsorted(x, [left, right])
+        # по одной точке за краями окна, чтобы линия не обрывалась
+        first, last = max(first - 1, 0), min(last + 1, len(x))
+        shown = np.arange(first, last)
+        decimated_span = None
+        if self.decimation and span > 0:
+            columns = int(self.p1.vb.width() * (right - left) / span)
+            index = peak_decimation(x[first:last], y[first:last], left, right, columns)
+            if index is not None:
+                shown = index + first
+                decimated_span = span
+        series["shown"] = shown
+        series["window"] = (left, right, decimated_span)
+        series["item"].setData(x=x[shown], y=y[shown], **series["style"])
+
+    def update_series_views(self, *_):
+        for name in self.series:
+            self.render_series(name)
+
     def set_up_table_plot(self):
         self.pw.showGrid(x=True, y=True)
         for axs in ['left', 'right', 'bottom']:
@@ -39,30 +153,6 @@ class Plotter(QtW.QWidget):
                                           color=self.my_config["Axis"][axs]["color"])
 
 
-class LegendPlotter(QtW.QWidget):
-    def __init__(self, config):
-        self.my_config = config
-        super().__init__()
-        self.pw = pg.GraphicsLayoutWidget(show=True)
-        self.pw.resize(100, 200)
-        pg.setConfigOptions(antialias=True)
-        self.plot = self.pw.addPlot()
-        self.plot.addLegend(colCount=2)
-        self.draw_plots()
-        self.plot.setXRange(-2, 2)
-        self.plot.hideAxis('bottom')
-        self.plot.hideAxis('left')
-
-    def draw_plots(self):
-        x_ = [0, 1]
-        y_top = len(self.my_config)
-        for i, elem in enumerate(self.my_config):
-            self.plot.plot(x=x_,
-                           y=[(y_top - i) for _ in range(len(x_))],
-                           **self.my_config[elem],
-                           name=elem)
-
-
 if __name__ == '__main__':
     app = QtW.QApplication(sys.argv)
     ex = Plotter({})
@@ -0,0 +1,83 @@
+import PyQt5.QtCore as QtC
+
+# интервал по умолчанию, мс: примерно один кадр при 60 Гц
+DEFAULT_INTERVAL_MS = 16
+
+
+class Redraw:
+    """
+    Что накопилось к перерисовке: таблица целиком (table), строки, добавленные в её конец (appended), или отдельные
+    строки (rows), серии графика (series; all_series — все объявленные серии), заголовок файла (title) и вид
+    графика по умолчанию (view).
+    """
+    def __init__(self):
+        self.table = False
+        self.appended = False
+        self.rows = set()
+        self.series = set()
+        self.all_series = False
+        self.title = False
+        self.view = False
+
+    def __bool__(self):
+        return (self.table or self.appended or bool(self.rows) or bool(self.series) or self.all_series or self.title
+                or self.view)
+
+
+class RedrawScheduler(QtC.QObject):
+    """
+    Единая точка обновления таблицы и графика. Правки только отмечают, что изменилось (mark), а функция apply
+    получает накопленный Redraw одним вызовом — по таймеру, не чаще раза в interval_ms, или сразу при flush.
+    Сколько бы правок ни пришло между двумя перерисовками, таблица и каждая серия перерисовываются один раз:
+    правки одного обработчика (удаление выделенных строк, вставка, приём показаний) таймер не разделяет.
+    """
+    def __init__(self, apply, interval_ms=DEFAULT_INTERVAL_MS, parent=None):
+        super(RedrawScheduler, self).__init__(parent)
+        self._apply = apply
+        self._pending = Redraw()
+        self._timer = QtC.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+        # число вызовов apply, для замеров и проверки «одна правка пачкой — одна перерисовка»
+        self.flushes = 0
+
+    @property
+    def pending(self):
+        return bool(self._pending)
+
+    def mark(self, table=False, appended=False, rows=(), series=(), all_series=False, title=False, view=False):
+        """
+        Отмечает изменившееся и, если перерисовка ещё не запланирована, запускает таймер.
+        :param table: таблица заменена целиком (новый DataFrame, вставка или удаление строк)
+        :param appended: строки добавлены только в конец таблицы (прежние строки на своих местах)
+        :param rows: номера изменённых строк таблицы
+        :param series: названия изменившихся серий графика
+        :param all_series: пересчитать все серии
+        :param title: обновить заголовок файла
+        :param view: привести график к виду по умолчанию
+        :return:
+        """
+        pending = self._pending
+        pending.table |= table
+        pending.appended |= appended
+        pending.rows.update(int(row) for row in rows)
+        pending.series.update(series)
+        pending.all_series |= all_series
+        pending.title |= title
+        pending.view |= view
+        if pending and not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """
+        Применяет накопленные изменения сейчас, не дожидаясь таймера. Без накопленных изменений ничего не делает.
+        :return:
+        """
+        self._timer.stop()
+        if not self._pending:
+            return
+        # новые отметки, сделанные внутри apply, попадут в следующую перерисовку
+        pending, self._pending = self._pending, Redraw()
+        self.flushes += 1
+        self._apply(pending)
@@ -0,0 +1,39 @@
+import PyQt5.QtCore as QtC
+
+
+class SaveWorker(QtC.QThread):
+    """
+    Сохранение таблицы (FileHandler.store) в отдельном потоке. Копия таблицы и накопленные изменения снимаются
+    при создании, в потоке GUI; изменения, сделанные во время записи, попадут в следующее сохранение.
+    Если журнал после записи разросся, там же выполняется его уплотнение (FileHandler.compact).
+    Сигнал saved отправляется сразу после записи, до уплотнения; ошибка уплотнения не теряет данных — журнал остаётся,
+    но продолжает расти, поэтому о ней сообщает сигнал compaction_failed.
+    """
+    saved = QtC.pyqtSignal()
+    failed = QtC.pyqtSignal(str)
+    compaction_failed = QtC.pyqtSignal(str)
+
+    def __init__(self, file_keeper, df, parent=None):
+        super(SaveWorker, self).__init__(parent)
+        self.file_keeper = file_keeper
+        self.df = df
+        self.pending = file_keeper.take_pending()
+        # номер изменения, которому соответствует копия: статус «сохранено» ставится, только если он не вырос
+        self.revision = file_keeper.revision
+
+    def run(self):
+        try:
+            self.file_keeper.store(self.df, self.pending)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        finally:
+            self.pending = None
+        self.saved.emit()
+        try:
+            if self.file_keeper.needs_compaction:
+                self.file_keeper.compact(self.df, self.file_keeper.journal_size())
+        except Exception as e:
+            self.compaction_failed.emit(str(e))
+        finally:
+            self.df = None
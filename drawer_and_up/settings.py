@@ -0,0 +1,138 @@
+import json
+from . import typed
+
+# необязательные разделы configs.json и их значения по умолчанию
+DEFAULT_SECTIONS = {
+    "Workspace": {"MemoryMB": 1024},
+    "Instrumentation": {"Enabled": False},
+    "Ingest": {"Address": "", "RateHz": 10, "QueueRows": 100000, "Types": ["Vtop", "Vtail", "Infusion"]},
+}
+# колонки, без которых таблица не читается
+REQUIRED_HEADINGS = ("DATE", "TYPE", "VALUE")
+
+
+def _problems(config):
+    problems = list()
+
+    def section(parent, key, path):
+        value = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(value, dict):
+            problems.append("{0} must be an object".format(path))
+            return dict()
+        return value
+
+    def check(parent, key, path, kinds, required=True):
+        if key not in parent:
+            if required:
+                problems.append("{0} is missing".format(path))
+            return None
+        value = parent[key]
+        # bool — подкласс int, но как число не подходит
+        if not isinstance(value, kinds) or (isinstance(value, bool) and bool not in kinds):
+            problems.append("{0} has wrong type {1}".format(path, type(value).__name__))
+            return None
+        return value
+
+    check(config, "Version", "Version", (str,))
+    table = section(config, "Table", "Table")
+    headings = check(table, "Headings", "Table :: Headings", (list,))
+    if headings is not None:
+        for heading in REQUIRED_HEADINGS:
+            if heading not in headings:
+                problems.append("Table :: Headings must contain {0}".format(heading))
+    delimiter = check(table, "Delimiter", "Table :: Delimiter", (str,))
+    if delimiter == "":
+        problems.append("Table :: Delimiter is empty")
+    for key in ("Cache", "Journal"):
+        check(table, key, "Table :: " + key, (bool,), required=False)
+    for key in ("ChunkRows", "JournalRows", "AutoSave", "PageDays", "PageMemoryMB", "Watch"):
+        value = check(table, key, "Table :: " + key, (int, float), required=False)
+        if value is not None and value < 0:
+            problems.append("Table :: {0} must not be negative".format(key))
+
+    plot = section(config, "Plot", "Plot")
+    axis_items = section(plot, "AxisItems", "Plot :: AxisItems")
+    coefficients = section(plot, "Coefficients", "Plot :: Coefficients")
+    styles = section(plot, "PointsStyle", "Plot :: PointsStyle")
+    series = list()
+    for key in ("leftAxis", "rightAxis"):
+        series += check(axis_items, key, "Plot :: AxisItems :: " + key, (list,)) or list()
+    for name in series:
+        check(coefficients, name, "Plot :: Coefficients :: " + name, (int, float))
+    for name in series + ["Event"]:
+        check(styles, name, "Plot :: PointsStyle :: " + name, (dict,))
+
+    plot_widget = section(config, "PlotWidget", "PlotWidget")
+    for key in ("RefreshRate", "RedrawMs"):
+        value = check(plot_widget, key, "PlotWidget :: " + key, (int, float), required=False)
+        if value is not None and value < 0:
+            problems.append("PlotWidget :: {0} must not be negative".format(key))
+    axis = section(plot_widget, "Axis", "PlotWidget :: Axis")
+    for key in ("bottom", "left", "right"):
+        side = section(axis, key, "PlotWidget :: Axis :: " + key)
+        for field in ("label", "color"):
+            check(side, field, "PlotWidget :: Axis :: {0} :: {1}".format(key, field), (str,))
+
+    dialog = section(config, "InputDialog", "InputDialog")
+    known_types = list()
+    for key in ("Types", "Events", "Multiplies"):
+        entry = section(dialog, key, "InputDialog :: " + key)
+        enum = check(entry, "Enum", "InputDialog :: {0} :: Enum".format(key), (list,))
+        default = check(entry, "Default", "InputDialog :: {0} :: Default".format(key), (int,))
+        if enum is not None and default is not None and not 0 <= default < len(enum):
+            problems.append("InputDialog :: {0} :: Default is out of range".format(key))
+        if key == "Types" and enum is not None:
+            known_types = enum
+        if key == "Multiplies" and enum is not None:
+            for value in enum:
+                if not str(value).isdigit() or int(value) == 0:
+                    problems.append("InputDialog :: Multiplies :: Enum has wrong value {0}".format(value))
+
+    memory = check(config.get("Workspace", dict()), "MemoryMB", "Workspace :: MemoryMB", (int, float),
+                   required=False)
+    if memory is not None and memory < 0:
+        problems.append("Workspace :: MemoryMB must not be negative")
+
+    ingest = config.get("Ingest", dict())
+    address = check(ingest, "Address", "Ingest :: Address", (str,), required=False)
+    if address and not address.startswith("unix:") and not address.rpartition(":")[2].isdigit():
+        problems.append("Ingest :: Address must be host:port or unix:path")
+    for key in ("RateHz", "QueueRows"):
+        value = check(ingest, key, "Ingest :: " + key, (int, float), required=False)
+        if value is not None and value <= 0:
+            problems.append("Ingest :: {0} must be positive".format(key))
+    ingest_types = check(ingest, "Types", "Ingest :: Types", (list,), required=False)
+    for kind in ingest_types or list():
+        if kind not in known_types:
+            problems.append("Ingest :: Types has unknown type {0}".format(kind))
+    return problems
+
+
+def validate_config(config):
+    """
+    Проверяет содержимое configs.json один раз при запуске, чтобы ошибка в файле настроек была видна сразу,
+    а не при первом обращении к нужному ключу. Необязательные разделы дополняются значениями по умолчанию.
+    :param config: dict из configs.json (дополняется на месте)
+    :return: тот же dict
+    """
+    if not isinstance(config, dict):
+        raise ValueError("configuration must be an object")
+    problems = _problems(config)
+    if problems:
+        raise ValueError("Wrong configuration:\n" + "\n".join(problems))
+    for name, defaults in DEFAULT_SECTIONS.items():
+        config[name] = dict(defaults, **config.get(name, dict()))
+    return config
+
+
+def load_config(path="configs.json"):
+    """
+    :param path: путь к configs.json
+    :return: проверенный dict настроек
+    """
+    with open(path, "r", encoding="utf-8") as cfg:
+        config = json.load(cfg)
+    config = validate_config(config)
+    # категории TYPE — из того же файла настроек, даже если он не configs.json рабочего каталога
+    typed.TYPES = tuple(config["InputDialog"]["Types"]["Enum"])
+    return config
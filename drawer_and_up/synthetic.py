@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from . import database
+from . import dates
+from . import typed
+from .filehandler import normalize_frame
+
+# значения VALUE по типам: (минимум, максимум, знаков после точки) — в пределах validators.VALUE_RULES
+VALUE_RANGES = {
+    "Vtop": (0, 90, 1),
+    "Vtail": (0, 90, 1),
+    "Enoxa": (0, 3, 1),
+    "RecEnoxa": (0, 3, 1),
+    "Infusion": (0, 2000, 0),
+    "RecInfusion": (0, 2000, 0),
+}
+# доли типов среди введённых записей (до развёртки повторных доз)
+TYPE_WEIGHTS = {"Vtop": 4, "Vtail": 4, "Enoxa": 1, "RecEnoxa": 1, "Infusion": 1, "RecInfusion": 1, "Event": 0.5}
+
+
+def generate_records(rows, config, seed=0, start="2021-01-01", days=90, iso_share=0.3, comma_share=0.3,
+                     comment_share=0.2, disorder=0.05):
+    """
+    Синтетическая запись пациента в том виде, в котором она лежит в файле: типы из InputDialog :: Types :: Enum,
+    значения в допустимых границах, тексты событий из InputDialog :: Events :: Enum. RecEnoxa и RecInfusion
+    разворачиваются, как в InputDialog: кратность из InputDialog :: Multiplies :: Enum, дозы через 24 / кратность
+    часов с одним значением.
+    :param rows: число строк
+    :param config: содержимое configs.json
+    :param seed: зерно генератора, одинаковое зерно даёт одинаковую запись
+    :param start: дата начала записи
+    :param days: длительность записи в днях
+    :param iso_share: доля дат в виде YYYY-mm-dd HH:MM:SS (остальные — dd/mm/YYYY HH:MM)
+    :param comma_share: доля дробных значений с десятичной запятой
+    :param comment_share: доля строк с комментарием
+    :param disorder: доля строк, стоящих не на своём месте по времени
+    :return: pd.DataFrame строк с колонками DATE, TYPE, VALUE, COMMENT
+    """
+    rng = np.random.default_rng(seed)
+    types = np.array(config["InputDialog"]["Types"]["Enum"], dtype=object)
+    weights = np.array([TYPE_WEIGHTS.get(kind, 1) for kind in types], dtype=float)
+    events = np.array([event for event in config["InputDialog"]["Events"]["Enum"] if event], dtype=object)
+    multipliers = np.array([int(value) for value in config["InputDialog"]["Multiplies"]["Enum"]], dtype=np.int64)
+
+    # записей с развёрткой не меньше, чем rows, лишние дозы в конце отбрасываются
+    entry_types = rng.choice(len(types), size=rows, p=weights / weights.sum())
+    repeated = np.isin(types[entry_types], ["RecEnoxa", "RecInfusion"])
+    counts = np.where(repeated, rng.choice(multipliers, size=rows), 1)
+    entries = np.repeat(np.arange(rows), counts)[:rows]
+    dose = np.arange(len(entries)) - np.repeat(np.cumsum(counts) - counts, counts)[:rows]
+    step_minutes = 24 * 60 // np.repeat(counts, counts)[:rows]
+
+    # время записей равномерно по длительности с точностью до минуты, дозы — со своим шагом от первой
+    minutes = np.sort(rng.integers(0, days * 24 * 60, size=rows))[entries] + dose * step_minutes
+    naive = np.datetime64(start, "m") + minutes.astype("timedelta64[m]")
+    kinds = types[entry_types][entries]
+
+    values = np.full(rows, np.nan, dtype=object)
+    for kind, (low, high, decimals) in VALUE_RANGES.items():
+        mask = kinds == kind
+        if not mask.any():
+            continue
+        numbers = np.round(rng.uniform(low, high, size=rows)[entries][mask], decimals)
+        if decimals:
+            text = np.char.mod("%.{0}f".format(decimals), numbers).astype(object)
+            comma = rng.random(len(text)) < comma_share
+            # np.char.replace не принимает пустой массив
+            if comma.any():
+                text[comma] = np.char.replace(text[comma].astype(str), ".", ",").astype(object)
+        else:
+            text = numbers.astype(np.int64).astype(str).astype(object)
+        values[mask] = text
+    event_rows = kinds == "Event"
+    if len(events) > 0:
+        values[event_rows] = events[rng.integers(0, len(events), size=int(event_rows.sum()))]
+
+    iso = rng.random(rows) < iso_share
+    date_text = dates.format_dates(naive).astype(object)
+    if iso.any():
+        date_text[iso] = np.char.replace(np.datetime_as_string(naive[iso].astype("datetime64[s]")), "T", " ")
+
+    # у развёрнутых доз комментарий общий, как при вводе
+    comments = np.full(rows, np.nan, dtype=object)
+    commented = rng.random(rows) < comment_share
+    comments[commented] = np.char.add("note ", rng.integers(0, 50, size=int(commented.sum())).astype(str))
+    comments = comments[entries]
+
+    order = np.arange(rows)
+    moved = np.flatnonzero(rng.random(rows) < disorder)
+    order[moved] = rng.permutation(moved)
+    return pd.DataFrame({"DATE": date_text[order], "TYPE": kinds[order], "VALUE": values[order],
+                         "COMMENT": comments[order]})
+
+
+def write_records(df: pd.DataFrame, path, delimiter=";"):
+    """
+    Запись сгенерированной таблицы в CSV, XLSX или базу SQLite (по расширению path).
+    :return:
+    """
+    if path.endswith(".sqlite"):
+        # в базе хранятся уже приведённые значения
+        database.write_frame(path, typed.to_typed(normalize_frame(df.copy())))
+    elif path.endswith(".xlsx"):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, sep=delimiter, index=False)
@@ -0,0 +1,135 @@
+import PyQt5.QtCore as QtC
+import PyQt5.QtGui as QtG
+import pandas as pd
+from . import dates
+from . import typed
+
+
+class DataFrameModel(QtC.QAbstractTableModel):
+    """
+    Модель таблицы поверх pd.DataFrame из typed.to_typed: значения читаются прямо из массивов колонок и только
+    для тех ячеек, которые видны на экране, поэтому стоимость открытия не зависит от числа строк. DATE строится
+    из EPOCH, VALUE — из VALUE и EVENT, как при записи в файл.
+    Правка ячейки не пишет в DataFrame сама, а передаётся наружу сигналом cellEdited(row, column, text).
+    Строки, отмеченные в служебной колонке INVALID, подсвечиваются.
+    """
+    invalid_brush = QtG.QBrush(QtG.QColor("#FFC8C8"))
+
+    cellEdited = QtC.pyqtSignal(int, int, str)
+
+    def __init__(self, parent=None):
+        super(DataFrameModel, self).__init__(parent)
+        self._df = None
+        self._columns = list()
+        self._arrays = list()
+        self._invalid = None
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def set_frame(self, df: pd.DataFrame):
+        """
+        Подменяет DataFrame целиком (открытие файла, добавление и удаление строк), одним сбросом модели.
+        :param df: pd.DataFrame
+        :return:
+        """
+        self.beginResetModel()
+        self._df = df
+        if df is None:
+            self._columns = list()
+        else:
+            self._columns = typed.display_columns(df)
+        self._refresh_arrays()
+        self.endResetModel()
+
+    def append_rows(self, df: pd.DataFrame):
+        """
+        Подменяет DataFrame его продолжением (новые строки только в конце) без сброса модели, так что выделение
+        и прокрутка таблицы сохраняются. Если df не продолжение текущего, модель сбрасывается, как в set_frame.
+        :param df: pd.DataFrame
+        :return:
+        """
+        first = self.rowCount()
+        if self._df is None or len(df) < first or typed.display_columns(df) != self._columns:
+            self.set_frame(df)
+            return
+        if len(df) > first:
+            self.beginInsertRows(QtC.QModelIndex(), first, len(df) - 1)
+        self._df = df
+        self._refresh_arrays()
+        if len(df) > first:
+            self.endInsertRows()
+
+    def refresh_rows(self, first, last=None):
+        """
+        Сообщает представлению, что строки first..last изменились в DataFrame.
+        :param first: первая строка
+        :param last: последняя строка (по умолчанию first)
+        :return:
+        """
+        if last is None:
+            last = first
+        self._refresh_arrays()
+        self.dataChanged.emit(self.index(first, 0), self.index(last, len(self._columns) - 1))
+
+    def _refresh_arrays(self):
+        # функции строки -> текст ячейки поверх массивов колонок, без копирования данных
+        if self._df is None:
+            self._arrays = list()
+            self._invalid = None
+        else:
+            self._arrays = [self._cell_getter(column) for column in self._columns]
+            self._invalid = self._df["INVALID"].to_numpy() if "INVALID" in self._df.columns else None
+
+    def _cell_getter(self, column):
+        if column == "DATE":
+            epochs = self._df["EPOCH"].to_numpy()
+            return lambda row: dates.date_from_timestamp(epochs[row])
+        if column == "VALUE":
+            values = self._df["VALUE"].to_numpy()
+            events = self._df["EVENT"].array
+            return lambda row: typed.format_value(values[row], events[row])
+        array = self._df[column].array
+
+        def text(row):
+            value = array[row]
+            return "" if pd.isna(value) else str(value)
+        return text
+
+    def rowCount(self, parent=QtC.QModelIndex()):
+        if parent.isValid() or self._df is None:
+            return 0
+        return len(self._df)
+
+    def columnCount(self, parent=QtC.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columns)
+
+    def data(self, index, role=QtC.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (QtC.Qt.DisplayRole, QtC.Qt.EditRole):
+            return self._arrays[index.column()](index.row())
+        if role == QtC.Qt.BackgroundRole and self._invalid is not None and self._invalid[index.row()]:
+            return self.invalid_brush
+        return None
+
+    def headerData(self, section, orientation, role=QtC.Qt.DisplayRole):
+        if role != QtC.Qt.DisplayRole:
+            return None
+        if orientation == QtC.Qt.Horizontal:
+            return self._columns[section]
+        return str(section)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtC.Qt.NoItemFlags
+        return QtC.Qt.ItemIsSelectable | QtC.Qt.ItemIsEnabled | QtC.Qt.ItemIsEditable
+
+    def setData(self, index, value, role=QtC.Qt.EditRole):
+        if role != QtC.Qt.EditRole or not index.isValid():
+            return False
+        self.cellEdited.emit(index.row(), index.column(), str(value))
+        return True
@@ -0,0 +1,245 @@
+import json
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from . import dates
+from . import validators
+
+# типы строк по умолчанию, если configs.json не прочитать
+DEFAULT_TYPES = ("Vtop", "Vtail", "Enoxa", "RecEnoxa", "Infusion", "RecInfusion", "Event")
+# колонки файла, которые в памяти хранятся в другом виде: DATE — как EPOCH, VALUE — как VALUE (float) и EVENT
+FILE_COLUMNS = ("DATE", "TYPE", "VALUE", "COMMENT")
+# колонки таблицы в памяти, которых нет в файле
+INTERNAL_COLUMNS = ("EPOCH", "EVENT", "INVALID")
+
+
+def configured_types(path="configs.json"):
+    """
+    :param path: путь к configs.json
+    :return: кортеж типов из InputDialog :: Types :: Enum или DEFAULT_TYPES, если файл не прочитать
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as cfg:
+            types = json.load(cfg)["InputDialog"]["Types"]["Enum"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_TYPES
+    if not isinstance(types, list) or not all(isinstance(kind, str) for kind in types):
+        return DEFAULT_TYPES
+    return tuple(types)
+
+
+# категории колонки TYPE в порядке InputDialog :: Types :: Enum; другие встретившиеся в файле типы дописываются
+# в категории после них. settings.load_config заменяет их типами из прочитанного файла настроек
+TYPES = configured_types()
+
+
+def categorical(values, known=()):
+    """
+    :param values: последовательность строк, пустые строки считаются пропусками
+    :param known: категории, которые идут первыми
+    :return: pd.Categorical
+    """
+    values = pd.Series(np.asarray(values, dtype=object), dtype=object)
+    values = values.where(values != "")
+    uniques = pd.unique(values.dropna().to_numpy())
+    known_set = set(known)
+    categories = list(known) + [value for value in uniques if value not in known_set]
+    return pd.Categorical(values, categories=categories)
+
+
+def text_column(values):
+    """
+    Категории для повторяющихся строк (комментарии, текст событий). Если почти все значения разные, категории
+    памяти не экономят, и колонка остаётся строками.
+    :param values: последовательность строк, пустые строки считаются пропусками
+    :return: pd.Categorical или np.ndarray object
+    """
+    values = np.asarray(values, dtype=object)
+    present = ~pd.isna(values)
+    present[present] = values[present] != ""
+    count = int(present.sum())
+    if count > 1 and len(pd.unique(values[present])) > count // 2:
+        return np.where(present, values, np.nan)
+    return categorical(values)
+
+
+def split_values(types, texts):
+    """
+    Разделение VALUE на число и текст: у Event и у нечисловых значений хранится текст, у остальных — число.
+    Значение типа, который по validators.VALUE_RULES допускает только целые, хранится текстом, если int() его
+    не принимает (1e3, 12.0): так оно записывается обратно без изменений и считается недопустимым.
+    Каждое уникальное значение разбирается один раз.
+    :param types: последовательность TYPE
+    :param texts: последовательность VALUE (строки)
+    :return: (np.ndarray float, np.ndarray object текстов, NaN там, где текста нет)
+    """
+    texts = np.asarray(texts, dtype=object)
+    codes, uniques = pd.factorize(texts)
+    uniques = np.asarray(uniques, dtype=object)
+    # последний элемент — для кода -1 (пропуск)
+    parsed = np.append(validators.numbers(uniques), np.nan)
+    integer = np.zeros(len(parsed), dtype=bool)
+    integer[:-1][~np.isnan(parsed[:-1])] = validators.integer_texts(uniques[~np.isnan(parsed[:-1])])
+    numeric = parsed[codes]
+    present = np.append(uniques != "", False)[codes]
+    types = np.asarray(types, dtype=object)
+    is_text = present & ((types == "Event") | np.isnan(numeric)
+                         | (np.isin(types, validators.integer_types()) & ~integer[codes]))
+    events = np.where(is_text, texts, np.nan)
+    values = np.where(is_text | ~present, np.nan, numeric)
+    return values, events
+
+
+def to_typed(df: pd.DataFrame):
+    """
+    Перевод строковой таблицы (после normalize_frame) в представление для работы: EPOCH int64, TYPE категории,
+    VALUE float, текст событий в категориальной колонке EVENT, COMMENT категории. DATE не хранится —
+    строки дат получаются из EPOCH при показе и записи. Прочие колонки файла остаются строками.
+    :param df: pd.DataFrame с колонками DATE, TYPE, VALUE, COMMENT, EPOCH
+    :return: новый pd.DataFrame
+    """
+    types = df["TYPE"].to_numpy(dtype=object)
+    values, events = split_values(types, df["VALUE"].to_numpy(dtype=object))
+    typed = pd.DataFrame({
+        "EPOCH": df["EPOCH"].to_numpy(dtype=np.int64),
+        "TYPE": categorical(types, TYPES),
+        "VALUE": values,
+        "EVENT": text_column(events),
+        "COMMENT": text_column(df["COMMENT"].to_numpy(dtype=object) if "COMMENT" in df.columns
+                               else np.full(len(df), np.nan, dtype=object)),
+    })
+    for column in df.columns:
+        if column not in FILE_COLUMNS and column not in INTERNAL_COLUMNS:
+            typed[column] = df[column].to_numpy(dtype=object)
+    if "INVALID" in df.columns:
+        typed["INVALID"] = df["INVALID"].to_numpy(dtype=bool)
+    return typed
+
+
+def empty_frame():
+    return to_typed(pd.DataFrame({"DATE": [], "TYPE": [], "VALUE": [], "COMMENT": [],
+                                  "EPOCH": np.empty(0, dtype=np.int64)}))
+
+
+def format_values(values, events):
+    """
+    Векторное обратное к split_values преобразование: целые числа пишутся без дробной части.
+    Каждое уникальное число форматируется один раз.
+    :param values: np.ndarray float
+    :param events: последовательность текстов (NaN — текста нет)
+    :return: np.ndarray object строк, NaN для пустых значений
+    """
+    uniques, inverse = np.unique(np.asarray(values, dtype=float), return_inverse=True)
+    formatted = np.full(len(uniques), np.nan, dtype=object)
+    numeric = ~np.isnan(uniques)
+    with np.errstate(invalid="ignore"):
+        whole = numeric & (uniques == np.round(uniques)) & (np.abs(uniques) < 1e15)
+    formatted[whole] = uniques[whole].astype(np.int64).astype(str)
+    rest = numeric & ~whole
+    formatted[rest] = uniques[rest].astype(str)
+    text = formatted[inverse.ravel()]
+    events = np.asarray(events, dtype=object)
+    has_text = ~pd.isna(events)
+    text[has_text] = events[has_text]
+    return text
+
+
+def format_value(value, event):
+    """
+    format_values для одной ячейки (показ в таблице).
+    :return: str
+    """
+    if not pd.isna(event):
+        return str(event)
+    if np.isnan(value):
+        return ""
+    if value == round(value) and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+def to_strings(df: pd.DataFrame):
+    """
+    Строковая таблица для записи в файл и журнал: колонки FILE_COLUMNS и прочие колонки файла.
+    :param df: pd.DataFrame из to_typed
+    :return: новый pd.DataFrame
+    """
+    strings = pd.DataFrame({
+        "DATE": dates.dates_from_epochs(df["EPOCH"].to_numpy(dtype=np.int64)).astype(object),
+        "TYPE": df["TYPE"].to_numpy(dtype=object),
+        "VALUE": format_values(df["VALUE"].to_numpy(dtype=float), df["EVENT"].to_numpy(dtype=object)),
+        "COMMENT": df["COMMENT"].to_numpy(dtype=object),
+    })
+    for column in display_columns(df)[len(FILE_COLUMNS):]:
+        strings[column] = df[column].to_numpy(dtype=object)
+    return strings
+
+
+def display_columns(df: pd.DataFrame):
+    """
+    :return: колонки таблицы в том виде, в котором они показываются и пишутся в файл
+    """
+    return list(FILE_COLUMNS) + [column for column in df.columns
+                                 if column not in FILE_COLUMNS and column not in INTERNAL_COLUMNS]
+
+
+def conform(df: pd.DataFrame, other: pd.DataFrame):
+    """
+    Приводит категории двух таблиц к общим, чтобы строки other можно было вставить в df без потери типа колонок:
+    недостающие категории дописываются в колонки df (на месте), other переводится на категории df. Колонка,
+    которая в df хранится строками (text_column), в other тоже переводится в строки.
+    :param df: pd.DataFrame из to_typed (меняется)
+    :param other: pd.DataFrame из to_typed с теми же колонками
+    :return: новый pd.DataFrame — other на категориях df
+    """
+    other = other.copy()
+    for column in df.columns:
+        if column not in other.columns:
+            continue
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            if isinstance(other[column].dtype, pd.CategoricalDtype):
+                other[column] = other[column].to_numpy(dtype=object)
+            continue
+        values = other[column].to_numpy(dtype=object)
+        known = df[column].cat.categories
+        extra = [value for value in pd.unique(values[~pd.isna(values)]) if value not in known]
+        if extra:
+            df[column] = df[column].cat.add_categories(extra)
+        other[column] = pd.Categorical(values, categories=df[column].cat.categories)
+    return other
+
+
+def concat(frames):
+    """
+    Склейка таблиц из to_typed с объединёнными категориями, без перехода колонок в object.
+    :param frames: непустой список pd.DataFrame с одинаковыми колонками
+    :return: pd.DataFrame (единственная таблица возвращается как есть)
+    """
+    if len(frames) == 1:
+        return frames[0]
+    if all(frame[column].dtype == frames[0][column].dtype for frame in frames[1:] for column in frames[0].columns):
+        # категории уже общие (обычно TYPE из TYPES)
+        return pd.concat(frames, ignore_index=True)
+    columns = dict()
+    for column in frames[0].columns:
+        parts = [frame[column] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            # категории объединяются в порядке появления, как при conform
+            columns[column] = union_categoricals([part.array for part in parts])
+        elif any(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            # часть кусков хранит колонку строками (text_column): вся колонка — строки
+            columns[column] = np.concatenate([part.to_numpy(dtype=object) for part in parts])
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def set_row(df: pd.DataFrame, row, record: pd.DataFrame):
+    """
+    Записывает строку record (один ряд из to_typed) на место строки row таблицы df.
+    :return:
+    """
+    record = conform(df, record)
+    for position, column in enumerate(df.columns):
+        if column in record.columns:
+            df.iat[row, position] = record[column].iat[0]
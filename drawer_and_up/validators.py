@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+# правила проверки VALUE по TYPE: (минимум, максимум, только целые); пустое значение допустимо. По ним проверяются
+# и поля ввода (popup.check_abstract_velocity, check_abstract_enoxa, check_abstract_infusion через check_value),
+# и таблицы целиком (bad_values, invalid_rows)
+VALUE_RULES = {
+    "Vtop": (0, 90, False),
+    "Vtail": (0, 90, False),
+    "Enoxa": (0, 3, False),
+    "RecEnoxa": (0, 3, False),
+    "Infusion": (None, None, True),
+    "RecInfusion": (None, None, True),
+}
+
+
+def numbers(values):
+    """
+    Векторный перевод строк в числа с заменой десятичной запятой.
+    :param values: последовательность строк
+    :return: np.ndarray float, NaN для пустых и неразбираемых значений
+    """
+    values = np.asarray(values, dtype=object)
+    parsed = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float, copy=True)
+    # запятая бывает редко (после загрузки VALUE уже приведено), поэтому заменяется только в неразобранных строках
+    retry = np.isnan(parsed)
+    if retry.any():
+        text = pd.Series(values[retry], dtype=object).str.replace(",", ".", regex=False)
+        parsed[retry] = pd.to_numeric(text, errors="coerce")
+    return parsed
+
+
+def integer_texts(values):
+    """
+    int() допускает пробелы и знак, но не запятую, точку и экспоненту, поэтому строки проверяются по кодам
+    символов, а не по разобранному числу.
+    :param values: np.ndarray строк (object), уже разобранных numbers как число
+    :return: маска строк, которые int() принимает
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    text = values.astype(str)
+    chars = text.view(np.uint32).reshape(len(text), -1)
+    return (((chars >= ord("0")) & (chars <= ord("9"))) | np.isin(chars, [0, ord(" "), ord("+"), ord("-")])
+            ).all(axis=1)
+
+
+def integer_types():
+    """
+    :return: список TYPE, значения которых по VALUE_RULES должны быть целыми
+    """
+    return [kind for kind, rule in VALUE_RULES.items() if rule[2]]
+
+
+def _check_unique(values, rule):
+    """
+    :param values: np.ndarray уникальных строк (object)
+    :param rule: значение VALUE_RULES
+    :return: маска допустимых значений
+    """
+    low, high, integer = rule
+    empty = values == ""
+    parsed = numbers(values)
+    if integer:
+        ok = ~np.isnan(parsed)
+        ok[ok] = integer_texts(values[ok])
+        return empty | ok
+    with np.errstate(invalid="ignore"):
+        return empty | (~np.isnan(parsed) & (parsed >= low) & (parsed <= high))
+
+
+def check_value(kind, text):
+    """
+    Проверка одного введённого значения по правилу VALUE_RULES для его типа.
+    :param kind: TYPE из VALUE_RULES
+    :param text: строка из поля ввода
+    :return: True, если значение пустое, число (int для целых типов), если оно проходит проверку, иначе False
+    """
+    if text == "":
+        return True
+    rule = VALUE_RULES[kind]
+    if not _check_unique(np.array([text], dtype=object), rule)[0]:
+        return False
+    return int(text) if rule[2] else float(numbers([text])[0])
+
+
+def bad_values(types, values):
+    """
+    Проверка значений по правилам VALUE_RULES для их типа. Каждое уникальное значение проверяется один раз,
+    строки с типами без правил (Event и неизвестные) считаются верными.
+    :param types: последовательность TYPE
+    :param values: последовательность VALUE той же длины (пропуск равен пустой строке)
+    :return: np.ndarray bool, True — значение не проходит проверку
+    """
+    type_codes, type_uniques = pd.factorize(np.asarray(types, dtype=object))
+    values = pd.Series(np.asarray(values, dtype=object), dtype=object).fillna("")
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    bad = np.zeros(len(type_codes), dtype=bool)
+    for type_code, kind in enumerate(type_uniques):
+        rule = VALUE_RULES.get(kind)
+        if rule is None:
+            continue
+        rows = type_codes == type_code
+        used = np.flatnonzero(np.bincount(codes[rows], minlength=len(uniques)))
+        bad_unique = np.zeros(len(uniques), dtype=bool)
+        bad_unique[used] = ~_check_unique(uniques[used], rule)
+        bad[rows] = bad_unique[codes[rows]]
+    return bad
+
+
+def invalid_rows(df: pd.DataFrame):
+    """
+    Проверка таблицы из typed.to_typed по тем же правилам: диапазон проверяется по числам VALUE. Текст (EVENT)
+    у типа с правилом — недопустимое значение; значение целого типа, которое int() не принимает (1e3, 12.0),
+    typed.split_values оставляет текстом, поэтому оно тоже недопустимо.
+    :param df: pd.DataFrame с колонками TYPE (категории), VALUE (float) и EVENT
+    :return: маска строк с недопустимыми значениями
+    """
+    type_codes = df["TYPE"].cat.codes.to_numpy()
+    values = df["VALUE"].to_numpy(dtype=float)
+    has_text = df["EVENT"].notna().to_numpy()
+    bad = np.zeros(len(df), dtype=bool)
+    for type_code, kind in enumerate(df["TYPE"].cat.categories):
+        rule = VALUE_RULES.get(kind)
+        if rule is None:
+            continue
+        rows = type_codes == type_code
+        low, high, integer = rule
+        if integer:
+            bad[rows] = has_text[rows]
+            continue
+        with np.errstate(invalid="ignore"):
+            wrong = (values < low) | (values > high)
+        # пустое значение (NaN без текста) допустимо
+        bad[rows] = has_text[rows] | (wrong[rows] & ~np.isnan(values[rows]))
+    return bad
@@ -0,0 +1,110 @@
+import sys
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def estimate_bytes(df: pd.DataFrame, sample=1000):
+    """
+    Оценка памяти, занятой таблицей. Размер строк в object-колонках оценивается по выборке, а не по всем значениям
+    (memory_usage(deep=True) обходит каждую строку); у категориальных колонок считаются строки категорий.
+    :param df: pd.DataFrame
+    :param sample: размер выборки на колонку
+    :return: число байт
+    """
+    total = int(df.memory_usage(index=True, deep=False).sum())
+    count = len(df)
+    if count == 0:
+        return total
+    positions = np.linspace(0, count - 1, min(sample, count)).astype(np.int64)
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            total += sum(sys.getsizeof(value) for value in df[column].cat.categories)
+        elif df[column].dtype == object or pd.api.types.is_string_dtype(df[column].dtype):
+            values = df[column].to_numpy()[positions]
+            total += int(np.mean([sys.getsizeof(value) for value in values]) * count)
+    return total
+
+
+class PatientState:
+    """
+    Всё, что нужно, чтобы снова показать пациента без чтения файла: FileHandler (с его несохранёнными изменениями),
+    приведённая таблица, массивы серий графика и индекс строк, а также выделение и видимый диапазон.
+    series_data = None означает, что массивы серий надо пересчитать.
+    """
+    def __init__(self, file_keeper, df, series_data=None, series_of_row=None, point_of_row=None,
+                 selected_rows=None, x_range=None):
+        self.file_keeper = file_keeper
+        self.df = df
+        self.series_data = series_data
+        self.series_of_row = series_of_row
+        self.point_of_row = point_of_row
+        self.selected_rows = list() if selected_rows is None else selected_rows
+        self.x_range = x_range
+        self.size = estimate_bytes(df)
+        if series_data is not None:
+            self.size += sum(array.nbytes for arrays in series_data.values() for array in arrays)
+            self.size += series_of_row.nbytes + point_of_row.nbytes
+
+    @property
+    def path(self):
+        return self.file_keeper.path
+
+    @property
+    def unsaved(self):
+        return not self.file_keeper.status_saved
+
+
+class Workspace:
+    """
+    LRU-кеш состояний открытых, но не показанных сейчас пациентов (PatientState), ограниченный по памяти.
+    При превышении бюджета выгружаются давно не открывавшиеся пациенты; пациенты с несохранёнными изменениями
+    не выгружаются никогда, так что бюджет может быть превышен на их размер.
+    """
+    def __init__(self, budget_mb):
+        self.budget = int(budget_mb * 2 ** 20)
+        self._states = OrderedDict()
+
+    def __contains__(self, path):
+        return path in self._states
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def states(self):
+        return list(self._states.values())
+
+    @property
+    def size(self):
+        return sum(state.size for state in self._states.values())
+
+    def put(self, state: PatientState):
+        """
+        Кладёт состояние как последнее использованное и выгружает лишнее.
+        :param state: PatientState
+        :return: список путей выгруженных пациентов
+        """
+        self._states[state.path] = state
+        self._states.move_to_end(state.path)
+        return self.trim()
+
+    def take(self, path):
+        """
+        :param path: путь файла пациента
+        :return: PatientState (удаляется из кеша, так как становится текущим) или None, если пациент выгружен
+        """
+        return self._states.pop(path, None)
+
+    def trim(self):
+        total = self.size
+        evicted = list()
+        for path, state in list(self._states.items()):
+            if total <= self.budget:
+                break
+            if state.unsaved:
+                continue
+            del self._states[path]
+            total -= state.size
+            evicted.append(path)
+        return evicted
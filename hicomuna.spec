@@ -8,10 +8,21 @@ a = Analysis(['main.py'],
              pathex=['C:\\no_russian\\resert'],
              binaries=[],
              datas=[('configs.json', '.'), ('example_data', './example_data/')],
-             hiddenimports=[],
+             # подмодули drawer_and_up импортируются лениво (__getattr__ в drawer_and_up/__init__.py), и анализ
+             # импортов их не видит: здесь должны быть все имена из drawer_and_up.__all__. openpyxl и xlrd pandas
+             # загружает только при первом чтении Excel
+             hiddenimports=['drawer_and_up.dates', 'drawer_and_up.popup', 'drawer_and_up.pyqtdrawer',
+                            'drawer_and_up.legend', 'drawer_and_up.database', 'drawer_and_up.filehandler',
+                            'drawer_and_up.tablemodel', 'drawer_and_up.loader', 'drawer_and_up.saver',
+                            'drawer_and_up.workspace', 'drawer_and_up.instrument', 'drawer_and_up.validators',
+                            'drawer_and_up.typed', 'drawer_and_up.settings', 'drawer_and_up.redraw',
+                            'drawer_and_up.paging', 'drawer_and_up.batch', 'drawer_and_up.synthetic',
+                            'drawer_and_up.benchmark', 'drawer_and_up.ingest', 'drawer_and_up.merge',
+                            'openpyxl', 'xlrd'],
              hookspath=[],
              runtime_hooks=[],
-             excludes=[],
+             # пакеты, которые программа не использует, но которые анализ тянет за pandas и pyqtgraph
+             excludes=['tkinter', 'matplotlib', 'IPython', 'scipy'],
              win_no_prefer_redirects=False,
              win_private_assemblies=False,
              cipher=block_cipher,
@@ -26,13 +37,14 @@ exe = EXE(pyz,
           debug=False,
           bootloader_ignore_signals=False,
           strip=False,
-          upx=True,
+          # сжатые UPX библиотеки распаковываются при каждом запуске, что заметно замедляет старт
+          upx=False,
           console=False , icon='other\\hico.ico')
 coll = COLLECT(exe,
                a.binaries,
                a.zipfiles,
                a.datas,
                strip=False,
-               upx=True,
+               upx=False,
                upx_exclude=[],
                name='hicomuna')
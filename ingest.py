@@ -0,0 +1,6 @@
+import sys
+from drawer_and_up import ingest
+
+
+if __name__ == '__main__':
+    sys.exit(ingest.main())
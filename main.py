@@ -1,13 +1,33 @@
 import sys
-import json
-import app_window
+import time
+# отсчёт времени запуска: от начала выполнения main.py, до импорта PyQt5 и пакета приложения (время старта
+# самого интерпретатора сюда не входит)
+START = time.perf_counter()
 from PyQt5 import QtWidgets as QtW
+import drawer_and_up
+from drawer_and_up import settings
 
 
 if __name__ == '__main__':
-    with open("configs.json", "r", encoding="utf-8") as cfg:
-        configs = json.load(cfg)
     app = QtW.QApplication(sys.argv)
     app.setStyle("Fusion")
-    ex = app_window.MainWindow(configs)
+    try:
+        configs = settings.load_config("configs.json")
+    except (OSError, ValueError) as e:
+        QtW.QMessageBox.critical(None, "Hicomuna", "Cannot read configs.json:\n{0}".format(e))
+        sys.exit(1)
+    # pandas и pyqtgraph загружаются в finish_ui, после первой отрисовки окна
+    import app_window
+    ex = app_window.MainWindow(configs, deferred=True)
+    app.processEvents()
+    shown = time.perf_counter()
+    ex.finish_ui()
+    ready = time.perf_counter()
+    startup = "window shown in {0:.0f} ms, ready in {1:.0f} ms".format((shown - START) * 1000,
+                                                                      (ready - START) * 1000)
+    if "--startup-time" in sys.argv[1:]:
+        print(startup)
+        sys.exit(0)
+    if drawer_and_up.instrument.recorder() is not None:
+        drawer_and_up.instrument.logger.info("startup: %s", startup)
     sys.exit(app.exec_())
@@ -0,0 +1,6 @@
+import sys
+from drawer_and_up import merge
+
+
+if __name__ == '__main__':
+    sys.exit(merge.main())